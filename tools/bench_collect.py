@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""가짜 YouTube 서버(tools/fake_youtube_server.py)를 상대로 댓글 수집 처리량/호출 수 비교.
+
+    python tools/fake_youtube_server.py --port 8765 &
+    python tools/bench_collect.py engines --videos 40 --fail 0.1
+    python tools/bench_collect.py plan --videos 60 --total 3000 --per-video 400
+    python tools/bench_collect.py store --videos 10 --grow 30 --mongomock
+
+앱 설정(.streamlit/secrets.toml)의 YT_API_BASE_URL이 가짜 서버를 가리켜야 함 (아니면 실제 쿼터를 쓰므로 중단).
+- engines: async / thread 엔진 각각 rows, 소요 시간, rows/s, API 호출 수 (--fail로 429/503 주입)
+- plan:    통계 기반 영상별 예산(plan_comment_budgets) 유무에 따른 커버 영상 수/호출 수
+- store:   영상별 댓글 저장소 첫 수집 → 서버에 새 스레드 추가(/_grow) → 재수집 호출 수
+           (Mongo 필요. --mongomock이면 mongomock으로 대신)
+"""
+import argparse
+import importlib.util
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+import requests
+
+APP_PATH = Path(__file__).resolve().parent.parent / "ytcc_chatbot.py"
+KEYS = ["bench-k1", "bench-k2"]
+
+
+def load_app():
+    spec = importlib.util.spec_from_file_location("ytcc_chatbot", APP_PATH)
+    app = importlib.util.module_from_spec(spec)
+    sys.modules["ytcc_chatbot"] = app
+    spec.loader.exec_module(app)
+    return app
+
+
+class NullProgress:
+    def progress(self, *a, **k):
+        pass
+
+    def empty(self):
+        pass
+
+
+class Bench:
+    def __init__(self, app, server: str):
+        self.app = app
+        self.server = server.rstrip("/")
+
+    def admin(self, path: str, **params) -> dict:
+        return requests.get(f"{self.server}/{path}", params=params, timeout=10).json()
+
+    def collect(self, engine, video_list, include_replies, total, per_video):
+        """엔진 하나로 수집 → (rows, 초, 서버 호출 수, 영상별 행 수)."""
+        self.app.YT_COLLECT_ENGINE = engine
+        self.admin("_reset")
+        t0 = time.time()
+        out_csv, rows = self.app.collect_comments_streaming(video_list, KEYS, include_replies, total, per_video,
+                                                            NullProgress())
+        elapsed = time.time() - t0
+        calls = self.admin("_stats")
+        per = pd.read_csv(out_csv).groupby("video_id").size() if rows else pd.Series(dtype=int)
+        return rows, elapsed, calls, per
+
+
+def video_list(n: int):
+    return [{"video_id": f"vid{i:07d}", "title": "t", "shortType": "Clip"} for i in range(n)]
+
+
+def run_engines(bench, args):
+    bench.app._comment_store_coll = lambda: None
+    bench.admin("_fail", p=args.fail)
+    try:
+        for engine in ("async", "thread"):
+            rows, sec, calls, _ = bench.collect(engine, video_list(args.videos), True, args.total, args.per_video)
+            print(f"{engine:6s} rows={rows:,} sec={sec:.1f} rows_per_sec={rows / max(sec, 1e-6):,.0f} "
+                  f"calls={calls['n']:,} by={calls['by']} injected_failures={calls['fail']}")
+    finally:
+        bench.admin("_fail", p=0)
+
+
+def run_plan(bench, args):
+    app = bench.app
+    app._comment_store_coll = lambda: None
+    stats = app.yt_video_statistics(app.RotatingYouTube(KEYS), [v["video_id"] for v in video_list(args.videos)])
+    print(f"videos={len(stats)} without_comments={sum(1 for r in stats if not r['commentCount'])}")
+    for engine in ("async", "thread"):
+        for mode in ("flat", "planned"):
+            vl = stats if mode == "flat" else app.plan_comment_budgets(stats, args.total, args.per_video)
+            rows, sec, calls, per = bench.collect(engine, vl, False, args.total, args.per_video)
+            print(f"{engine:6s} {mode:7s} rows={rows:,} covered_videos={len(per)} "
+                  f"per_video={per.min() if len(per) else 0}-{per.max() if len(per) else 0} calls={calls['n']}")
+
+
+def run_store(bench, args):
+    app = bench.app
+    if args.mongomock:
+        import mongomock
+        client = mongomock.MongoClient()
+        app._mongo_client = lambda: client
+    elif app._mongo_client() is None:
+        sys.exit("store: Mongo 설정이 없습니다 (--mongomock 사용)")
+    app.YT_COMMENT_STORE_ENABLED = True
+    vl = [v for v in video_list(args.videos * 2) if not v["video_id"].endswith("0")][:args.videos]
+    for label in ("first", "refresh"):
+        if label == "refresh":
+            bench.admin("_grow", n=args.grow)
+        rows, sec, calls, _ = bench.collect(args.engine, vl, True, args.total, args.per_video)
+        by = calls["by"]
+        print(f"{label:7s} rows={rows:,} sec={sec:.1f} commentThreads={by.get('commentThreads', 0)} "
+              f"comments={by.get('comments', 0)}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("scenario", choices=("engines", "plan", "store"))
+    ap.add_argument("--server", default="http://127.0.0.1:8765")
+    ap.add_argument("--videos", type=int, default=40)
+    ap.add_argument("--total", type=int, default=120_000, help="max_total_comments")
+    ap.add_argument("--per-video", type=int, default=4_000, help="max_per_video")
+    ap.add_argument("--fail", type=float, default=0.0, help="engines: 실패 주입 비율")
+    ap.add_argument("--grow", type=int, default=30, help="store: 재수집 전에 영상마다 추가할 새 스레드 수")
+    ap.add_argument("--engine", choices=("async", "thread"), default="async", help="store에서 쓸 엔진")
+    ap.add_argument("--mongomock", action="store_true")
+    args = ap.parse_args()
+
+    app = load_app()
+    if not app.YT_API_BASE_URL.startswith(args.server.rstrip("/")):
+        sys.exit(f"YT_API_BASE_URL={app.YT_API_BASE_URL} 이 가짜 서버({args.server})가 아닙니다. "
+                 f"secrets.toml에 YT_API_BASE_URL = \"{args.server}/youtube/v3\" 설정 후 실행하세요.")
+    bench = Bench(app, args.server)
+    {"engines": run_engines, "plan": run_plan, "store": run_store}[args.scenario](bench, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""로컬 가짜 YouTube Data API v3 서버 (수집 엔진 테스트/처리량 비교용, 실제 쿼터를 쓰지 않음).
+
+    python tools/fake_youtube_server.py --port 8765 --latency 0.05
+
+앱 쪽은 .streamlit/secrets.toml에 다음을 넣으면 두 엔진(googleapiclient / aiohttp)이 모두 이 서버로 감:
+    YT_API_BASE_URL = "http://127.0.0.1:8765/youtube/v3"
+
+- commentThreads / comments / videos / search 만 흉내냄 (키는 검사하지 않음)
+- 영상별 댓글 수는 video_id 해시로 고정 (실행마다 같은 데이터). '0'으로 끝나는 ID는 댓글 없음
+- 스레드마다 답글 0~6개, 그중 최대 5개만 replies.comments로 인라인 (나머지는 comments.list로 펼쳐야 함)
+- 관리용: /_stats (호출 수), /_reset (호출 수 초기화), /_grow?n=10 (댓글 있는 영상마다 새 스레드 n개 추가),
+          /_fail?p=0.1 (요청의 p 비율을 절반은 429 rateLimitExceeded, 절반은 503으로 실패)
+"""
+import argparse
+import asyncio
+import random
+import zlib
+from datetime import datetime, timedelta
+
+from aiohttp import web
+
+INLINE_REPLIES = 5
+
+
+class FakeYouTube:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = {"n": 0, "by": {}, "fail": 0}
+        self.grow = 0
+        self.fail_p = 0.0
+
+    @staticmethod
+    def threads_of(video_id: str) -> int:
+        if video_id.endswith("0"):
+            return 0
+        return (zlib.crc32(video_id.encode("utf-8")) % 5) * 150
+
+    def _n_threads(self, video_id: str) -> int:
+        n = self.threads_of(video_id)
+        return n + self.grow if n else 0
+
+    async def _enter(self, name: str, latency: float = None):
+        """실패 주입 → 응답(에러) 반환, 아니면 지연 후 호출 수 기록하고 None."""
+        r = random.random()
+        if r < self.fail_p:
+            self.calls["fail"] += 1
+            if r < self.fail_p / 2:
+                return web.json_response({"error": {"code": 429, "errors": [{"reason": "rateLimitExceeded"}]}},
+                                         status=429, headers={"Retry-After": "0"})
+            return web.json_response({"error": {"code": 503, "message": "backendError"}}, status=503)
+        await asyncio.sleep(self.latency if latency is None else latency)
+        self.calls["n"] += 1
+        self.calls["by"][name] = self.calls["by"].get(name, 0) + 1
+        return None
+
+    @staticmethod
+    def _stamp(i: int) -> str:
+        return (datetime(2025, 12, 1) + timedelta(minutes=i)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    @staticmethod
+    def _reply(comment_id: str, j: int) -> dict:
+        return {"id": comment_id, "snippet": {"authorDisplayName": "u", "textDisplay": f"reply {j}",
+                                              "publishedAt": f"2025-12-{1 + j % 28:02d}T{j % 24:02d}:00:00Z",
+                                              "likeCount": j}}
+
+    async def comment_threads(self, req):
+        if (err := await self._enter("commentThreads")) is not None:
+            return err
+        q = req.query
+        vid = q["videoId"]
+        start = int(q.get("pageToken") or 0)
+        page = int(q.get("maxResults", 20))
+        n = self._n_threads(vid)
+        items = []
+        for k in range(start, min(n, start + page)):
+            i = n - 1 - k   # order=time: 최신(큰 번호) 스레드부터
+            rc = i % 7
+            item = {"snippet": {
+                "topLevelComment": {"id": f"{vid}.c{i}", "snippet": {
+                    "authorDisplayName": f"a{i}", "textDisplay": f"comment {i} 정말 재밌다",
+                    "publishedAt": self._stamp(i), "likeCount": i % 13}},
+                "totalReplyCount": rc}}
+            if rc:
+                item["replies"] = {"comments": [self._reply(f"{vid}.r{i}.{j}", j)
+                                                for j in range(min(rc, INLINE_REPLIES))]}
+            items.append(item)
+        body = {"items": items}
+        if start + page < n:
+            body["nextPageToken"] = str(start + page)
+        return web.json_response(body)
+
+    async def comments(self, req):
+        if (err := await self._enter("comments")) is not None:
+            return err
+        pid = req.query["parentId"]
+        rc = int(pid.split(".c")[1]) % 7
+        return web.json_response({"items": [self._reply(f"{pid}.x{j}", j) for j in range(rc)]})
+
+    async def videos(self, req):
+        if (err := await self._enter("videos")) is not None:
+            return err
+        items = []
+        for vid in req.query["id"].split(","):
+            h = zlib.crc32(vid.encode("utf-8"))
+            items.append({
+                "id": vid,
+                "snippet": {"title": f"t {vid}", "channelTitle": "ch", "publishedAt": "2025-12-01T00:00:00Z"},
+                "statistics": {"viewCount": str(1000 + h % 10000), "likeCount": "5",
+                               "commentCount": str(self._n_threads(vid))},
+                "contentDetails": {"duration": "PT1M30S"},
+            })
+        return web.json_response({"items": items})
+
+    async def search(self, req):
+        if (err := await self._enter("search", self.latency * 4)) is not None:
+            return err
+        q = req.query
+        start = int(q.get("pageToken") or 0)
+        page = int(q.get("maxResults", 5))
+        base = zlib.crc32(q.get("q", "").encode("utf-8")) % 1000
+        body = {"items": [{"id": {"videoId": f"v{base:04d}{i:06d}"}} for i in range(start, start + page)]}
+        if start + page < 100:
+            body["nextPageToken"] = str(start + page)
+        return web.json_response(body)
+
+    async def admin_stats(self, req):
+        return web.json_response(self.calls)
+
+    async def admin_reset(self, req):
+        self.calls = {"n": 0, "by": {}, "fail": 0}
+        return web.json_response(self.calls)
+
+    async def admin_grow(self, req):
+        self.grow += int(req.query.get("n", 10))
+        return web.json_response({"grow": self.grow})
+
+    async def admin_fail(self, req):
+        self.fail_p = float(req.query.get("p", 0))
+        return web.json_response({"p": self.fail_p})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/youtube/v3/commentThreads", self.comment_threads)
+        app.router.add_get("/youtube/v3/comments", self.comments)
+        app.router.add_get("/youtube/v3/videos", self.videos)
+        app.router.add_get("/youtube/v3/search", self.search)
+        app.router.add_get("/_stats", self.admin_stats)
+        app.router.add_get("/_reset", self.admin_reset)
+        app.router.add_get("/_grow", self.admin_grow)
+        app.router.add_get("/_fail", self.admin_fail)
+        return app
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.05, help="요청당 지연(초), search는 4배")
+    args = ap.parse_args()
+    print(f"fake YouTube API on http://127.0.0.1:{args.port}/youtube/v3 (latency {args.latency}s)")
+    web.run_app(FakeYouTube(args.latency).app(), host="127.0.0.1", port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
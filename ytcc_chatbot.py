@@ -4,24 +4,33 @@ from io import BytesIO
 from functools import lru_cache
 
 import pandas as pd
+import numpy as np
 import os
 import re
 import gc
+import math
 import time
 import json
 import base64
 import gzip
 import requests
 from datetime import datetime, timedelta, timezone
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from uuid import uuid4
 import io
+import csv
+import queue
 import threading
+import asyncio
+from collections import OrderedDict, deque
 
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
 from google.generativeai import caching  
+from google.generativeai.types import GenerateContentResponse
+from google.api_core.exceptions import from_grpc_error
+from google.api_core.gapic_v1 import routing_header
+import grpc
 from streamlit.components.v1 import html as st_html
 
 # Optional: browser storage bridge (used for login persistence without URL params)
@@ -32,6 +41,22 @@ except Exception:
     streamlit_js_eval = None
     _SJE_AVAILABLE = False
 
+# Optional: asyncio 기반 댓글 수집 엔진 (없으면 ThreadPool 경로로 fallback)
+try:
+    import aiohttp  # pip: aiohttp
+    _AIOHTTP_AVAILABLE = True
+except Exception:
+    aiohttp = None
+    _AIOHTTP_AVAILABLE = False
+
+# Optional: 빠른 JSON 디코딩 (없으면 표준 json)
+try:
+    import orjson  # pip: orjson
+    _ORJSON_AVAILABLE = True
+except Exception:
+    orjson = None
+    _ORJSON_AVAILABLE = False
+
 import pymongo
 from pymongo import MongoClient
 import certifi
@@ -92,6 +117,11 @@ def load_first_turn_system_prompt() -> str:
 
 
 KST = timezone(timedelta(hours=9))
+try:
+    from zoneinfo import ZoneInfo
+    PT = ZoneInfo("America/Los_Angeles")  # YouTube Data API 일일 쿼터 리셋 기준
+except Exception:
+    PT = timezone(timedelta(hours=-8))
 
 def now_kst() -> datetime:
     return datetime.now(tz=KST)
@@ -105,6 +135,13 @@ def kst_to_rfc3339_utc(dt_kst: datetime) -> str:
     if dt_kst.tzinfo is None:
         dt_kst = dt_kst.replace(tzinfo=KST)
     return dt_kst.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+def pt_quota_day(now: datetime = None) -> str:
+    return (now or datetime.now(tz=PT)).astimezone(PT).strftime("%Y-%m-%d")
+
+def next_pt_midnight(now: datetime = None) -> datetime:
+    now = (now or datetime.now(tz=PT)).astimezone(PT)
+    return datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=PT)
 # endregion
 
 
@@ -300,35 +337,328 @@ MAX_TOTAL_COMMENTS   = 120_000
 MAX_COMMENTS_PER_VID = 4_000
 CACHE_TTL_MINUTES    = 20 
 
-# Gemini 동시 호출 제한
+# YouTube 댓글 수집 엔진
+# - YT_COLLECT_ENGINE: "async"(aiohttp, 기본) | "thread"(기존 ThreadPoolExecutor 경로)
+# - YT_API_BASE_URL: 로컬 가짜 YouTube 서버로 돌려서 테스트/벤치마크할 때만 변경
+#   (tools/fake_youtube_server.py + tools/bench_collect.py)
+YT_API_BASE_URL = str(st.secrets.get("YT_API_BASE_URL", "") or "https://youtube.googleapis.com/youtube/v3").rstrip("/")
+YT_COLLECT_ENGINE = str(st.secrets.get("YT_COLLECT_ENGINE", "async") or "async").strip().lower()
+YT_ASYNC_MAX_INFLIGHT = max(1, int(st.secrets.get("YT_ASYNC_MAX_INFLIGHT", 32) or 32))
+YT_ASYNC_MAX_INFLIGHT_PER_KEY = max(1, int(st.secrets.get("YT_ASYNC_MAX_INFLIGHT_PER_KEY", 8) or 8))
+YT_HTTP_TIMEOUT_SEC = int(st.secrets.get("YT_HTTP_TIMEOUT_SEC", 30) or 30)
+YT_HTTP_POOL_SIZE = max(4, int(st.secrets.get("YT_HTTP_POOL_SIZE", 64) or 64))
+YT_REPLY_EXPAND_WORKERS = max(1, int(st.secrets.get("YT_REPLY_EXPAND_WORKERS", 16) or 16))
+
+# search.list 결과 캐시: 기간 경계를 버킷(분) 단위로 맞춰서 "최근 24시간 X" 같은 반복 질의를 같은 키로 묶음
+YT_SEARCH_CACHE_BUCKET_MIN = max(1, int(st.secrets.get("YT_SEARCH_CACHE_BUCKET_MIN", 60) or 60))
+YT_SEARCH_CACHE_TTL_MIN = max(1, int(st.secrets.get("YT_SEARCH_CACHE_TTL_MIN", YT_SEARCH_CACHE_BUCKET_MIN) or YT_SEARCH_CACHE_BUCKET_MIN))
+
+# videos.list 통계 캐시 TTL / 세션 간 요청 합치기 대기창
+YT_STATS_CACHE_TTL_SEC = int(st.secrets.get("YT_STATS_CACHE_TTL_SEC", 600) or 600)
+YT_STATS_BATCH_WINDOW_SEC = float(st.secrets.get("YT_STATS_BATCH_WINDOW_SEC", 0.05) or 0.05)
+YT_STATS_CACHE_MAX_ITEMS = 20000   # 영상 통계 캐시 상한 (LRU, 넘치면 오래 안 쓴 영상부터)
+
+# 영상별 댓글 저장소 (Mongo). 이 시간보다 오래된 항목은 좋아요 수 등이 낡았으니 전체 재수집
+YT_COMMENT_STORE_ENABLED = bool(st.secrets.get("YT_COMMENT_STORE_ENABLED", True))
+YT_COMMENT_STORE_MAX_AGE_HOURS = int(st.secrets.get("YT_COMMENT_STORE_MAX_AGE_HOURS", 72) or 72)
+
+# 1차 분석 백그라운드 잡: 하트비트가 끊긴 잡은 다른 프로세스/레플리카가 이어받아 재개
+FIRST_TURN_JOB_HEARTBEAT_SEC = 5
+FIRST_TURN_JOB_STALE_SEC = max(15, int(st.secrets.get("FIRST_TURN_JOB_STALE_SEC", 30) or 30))
+FIRST_TURN_JOB_TTL_HOURS = 24
+
+# 같은 조건(키워드·기간 버킷·답글 여부·자사 IP 모드)의 1차 수집은 한 번만 돌리고 결과 CSV를 공유
+# - 다른 레플리카와는 Mongo lease로 조율 (lease가 끊기면 다른 쪽이 이어받음)
+# - 끝난 수집도 COLLECT_FLIGHT_REUSE_MIN 동안은 그대로 재사용
+COLLECT_FLIGHT_LEASE_SEC = 60
+COLLECT_FLIGHT_REUSE_MIN = max(0, int(st.secrets.get("COLLECT_FLIGHT_REUSE_MIN", 10) or 10))
+
+# YouTube 쿼터 (키당 일일 units, 호출 종류별 비용)
+YT_DAILY_QUOTA_UNITS = int(st.secrets.get("YT_DAILY_QUOTA_UNITS", 10_000) or 10_000)
+YT_QUOTA_COST = {"search.list": 100, "videos.list": 1, "commentThreads.list": 1, "comments.list": 1}
+
+# YouTube 호출 속도 제어 (RotatingYouTube.execute / async 엔진 공통)
+# - 키별 토큰 버킷(초당 요청 수/버스트), AIMD 동시성 한도, 429/5xx 지수 백오프(+지터, Retry-After 우선)
+YT_KEY_RPS = float(st.secrets.get("YT_KEY_RPS", 100) or 100)
+YT_KEY_BURST = float(st.secrets.get("YT_KEY_BURST", 100) or 100)
+YT_AIMD_MIN, YT_AIMD_START, YT_AIMD_MAX = 2, 16, int(st.secrets.get("YT_AIMD_MAX", 64) or 64)
+YT_MAX_RETRIES = int(st.secrets.get("YT_MAX_RETRIES", 5) or 5)
+YT_BACKOFF_BASE_SEC, YT_BACKOFF_MAX_SEC = 0.5, 30.0
+
+# Gemini 동시 호출 제한 (레플리카 전체 합계, Mongo 슬롯 lease로 조율)
+# - 대기열 순서: 우선순위(해석 > 후속 질문 > 1차 보고서) → 사용자별 차례(한 사람이 몰아서 못 막게) → 도착 순
 MAX_GEMINI_INFLIGHT = max(1, int(st.secrets.get("MAX_GEMINI_INFLIGHT", 3) or 3))
 GEMINI_INFLIGHT_WAIT_SEC = int(st.secrets.get("GEMINI_INFLIGHT_WAIT_SEC", 120) or 120)
+GEMINI_PRIO_LIGHT, GEMINI_PRIO_FOLLOWUP, GEMINI_PRIO_REPORT = 0, 1, 2
+GEMINI_SLOT_LEASE_SEC = 30
+GEMINI_SLOT_POLL_SEC = 0.25
+
+# Gemini 컨텍스트 캐시(CachedContent) 공유: TTL은 만료가 이만큼 남았을 때만 연장,
+# 아무 세션도 안 쓰는 캐시는 이 시간만큼 놀면 삭제 (남은 TTL만큼 보관 비용이 드니까)
+GEMINI_CACHE_REFRESH_MARGIN_MIN = 5
+# 429/quota를 맞은 Gemini 키는 모든 세션에서 잠시 제외 (연속으로 맞으면 2배씩, 최대 GEMINI_KEY_COOLDOWN_MAX_SEC)
+GEMINI_KEY_COOLDOWN_SEC = int(st.secrets.get("GEMINI_KEY_COOLDOWN_SEC", 60) or 60)
+GEMINI_KEY_COOLDOWN_MAX_SEC = 15 * 60
+GEMINI_CACHE_IDLE_EVICT_SEC = int(st.secrets.get("GEMINI_CACHE_IDLE_EVICT_SEC", 300) or 300)
+
+# Gemini 요청 hedging (기본 꺼짐, secrets로 켬): 첫 응답(첫 청크)이 호출 종류별 p95보다 늦으면 다른 키로 같은 요청을 하나 더 보내고 먼저 온 쪽 채택
+# - 중복 요청도 대기열 슬롯을 하나 씀 (빈 슬롯이 없으면 hedge 안 함)
+# - 최근 GEMINI_HEDGE_WINDOW건 중 hedge 비율이 GEMINI_HEDGE_MAX_RATE를 넘지 않게 제한
+# - 표본이 GEMINI_HEDGE_MIN_SAMPLES개 모이기 전에는 GEMINI_HEDGE_DEFAULT_SEC 기준
+GEMINI_HEDGE_ENABLED = bool(st.secrets.get("GEMINI_HEDGE_ENABLED", False))
+GEMINI_HEDGE_MAX_RATE = float(st.secrets.get("GEMINI_HEDGE_MAX_RATE", 0.05) or 0.05)
+GEMINI_HEDGE_DEFAULT_SEC = float(st.secrets.get("GEMINI_HEDGE_DEFAULT_SEC", 30) or 30)
+GEMINI_HEDGE_MIN_SEC = 2.0
+GEMINI_HEDGE_MIN_SAMPLES = 20
+GEMINI_HEDGE_WINDOW = 200
+
+# 토큰 예산 (한국어 댓글 기준 오프라인 추정치 → TokenEstimator, count_tokens 왕복 없음)
+# - LLM_SAMPLE_TOKEN_BUDGET: 1차 보고서 입력 샘플을 이 토큰 수까지 채움 (인기댓글 먼저, 남는 예산은 랜덤 댓글)
+# - GEMINI_CACHE_MIN_TOKENS: 컨텍스트가 이보다 짧으면 CachedContent를 만들지 않고 인라인으로 보냄
+#   (모델 최소 캐시 크기 미만이면 생성 요청이 실패만 하고, 짧은 컨텍스트는 캐시 보관비가 더 듦)
+LLM_SAMPLE_TOKEN_BUDGET = int(st.secrets.get("LLM_SAMPLE_TOKEN_BUDGET", 120_000) or 120_000)
+GEMINI_CACHE_MIN_TOKENS = int(st.secrets.get("GEMINI_CACHE_MIN_TOKENS", 4096) or 4096)
+
+# Gemini 스트리밍 응답을 채팅 말풍선에 다시 그리는 최소 간격 (청크마다 그리면 웹소켓이 밀림)
+GEMINI_STREAM_RENDER_SEC = float(st.secrets.get("GEMINI_STREAM_RENDER_SEC", 0.15) or 0.15)
+
+# 후속 질문 답변 캐시: 같은 컨텍스트에 같은 질문이면 Gemini를 부르지 않고 바로 답변 (메모리 LRU → Mongo TTL)
+FOLLOWUP_ANSWER_CACHE_ENABLED = bool(st.secrets.get("FOLLOWUP_ANSWER_CACHE_ENABLED", True))
+FOLLOWUP_ANSWER_CACHE_TTL_HOURS = int(st.secrets.get("FOLLOWUP_ANSWER_CACHE_TTL_HOURS", 72) or 72)
+FOLLOWUP_ANSWER_CACHE_MEM_ITEMS = 512
+
+# 후속 질문 payload 압축: 최근 FOLLOWUP_RECENT_MESSAGES개만 평문(HTML 제거)으로, 그 앞은 rolling 요약으로
+# - 창 밖으로 밀린 메시지가 FOLLOWUP_SUMMARY_BATCH개 쌓이면 요약에 접어 넣음 (매 턴 요약 호출하지 않게)
+FOLLOWUP_RECENT_MESSAGES = 4
+FOLLOWUP_SUMMARY_BATCH = 4
+FOLLOWUP_MESSAGE_MAX_TOKENS = 1500     # 최근 메시지 하나당 (첫 보고서가 제일 김)
+FOLLOWUP_SUMMARY_MAX_TOKENS = 1000
+
+# 후속 질문 근거 검색: 수집한 댓글 전체로 세션별 BM25 인덱스(kiwipiepy 형태소)를 수집 직후 백그라운드로 만들고,
+# 질문마다 상위 COMMENT_INDEX_TOP_K개 댓글을 payload에 붙임 (캐시 샘플 2,000줄 밖의 댓글도 인용 가능)
+COMMENT_INDEX_ENABLED = bool(st.secrets.get("COMMENT_INDEX_ENABLED", True))
+COMMENT_INDEX_TOP_K = int(st.secrets.get("COMMENT_INDEX_TOP_K", 30) or 30)
+COMMENT_INDEX_MAX_SESSIONS = 8          # 프로세스에 들고 있을 인덱스 수 (LRU, 12만 댓글 기준 수십 MB)
+COMMENT_INDEX_KIWI_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+# 첫 질문 해석(LIGHT_PROMPT)을 규칙 기반으로 먼저 시도 → 기간 1개 + 키워드 1개가 확실할 때만 Gemini 생략
+LIGHT_LOCAL_PARSE_ENABLED = bool(st.secrets.get("LIGHT_LOCAL_PARSE_ENABLED", True))
+
+# 전체 댓글 모드(토글): 샘플 대신 수집한 댓글 전부를 청크로 나눠 부분 요약(map) → 모아서 1차 보고서(reduce)
+# - FULL_CORPUS_SPLIT: "video"(영상별로 묶음) | "time"(작성 시각순, 날짜 단위)
+# - 부분 요약이 FULL_CORPUS_REDUCE_MAX_TOKENS를 넘으면 한 번 더 접어서(combine) 보고서 입력에 넣음
+FULL_CORPUS_SPLIT = str(st.secrets.get("FULL_CORPUS_SPLIT", "video") or "video").strip().lower()
+FULL_CORPUS_CHUNK_TOKENS = int(st.secrets.get("FULL_CORPUS_CHUNK_TOKENS", 180_000) or 180_000)
+FULL_CORPUS_REDUCE_MAX_TOKENS = int(st.secrets.get("FULL_CORPUS_REDUCE_MAX_TOKENS", 120_000) or 120_000)
+FULL_CORPUS_MAP_MAX_TOKENS = 2048
 
-_GEMINI_SEM = threading.BoundedSemaphore(MAX_GEMINI_INFLIGHT)
 _GEMINI_TLOCAL = threading.local()
 
+
+class gemini_request_context:
+    """이 스레드에서 나가는 Gemini 호출의 대기열 정보 (우선순위, 사용자, 대기 콜백 on_wait(순번, 예상 대기초)).
+    call_gemini_* 인자로 일일이 넘기지 않고 호출부에서 with로 감쌈."""
+    def __init__(self, priority=GEMINI_PRIO_REPORT, user_id=None, on_wait=None):
+        self.ctx = {"priority": int(priority), "user_id": user_id or "anon", "on_wait": on_wait}
+
+    def __enter__(self):
+        self.prev = getattr(_GEMINI_TLOCAL, "ctx", None)
+        _GEMINI_TLOCAL.ctx = self.ctx
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _GEMINI_TLOCAL.ctx = self.prev
+        return False
+
+
+class _GeminiWaiter:
+    __slots__ = ("order", "priority", "user_id")
+
+    def __init__(self, order, priority, user_id):
+        self.order, self.priority, self.user_id = order, priority, user_id
+
+
+class GeminiAdmission:
+    """프로세스 전역 Gemini 입장 스케줄러 (기존 BoundedSemaphore 0.2초 폴링 대체).
+    - 로컬 대기열은 (우선순위, 사용자별 차례, 도착 순)으로 정렬, 맨 앞만 슬롯을 시도
+    - 슬롯은 Mongo ytcc_gemini_slots의 lease 문서 (MAX_GEMINI_INFLIGHT개). 잡고 있는 동안 주기적으로 연장,
+      프로세스가 죽으면 GEMINI_SLOT_LEASE_SEC 뒤 다른 레플리카가 가져감. Mongo가 없으면 프로세스 안에서만 제한
+    - 평균 점유 시간(EWMA, 우선순위별)으로 예상 대기 시간 계산"""
+    def __init__(self, capacity: int = MAX_GEMINI_INFLIGHT):
+        self.capacity = max(1, int(capacity))
+        self._cv = threading.Condition()
+        self._waiting = []    # _GeminiWaiter, order 오름차순
+        self._seq = 0
+        self._inflight = 0
+        self._held = {}       # Mongo 슬롯 id -> holder 토큰
+        self._avg_hold = {GEMINI_PRIO_LIGHT: 3.0, GEMINI_PRIO_FOLLOWUP: 15.0, GEMINI_PRIO_REPORT: 60.0}
+        self._slots_ready = False
+        self._renewer = None
+
+    def _coll(self):
+        try:
+            coll = _mongo_aux_coll("gemini_slots_coll", "ytcc_gemini_slots")
+        except Exception:
+            return None
+        if coll is not None and not self._slots_ready:
+            try:
+                for i in range(self.capacity):
+                    coll.update_one({"_id": f"slot-{i}"},
+                                    {"$setOnInsert": {"holder": None, "leaseUntil": datetime(1970, 1, 1)}}, upsert=True)
+                self._slots_ready = True
+            except Exception as e:
+                print(f"⚠️ [gemini admission] slot init failed: {e}")
+                return None
+        return coll
+
+    def _claim_slot(self):
+        """레플리카 공용 슬롯 하나를 lease로 잡음. 슬롯 id / ""(Mongo 없음 → 로컬 제한만) / None(전부 사용 중)."""
+        coll = self._coll()
+        if coll is None:
+            return ""
+        token = uuid4().hex
+        now = datetime.utcnow()
+        try:
+            doc = coll.find_one_and_update(
+                {"_id": {"$in": [f"slot-{i}" for i in range(self.capacity)]}, "leaseUntil": {"$lt": now}},
+                {"$set": {"holder": token, "leaseUntil": now + timedelta(seconds=GEMINI_SLOT_LEASE_SEC)}})
+        except Exception as e:
+            print(f"⚠️ [gemini admission] slot claim failed, local limit only: {e}")
+            return ""
+        if not doc:
+            return None
+        with self._cv:
+            self._held[doc["_id"]] = token
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew, name="gemini-slot-lease", daemon=True)
+                self._renewer.start()
+        return doc["_id"]
+
+    def _renew(self):
+        while True:
+            time.sleep(GEMINI_SLOT_LEASE_SEC / 3)
+            with self._cv:
+                held = dict(self._held)
+                if not held:
+                    self._renewer = None
+                    return
+            coll = self._coll()
+            for slot, token in held.items():
+                try:
+                    coll.update_one({"_id": slot, "holder": token}, {"$set": {
+                        "leaseUntil": datetime.utcnow() + timedelta(seconds=GEMINI_SLOT_LEASE_SEC)}})
+                except Exception as e:
+                    print(f"⚠️ [gemini admission] lease renew failed: {e}")
+
+    def _eta(self, pos: int) -> float:
+        ahead = self._waiting[:pos]
+        busy = sum(self._avg_hold[w.priority] for w in ahead) + self._inflight * self._avg_hold[GEMINI_PRIO_FOLLOWUP] / 2
+        return busy / self.capacity
+
+    def acquire(self, priority=GEMINI_PRIO_REPORT, user_id="anon", wait_sec=GEMINI_INFLIGHT_WAIT_SEC, on_wait=None):
+        """입장할 때까지 대기 후 ticket 반환 (release에 넘김). 순번이 바뀔 때마다 on_wait(순번, 예상 대기초)."""
+        deadline = time.time() + max(0, wait_sec)
+        with self._cv:
+            turn = sum(1 for w in self._waiting if w.user_id == user_id and w.priority == priority)
+            self._seq += 1
+            waiter = _GeminiWaiter((priority, turn, self._seq), priority, user_id)
+            self._waiting.append(waiter)
+            self._waiting.sort(key=lambda w: w.order)
+        last_pos, t0 = None, time.time()
+        try:
+            while True:
+                with self._cv:
+                    head = self._waiting[0] is waiter
+                    claim = head and self._inflight < self.capacity
+                    if claim:
+                        self._inflight += 1   # Mongo 슬롯을 잡는 동안 로컬 자리를 맡아 둠
+                if claim:
+                    # Mongo 왕복은 조건 락 밖에서 (그동안 다른 스레드의 release/대기열 갱신이 막히지 않게)
+                    slot = None
+                    try:
+                        slot = self._claim_slot()
+                    finally:
+                        with self._cv:
+                            if slot is None:
+                                self._inflight -= 1
+                            else:
+                                self._waiting.remove(waiter)
+                            self._cv.notify_all()
+                    if slot is not None:
+                        waited = time.time() - t0
+                        if waited > 1:
+                            print(f"[METRICS] gemini_admission waited_sec={waited:.1f} priority={priority}")
+                        break
+                with self._cv:
+                    head = self._waiting[0] is waiter
+                    pos = self._waiting.index(waiter) + 1
+                    if on_wait is None or pos == last_pos:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise TimeoutError("GEMINI_INFLIGHT_TIMEOUT")
+                        # 맨 앞인데 다른 레플리카가 슬롯을 다 쥐고 있으면 짧게 폴링, 아니면 release 알림을 기다림
+                        self._cv.wait(min(GEMINI_SLOT_POLL_SEC if head else 1.0, remaining))
+                        continue
+                    eta = self._eta(pos - 1)
+                last_pos = pos
+                try:
+                    on_wait(pos, eta)
+                except Exception:
+                    pass
+        finally:
+            with self._cv:
+                if waiter in self._waiting:
+                    self._waiting.remove(waiter)
+                    self._cv.notify_all()
+        if last_pos is not None:
+            try:
+                on_wait(0, 0.0)   # 대기 끝 (입장)
+            except Exception:
+                pass
+        return {"slot": slot, "priority": priority, "started": time.time()}
+
+    def release(self, ticket):
+        held = time.time() - ticket["started"]
+        with self._cv:
+            self._inflight = max(0, self._inflight - 1)
+            p = ticket["priority"]
+            self._avg_hold[p] = 0.8 * self._avg_hold[p] + 0.2 * held
+            token = self._held.pop(ticket["slot"], None) if ticket["slot"] else None
+            self._cv.notify_all()
+        if token:
+            try:
+                self._coll().update_one({"_id": ticket["slot"], "holder": token},
+                                        {"$set": {"holder": None, "leaseUntil": datetime(1970, 1, 1)}})
+            except Exception as e:
+                print(f"⚠️ [gemini admission] slot release failed: {e}")
+
+
+@st.cache_resource
+def get_gemini_admission() -> GeminiAdmission:
+    return GeminiAdmission()
+
+
 class GeminiInflightSlot:
+    """Gemini 호출 1건의 입장권. 우선순위/사용자/대기 콜백은 gemini_request_context에서 가져옴.
+    같은 스레드에서 중첩되면 바깥 슬롯을 그대로 씀."""
     def __init__(self, wait_sec: int = None):
         self.wait_sec = GEMINI_INFLIGHT_WAIT_SEC if wait_sec is None else int(wait_sec)
-        self.acquired = False
+        self.ticket = None
 
     def __enter__(self):
         if getattr(_GEMINI_TLOCAL, "held", False):
             return self
-
-        deadline = time.time() + max(0, self.wait_sec)
-        while True:
-            if _GEMINI_SEM.acquire(timeout=0.2):
-                self.acquired = True
-                _GEMINI_TLOCAL.held = True
-                return self
-            if time.time() >= deadline:
-                raise TimeoutError("GEMINI_INFLIGHT_TIMEOUT")
+        ctx = getattr(_GEMINI_TLOCAL, "ctx", None) or {}
+        self.ticket = get_gemini_admission().acquire(
+            priority=ctx.get("priority", GEMINI_PRIO_REPORT), user_id=ctx.get("user_id", "anon"),
+            wait_sec=self.wait_sec, on_wait=ctx.get("on_wait"))
+        _GEMINI_TLOCAL.held = True
+        return self
 
     def __exit__(self, exc_type, exc, tb):
-        if self.acquired:
+        if self.ticket is not None:
             _GEMINI_TLOCAL.held = False
-            _GEMINI_SEM.release()
+            get_gemini_admission().release(self.ticket)
         return False
 
 
@@ -342,6 +672,7 @@ def ensure_state():
         "loaded_session_name": None,
         "own_ip_mode": False,
         "own_ip_toggle_prev": None,
+        "full_corpus_mode": False,
         "current_cache": None,
     }
     for k, v in defaults.items():
@@ -438,7 +769,7 @@ def search_pgc_data(keywords: list, start_dt: datetime, end_dt: datetime):
         print(f"Search Error: {e}")
         return []
     
-def log_search_history(user_query: str, schema: dict):
+def log_search_history(user_query: str, schema: dict, user_id: str = None, parser: str = None, parse_ms: float = None):
     """
     [NEW] 사용자의 검색 이력(누가, 무엇을, 언제)을 DB에 저장합니다.
     에러가 나더라도 분석 흐름을 방해하지 않도록 try-except 처리했습니다.
@@ -450,7 +781,7 @@ def log_search_history(user_query: str, schema: dict):
         db = client.get_database("yt_dashboard")
         col = db.get_collection("search_logs") # 'search_logs' 컬렉션 자동 생성됨
         
-        user_id = st.session_state.get("auth_user_id") or "public"
+        user_id = user_id or st.session_state.get("auth_user_id") or "public"
         
         log_doc = {
             "user_id": user_id,
@@ -458,6 +789,8 @@ def log_search_history(user_query: str, schema: dict):
             "keywords": schema.get("keywords", []), # AI가 추출한 핵심 키워드
             "range_start": schema.get("start_iso"),
             "range_end": schema.get("end_iso"),
+            "parser": parser or "gemini",         # 해석 경로 (local | gemini) → 해석기 벤치마크 기준 데이터
+            "parse_ms": parse_ms,
             "timestamp": datetime.utcnow()        # 검색 시점 (UTC)
         }
         col.insert_one(log_doc)
@@ -997,6 +1330,33 @@ def _mongo_saved_sessions_coll():
     db = client[_mongo_db_name()]
     return db[_mongo_saved_sessions_coll_name()]
 
+def _mongo_aux_coll(name_key: str, default_name: str):
+    # 보조 컬렉션(쿼터/캐시/잡 등) 공통 접근자. 이름은 secrets로 덮어쓸 수 있음:
+    #   [mongo]
+    #   yt_key_usage_coll = "ytcc_yt_key_usage"
+    try:
+        mongo_block = st.secrets.get("mongo", {}) or {}
+        name = str(mongo_block.get(name_key) or "").strip()
+    except Exception:
+        name = ""
+    client = _mongo_client()
+    if client is None:
+        return None
+    return client[_mongo_db_name()][name or default_name]
+
+_MONGO_AUX_INDEXED = set()   # 이 프로세스에서 이미 인덱스를 만든 보조 컬렉션 (name_key)
+
+def _mongo_aux_ensure_indexes(name_key: str, coll, indexes, tag: str):
+    """클래스 없이 함수로만 쓰는 보조 컬렉션용: 인덱스를 프로세스당 한 번만 생성. indexes = [(keys, kwargs), ...]"""
+    if coll is None or name_key in _MONGO_AUX_INDEXED:
+        return
+    _MONGO_AUX_INDEXED.add(name_key)
+    try:
+        for keys, kwargs in indexes:
+            coll.create_index(keys, **kwargs)
+    except Exception as e:
+        print(f"⚠️ [{tag}] index failed: {e}")
+
 def _b64_gzip_bytes(raw: bytes) -> str:
     if raw is None:
         return ""
@@ -1410,83 +1770,465 @@ def require_auth():
 
 
 # region [Helper Classes]
-class RotatingKeys:
-    def __init__(self, keys, state_key: str, use_session_state: bool = True, on_rotate=None):
+class YouTubeApiError(Exception):
+    """YouTube Data API 응답 에러 (REST 클라이언트 / async 수집기 공통)."""
+    def __init__(self, status: int, message: str = "", retry_after: float | None = None):
+        super().__init__(f"YouTube API {status}: {message[:300]}")
+        self.status = int(status or 0)
+        self.message = message or ""
+        self.retry_after = retry_after
+
+
+class CollectCancelToken:
+    """댓글 수집 협조적 취소 토큰. 수집 함수들이 페이지 경계마다 확인하고 스스로 멈춤.
+    parent가 있으면 parent가 취소될 때도 취소된 것으로 봄 (잡 취소 → 수집 단계 취소)."""
+    def __init__(self, parent=None):
+        self._event = threading.Event()
+        self.reason = ""
+        self.parent = parent
+
+    def cancel(self, reason: str = ""):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def is_cancelled(self) -> bool:
+        return self._event.is_set() or (self.parent is not None and self.parent.is_cancelled())
+
+
+class YouTubeKeyPool:
+    """프로세스 전역 YouTube API 키 풀.
+    - 호출 종류별 quota units(search=100, 나머지=1)를 키마다 미리 차감하고, 가장 덜 쓴 정상 키를 배정
+    - 쿼터 소진 키는 다음 태평양시 자정(일일 리셋)까지 제외, 레이트 제한은 잠깐만 제외
+    - 사용량/소진 여부는 Mongo에 주기적으로 $inc 해서 재시작·레플리카 간에도 같은 값을 보게 함
+      (밀린 사용량은 락 안에서 꺼내기만 하고 Mongo 쓰기는 락 밖에서 → acquire가 DB 왕복을 기다리지 않음)
+    """
+    FLUSH_EVERY_SEC = 5.0
+
+    def __init__(self, keys, daily_limit: int = YT_DAILY_QUOTA_UNITS):
         self.keys = [k.strip() for k in (keys or []) if isinstance(k, str) and k.strip()][:10]
-        self.state_key = state_key
-        self.use_session_state = bool(use_session_state)
-        self.on_rotate = on_rotate
-
-        # NOTE:
-        # - 메인 스레드(Streamlit)는 st.session_state를 써도 되지만,
-        # - ThreadPoolExecutor 워커 스레드에서는 st.session_state 접근이 불안정할 수 있음.
-        #   (또한 build() 남발 시 소켓/FD가 쌓여 "Too many open files"가 나올 수 있음)
-        if self.use_session_state:
-            idx = st.session_state.get(state_key, 0)
-        else:
-            idx = 0
+        self.daily_limit = int(daily_limit)
+        self._lock = threading.Lock()
+        self._day = pt_quota_day()
+        self._used = {k: 0 for k in self.keys}
+        self._pending = {k: 0 for k in self.keys}
+        self._blocked_until = {}  # key -> epoch sec
+        self._last_flush = 0.0
+        self._load()
+
+    @staticmethod
+    def _kid(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+    def _coll(self):
+        try:
+            return _mongo_aux_coll("yt_key_usage_coll", "ytcc_yt_key_usage")
+        except Exception:
+            return None
 
-        self.idx = 0 if not self.keys else (idx % len(self.keys))
+    def _load(self):
+        coll = self._coll()
+        if coll is None:
+            return
+        try:
+            from pymongo import ASCENDING  # type: ignore
+            coll.create_index([("expiresAt", ASCENDING)], expireAfterSeconds=0)
+            by_kid = {self._kid(k): k for k in self.keys}
+            for doc in coll.find({"day": self._day, "kid": {"$in": list(by_kid)}}):
+                key = by_kid.get(doc.get("kid"))
+                if not key:
+                    continue
+                self._used[key] = max(self._used[key], int(doc.get("units") or 0))
+                if doc.get("exhausted"):
+                    self._blocked_until[key] = next_pt_midnight().timestamp()
+        except Exception as e:
+            print(f"⚠️ [yt key pool] load failed: {e}")
+
+    def _roll_day_locked(self):
+        day = pt_quota_day()
+        if day != self._day:
+            self._day = day
+            self._used = {k: 0 for k in self.keys}
+            self._pending = {k: 0 for k in self.keys}
+            self._blocked_until = {}
+
+    def _take_flush_locked(self, force: bool = False):
+        """쓸 때가 됐으면 밀린 사용량을 꺼내 (day, [(key, inc)]) 반환 (pending은 0으로). 쓰기는 락 밖에서 _flush."""
+        now = time.time()
+        if not force and now - self._last_flush < self.FLUSH_EVERY_SEC:
+            return None
+        self._last_flush = now
+        items = [(k, self._pending.get(k, 0)) for k in self.keys if force or self._pending.get(k, 0) > 0]
+        for key, _ in items:
+            self._pending[key] = 0
+        return (self._day, items) if items else None
+
+    def _flush(self, batch):
+        if not batch or (coll := self._coll()) is None:
+            return
+        day, items = batch
+        done = []
+        try:
+            from pymongo import ReturnDocument  # type: ignore
+            expires = next_pt_midnight() + timedelta(days=2)
+            for key, inc in items:
+                kid = self._kid(key)
+                doc = coll.find_one_and_update(
+                    {"_id": f"{day}:{kid}"},
+                    {"$inc": {"units": inc},
+                     "$set": {"updatedAt": datetime.utcnow()},
+                     "$setOnInsert": {"day": day, "kid": kid, "expiresAt": expires}},
+                    upsert=True, return_document=ReturnDocument.AFTER,
+                )
+                done.append((key, doc))
+        except Exception as e:
+            print(f"⚠️ [yt key pool] flush failed: {e}")
+        with self._lock:
+            if day != self._day:
+                return
+            # 못 쓴 몫은 다음 flush로 넘김
+            for key, inc in items[len(done):]:
+                self._pending[key] = self._pending.get(key, 0) + inc
+            for key, doc in done:
+                if doc:
+                    # 다른 레플리카가 쓴 사용량까지 합쳐진 값
+                    self._used[key] = max(self._used[key], int(doc.get("units") or 0) + self._pending[key])
+                    if doc.get("exhausted"):
+                        self._blocked_until[key] = next_pt_midnight().timestamp()
+
+    def healthy_keys(self, exclude=()) -> list:
+        with self._lock:
+            self._roll_day_locked()
+            now = time.time()
+            return [k for k in self.keys
+                    if k not in exclude and self._blocked_until.get(k, 0) <= now]
+
+    def usage(self, key: str) -> int:
+        return self._used.get(key, 0)
+
+    def charge(self, key: str, units: int):
+        with self._lock:
+            self._roll_day_locked()
+            self._used[key] = self._used.get(key, 0) + int(units)
+            self._pending[key] = self._pending.get(key, 0) + int(units)
+            batch = self._take_flush_locked()
+        self._flush(batch)
+
+    def refund(self, key: str, units: int):
+        """쿼터를 쓰지 않은 호출(429/5xx)의 선차감분 반납."""
+        self.charge(key, -int(units))
+
+    def acquire(self, cost: int = 1, exclude=()) -> str:
+        """가장 덜 쓴 정상 키를 골라 cost만큼 차감 후 반환. 남은 키가 없으면 YouTubeApiError(403)."""
+        with self._lock:
+            self._roll_day_locked()
+            now = time.time()
+            alive = [k for k in self.keys if k not in exclude and self._blocked_until.get(k, 0) <= now]
+            if not alive:
+                raise YouTubeApiError(403, "quotaExceeded: all YouTube API keys exhausted")
+            # 한도 안에 들어오는 키 우선, 없으면(로컬 추정치가 틀렸을 수 있으니) 그래도 가장 덜 쓴 키
+            fits = [k for k in alive if self._used.get(k, 0) + cost <= self.daily_limit] or alive
+            key = min(fits, key=lambda k: self._used.get(k, 0))
+            self._used[key] = self._used.get(key, 0) + int(cost)
+            self._pending[key] = self._pending.get(key, 0) + int(cost)
+            batch = self._take_flush_locked()
+        self._flush(batch)
+        return key
+
+    def mark_exhausted(self, key: str):
+        with self._lock:
+            self._blocked_until[key] = next_pt_midnight().timestamp()
+            day = self._day
+            batch = self._take_flush_locked(force=True)
+        self._flush(batch)
+        coll = self._coll()
+        if coll is None:
+            return
+        try:
+            coll.update_one({"_id": f"{day}:{self._kid(key)}"}, {"$set": {"exhausted": True}})
+        except Exception as e:
+            print(f"⚠️ [yt key pool] mark exhausted failed: {e}")
 
-        if self.use_session_state:
-            st.session_state[state_key] = self.idx
 
-    def current(self):
-        return self.keys[self.idx % len(self.keys)] if self.keys else None
 
-    def rotate(self):
-        if not self.keys:
-            return
-        self.idx = (self.idx + 1) % len(self.keys)
-        if self.use_session_state:
-            st.session_state[self.state_key] = self.idx
-        if callable(self.on_rotate):
-            self.on_rotate(self.idx, self.current())
+@st.cache_resource
+def get_youtube_key_pool(key_tuple: tuple) -> YouTubeKeyPool:
+    return YouTubeKeyPool(list(key_tuple))
+
+
+def _yt_error_info(e) -> tuple:
+    """(status, lower-cased message)"""
+    return e.status, e.message.lower()
+
+
+def _yt_retry_after(e):
+    return e.retry_after
+
+
+def _yt_error_kind(status, msg: str) -> str:
+    """반환: quota(일일 쿼터 소진 → 키 교체) | throttle(429/레이트/5xx → 백오프 후 재시도) | fatal"""
+    if status in (403, 429) and ("quotaexceeded" in msg or "dailylimitexceeded" in msg
+                                 or ("quota" in msg and "ratelimit" not in msg)):
+        return "quota"
+    if status == 429 or (status == 403 and "ratelimit" in msg) or status in (500, 502, 503, 504):
+        return "throttle"
+    return "fatal"
+
+
+class TokenBucket:
+    """예약형 토큰 버킷: reserve()는 막지 않고 '얼마나 기다려야 하는지'만 돌려줌 (sync/async 공용)."""
+    def __init__(self, rate: float, burst: float):
+        self.rate = max(0.1, float(rate))
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+            self.ts = now
+            self.tokens -= 1.0
+            return 0.0 if self.tokens >= 0 else (-self.tokens / self.rate)
+
+
+class AimdController:
+    """AIMD 동시성 한도: 성공마다 +1/limit(대략 한 바퀴에 +1), 스로틀 시 절반(1초에 한 번만).
+    스레드는 acquire(), 이벤트 루프는 acquire_async() — 자리가 나면 release/on_success가 대기 중인 future를
+    해당 루프에서 깨움 (여러 루프/스레드가 한 컨트롤러를 공유하므로 call_soon_threadsafe로)."""
+    def __init__(self, start=YT_AIMD_START, lo=YT_AIMD_MIN, hi=YT_AIMD_MAX):
+        self.lo, self.hi = float(lo), float(max(lo, hi))
+        self.limit = float(min(max(start, lo), self.hi))
+        self.inflight = 0
+        self._last_cut = 0.0
+        self._cond = threading.Condition()
+        self._async_waiters = deque()   # (loop, future)
+
+    def acquire(self):
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                self._cond.wait(timeout=1.0)
+            self.inflight += 1
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self.inflight < int(self.limit):
+                    self.inflight += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self._async_waiters.append(waiter)
+            try:
+                await waiter[1]
+            finally:
+                with self._cond:
+                    try:
+                        self._async_waiters.remove(waiter)
+                    except ValueError:
+                        pass
+                    # 깨워진 뒤 취소된 경우 그 자리를 다음 대기자에게 넘김
+                    self._wake_async_locked()
+
+    def _wake_async_locked(self):
+        free = int(self.limit) - self.inflight
+        while free > 0 and self._async_waiters:
+            loop, fut = self._async_waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(lambda f=fut: f.done() or f.set_result(True))
+            except RuntimeError:   # 루프가 이미 닫힘
+                continue
+            free -= 1
+
+    def release(self):
+        with self._cond:
+            self.inflight = max(0, self.inflight - 1)
+            self._cond.notify_all()
+            self._wake_async_locked()
+
+    def on_success(self):
+        with self._cond:
+            self.limit = min(self.hi, self.limit + 1.0 / max(1.0, self.limit))
+            self._cond.notify_all()
+            self._wake_async_locked()
+
+    def on_throttle(self):
+        with self._cond:
+            now = time.monotonic()
+            if now - self._last_cut >= 1.0:
+                self._last_cut = now
+                self.limit = max(self.lo, self.limit * 0.5)
+                print(f"⚠️ [YouTube API] 스로틀 감지 → 동시성 한도 {self.limit:.1f}")
+
+
+class YouTubeRateLimiter:
+    """프로세스 전역 YouTube 호출 속도 제어: 키별 토큰 버킷 + AIMD + 백오프 계산."""
+    def __init__(self, rps: float = YT_KEY_RPS, burst: float = YT_KEY_BURST):
+        self.rps, self.burst = rps, burst
+        self.aimd = AimdController()
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def key_wait(self, key: str) -> float:
+        with self._lock:
+            bucket = self._buckets.setdefault(key, TokenBucket(self.rps, self.burst))
+        return bucket.reserve()
+
+    @staticmethod
+    def backoff(attempt: int, retry_after=None) -> float:
+        if retry_after is not None and retry_after >= 0:
+            return min(YT_BACKOFF_MAX_SEC, float(retry_after))
+        import random
+        cap = min(YT_BACKOFF_MAX_SEC, YT_BACKOFF_BASE_SEC * (2 ** attempt))
+        return random.uniform(0, cap)  # full jitter
+
+
+@st.cache_resource
+def get_youtube_rate_limiter() -> YouTubeRateLimiter:
+    return YouTubeRateLimiter()
+
+
+# ---- YouTube REST client ----
+# 응답에서 실제로 읽는 필드만 받도록 endpoint별 fields 마스크 (페이로드/파싱 시간 절감)
+YT_FIELDS = {
+    "search.list": "nextPageToken,items/id/videoId",
+    "videos.list": "items(id,snippet(title,channelTitle,publishedAt),"
+                   "statistics(viewCount,likeCount,commentCount),contentDetails/duration)",
+    "commentThreads.list": "nextPageToken,items(snippet(totalReplyCount,topLevelComment(id,"
+                           "snippet(authorDisplayName,textDisplay,publishedAt,likeCount))),"
+                           "replies/comments(id,snippet(authorDisplayName,textDisplay,publishedAt,likeCount)))",
+    "comments.list": "nextPageToken,items(id,snippet(authorDisplayName,textDisplay,publishedAt,likeCount))",
+}
+
+def _yt_json_loads(raw: bytes):
+    return orjson.loads(raw) if _ORJSON_AVAILABLE else json.loads(raw)
+
+def _yt_params(method_id: str, params: dict, key: str) -> dict:
+    out = {k: v for k, v in params.items() if v is not None}
+    if method_id in YT_FIELDS:
+        out.setdefault("fields", YT_FIELDS[method_id])
+    out["key"] = key
+    return out
+
+def _yt_retry_after_header(headers):
+    ra = headers.get("Retry-After")
+    return float(ra) if ra and ra.isdigit() else None
+
+@st.cache_resource
+def get_youtube_http_session() -> requests.Session:
+    """프로세스 전역 keep-alive 커넥션 풀. urllib3 풀은 스레드 안전 → 워커 스레드끼리 공유."""
+    sess = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=YT_HTTP_POOL_SIZE, max_retries=0)
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+    # Google API는 User-Agent에 gzip이 있어야 압축 응답을 줌
+    sess.headers.update({"Accept-Encoding": "gzip", "User-Agent": "ytcc-chatbot (gzip)"})
+    return sess
+
+
+class YouTubeRestRequest:
+    """googleapiclient HttpRequest처럼 methodId / execute()를 가진 요청 객체. 키는 실행 시점에 쿼리로 붙임."""
+    def __init__(self, http: requests.Session, resource: str, method: str, params: dict, key: str = None):
+        self.http = http
+        self.resource = resource
+        self.methodId = f"youtube.{resource}.{method}"
+        self.params = params
+        self.key = key
+
+    def execute(self, key: str = None) -> dict:
+        params = _yt_params(f"{self.resource}.list", self.params, key or self.key)
+        try:
+            resp = self.http.get(f"{YT_API_BASE_URL}/{self.resource}", params=params, timeout=YT_HTTP_TIMEOUT_SEC)
+        except requests.RequestException as e:
+            raise YouTubeApiError(503, f"{type(e).__name__}: {e}")
+        if resp.status_code == 200:
+            return _yt_json_loads(resp.content)
+        raise YouTubeApiError(resp.status_code, resp.text, _yt_retry_after_header(resp.headers))
+
+
+class _YouTubeRestResource:
+    def __init__(self, service, name: str):
+        self._service, self._name = service, name
+
+    def list(self, **params) -> YouTubeRestRequest:
+        return YouTubeRestRequest(self._service.http, self._name, "list", params, self._service.key)
+
+
+class YouTubeRestService:
+    """build("youtube", "v3")와 같은 호출 모양(s.search().list(**p).execute())의 경량 REST 클라이언트.
+    - 디스커버리 문서 파싱/httplib2 인스턴스 없음: 공유 커넥션 풀 하나로 모든 스레드가 호출
+    - 키 교체 = 쿼리 파라미터 key만 바꿈 (클라이언트 재생성 없음)
+    """
+    def __init__(self, key: str = None, http: requests.Session = None):
+        self.key = key
+        self.http = http or get_youtube_http_session()
+
+    def search(self): return _YouTubeRestResource(self, "search")
+    def videos(self): return _YouTubeRestResource(self, "videos")
+    def commentThreads(self): return _YouTubeRestResource(self, "commentThreads")
+    def comments(self): return _YouTubeRestResource(self, "comments")
 
 
 class RotatingYouTube:
-    def __init__(self, keys, state_key="yt_key_idx", use_session_state: bool = True):
-        self.rot = RotatingKeys(keys, state_key, use_session_state=use_session_state)
-        self.service = None
-        self._build()
-
-    def _build(self):
-        key = self.rot.current()
-        if not key:
+    """YouTube 클라이언트. 호출마다 프로세스 전역 키 풀(YouTubeKeyPool)에서 키를 받아 씀."""
+    def __init__(self, keys):
+        key_tuple = tuple(k.strip() for k in (keys or []) if isinstance(k, str) and k.strip())
+        if not key_tuple:
             raise RuntimeError("YouTube API Key가 비어 있습니다.")
-        # IMPORTANT:
-        # build()를 반복 호출하면(특히 멀티스레드에서 video마다 새 인스턴스 생성 시)
-        # 내부 HTTP/소켓/캐시 FD가 누적되어 [Errno 24] Too many open files로 터질 수 있음.
-        # - cache_discovery=False : 디스커버리 캐시 파일 사용 방지(불필요한 FD/락 감소)
-        self.service = build("youtube", "v3", developerKey=key, cache_discovery=False)
+        self.pool = get_youtube_key_pool(key_tuple)
+        self.limiter = get_youtube_rate_limiter()
+        # 키 없는 서비스 1개를 공유하고, 실행할 때 key 쿼리 파라미터만 바꿔 끼움
+        self._svc = YouTubeRestService()
+
+    def _cost_of(self, req) -> int:
+        method = str(getattr(req, "methodId", "") or "").replace("youtube.", "", 1)
+        return YT_QUOTA_COST.get(method, 1)
 
     def execute(self, factory, max_rotate: int | None = None):
         if not callable(factory):
             raise ValueError("factory must be callable")
-        max_retries = max_rotate if isinstance(max_rotate, int) and max_rotate > 0 else len(self.rot.keys)
-        max_retries = max(max_retries, 1)
+        max_rotate = max_rotate if isinstance(max_rotate, int) and max_rotate > 0 else len(self.pool.keys)
+        max_attempts = max(max_rotate, 1) + YT_MAX_RETRIES
 
+        req = factory(self._svc)
+        cost = self._cost_of(req)
+        tried = set()
+        throttled = 0
         last_error = None
-        for _ in range(max_retries):
+        for _ in range(max_attempts):
+            key = self.pool.acquire(cost, exclude=tried)
+            if (wait := self.limiter.key_wait(key)) > 0:
+                time.sleep(wait)
+            self.limiter.aimd.acquire()
             try:
-                return factory(self.service).execute()
-            except HttpError as e:
+                resp = req.execute(key=key)
+                self.limiter.aimd.on_success()
+                return resp
+            except YouTubeApiError as e:
                 last_error = e
-                status = getattr(getattr(e, "resp", None), "status", None)
-                content = getattr(e, "content", b"") or b""
-                try:
-                    msg = content.decode("utf-8", "ignore").lower()
-                except Exception:
-                    msg = str(content).lower()
-
-                # 쿼터/레이트 제한이면 키 회전
-                if status in (403, 429) and any(t in msg for t in ("quota", "rate", "limit", "exceeded")):
-                    print(f"⚠️ [YouTube API] 키 제한 감지 → 키 교체 (Current idx: {self.rot.idx})")
-                    self.rot.rotate()
-                    self._build()
-                    continue
+            finally:
+                self.limiter.aimd.release()
+
+            # 재시도 판단/백오프는 동시성 슬롯을 돌려준 뒤에 (자는 동안 다른 요청이 슬롯을 쓰게)
+            status, msg = _yt_error_info(last_error)
+            kind = _yt_error_kind(status, msg)
+
+            # 일일 쿼터 소진: 리셋 시각까지 전역 제외하고 다른 키로
+            if kind == "quota":
+                print(f"⚠️ [YouTube API] 쿼터 소진 키 감지 → 다른 키로 재시도 (used={self.pool.usage(key)})")
+                self.pool.mark_exhausted(key)
+                tried.add(key)
+                continue
+            # 429/레이트/5xx: 쿼터가 안 쓰였으니 선차감분 반납, 동시성 줄이고 백오프 후 재시도
+            if kind == "throttle" and throttled < YT_MAX_RETRIES:
+                self.pool.refund(key, cost)
+                self.limiter.aimd.on_throttle()
+                time.sleep(self.limiter.backoff(throttled, _yt_retry_after(last_error)))
+                throttled += 1
+                continue
 
-                raise
+            raise last_error
 
         if last_error:
             raise last_error
@@ -1498,14 +2240,14 @@ _YT_THREAD_LOCAL = threading.local()
 
 def get_thread_youtube_client(keys):
     """ThreadPoolExecutor 워커 스레드에서 재사용할 YouTube client(=RotatingYouTube).
-    - 워커 스레드마다 1개만 생성해서 build() 남발을 막음 → FD/소켓 누수 방지
-    - st.session_state 접근 금지(use_session_state=False)
+    - HTTP 커넥션은 프로세스 전역 풀을 공유하므로 스레드별 객체는 가벼운 래퍼일 뿐
+    - st.session_state 접근 금지
     """
     key_tuple = tuple(keys or [])
     rt = getattr(_YT_THREAD_LOCAL, "rt", None)
     if rt is None or getattr(_YT_THREAD_LOCAL, "key_tuple", None) != key_tuple:
         _YT_THREAD_LOCAL.key_tuple = key_tuple
-        _YT_THREAD_LOCAL.rt = RotatingYouTube(list(key_tuple), state_key="yt_key_idx_thread", use_session_state=False)
+        _YT_THREAD_LOCAL.rt = RotatingYouTube(list(key_tuple))
     return _YT_THREAD_LOCAL.rt
 
 def get_session_youtube_client(keys):
@@ -1513,7 +2255,7 @@ def get_session_youtube_client(keys):
     key_tuple = tuple(keys or [])
     if ("yt_rt_session" not in st.session_state) or (st.session_state.get("yt_rt_session_keys") != key_tuple):
         st.session_state["yt_rt_session_keys"] = key_tuple
-        st.session_state["yt_rt_session"] = RotatingYouTube(list(key_tuple), state_key="yt_key_idx", use_session_state=True)
+        st.session_state["yt_rt_session"] = RotatingYouTube(list(key_tuple))
     return st.session_state["yt_rt_session"]
 # endregion
 
@@ -1644,12 +2386,15 @@ def save_current_session_to_db():
     local_dir = os.path.join(SESS_DIR, user_id, sess_name)
     os.makedirs(local_dir, exist_ok=True)
 
+    apply_followup_summary()   # 끝난 백그라운드 요약이 있으면 같이 저장
     try:
         # 1) meta (qa.json) 준비
         meta_data = {
             "chat": st.session_state.chat,
             "last_schema": st.session_state.get("last_schema"),
             "sample_text": st.session_state.get("sample_text"),
+            "followup_summary": st.session_state.get("followup_summary"),
+            "followup_summary_upto": st.session_state.get("followup_summary_upto"),
         }
         
         # 로컬 저장 (qa.json)
@@ -1748,6 +2493,8 @@ def load_session_from_db(sess_name: str):
             st.session_state.chat = meta.get("chat") or []
             st.session_state.last_schema = meta.get("last_schema") or {}
             st.session_state.sample_text = meta.get("sample_text") or ""
+            st.session_state.followup_summary = meta.get("followup_summary") or ""
+            st.session_state.followup_summary_upto = int(meta.get("followup_summary_upto") or 0)
             st.session_state.loaded_session_name = sess_name
 
             # 2) comments.csv 복원
@@ -1828,12 +2575,99 @@ def _process_saved_session_actions():
         st.rerun()
 # endregion
 
+class TokenEstimator:
+    """Gemini 입력 토큰 수 오프라인 추정 (한국어 유튜브 댓글 기준).
+    문자 종류별 토큰 가중치의 합 × 보정 배율(scale). 배율은 calibrate()로 count_tokens 실측에 맞춤
+    (get_token_estimator가 Mongo ytcc_token_calibration에서 모델별 배율을 읽어옴)."""
+    # (정규식, 글자당 토큰) — 한글 음절은 2글자 남짓이 1토큰, 영문은 단어 조각 단위, 숫자는 자리마다 1토큰
+    _CLASSES = (
+        (re.compile(r"[가-힣]"), 0.62),
+        (re.compile(r"[ㄱ-ㆎ]"), 0.5),      # ㅋㅋㅋ, ㅠㅠ
+        (re.compile(r"[A-Za-z]"), 0.27),
+        (re.compile(r"[0-9]"), 1.0),
+        (re.compile(r"\s"), 0.08),
+        (re.compile(r"[!-/:-@\[-`{-~]"), 0.7),
+    )
+    OTHER_WEIGHT = 1.4   # 이모지/한자/기호 등 (바이트 단위로 쪼개짐)
+
+    def __init__(self, scale: float = 1.0):
+        self.scale = float(scale) if scale and scale > 0 else 1.0
+
+    def _raw(self, text: str) -> float:
+        total, known = 0.0, 0
+        for pattern, weight in self._CLASSES:
+            n = len(pattern.findall(text))
+            total += n * weight
+            known += n
+        return total + (len(text) - known) * self.OTHER_WEIGHT
+
+    def estimate(self, text: str) -> int:
+        if not text:
+            return 0
+        return int(math.ceil(self._raw(text) * self.scale))
+
+    def calibrate(self, samples) -> float:
+        """samples: [(text, 실측 토큰 수)] → 배율 = 실측 합 / 원 추정 합."""
+        raw = sum(self._raw(t) for t, _ in samples)
+        actual = sum(int(n) for _, n in samples)
+        if raw > 0 and actual > 0:
+            self.scale = actual / raw
+        return self.scale
+
+
+@st.cache_resource
+def get_token_estimator() -> TokenEstimator:
+    scale = 1.0
+    try:
+        coll = _mongo_aux_coll("token_calibration_coll", "ytcc_token_calibration")
+        doc = coll.find_one({"_id": GEMINI_MODEL}) if coll is not None else None
+        scale = float((doc or {}).get("scale") or 1.0)
+    except Exception as e:
+        print(f"⚠️ [token estimator] calibration load failed: {e}")
+    return TokenEstimator(scale)
+
+
+def calibrate_token_estimator(texts, keys=None) -> dict:
+    """count_tokens 실측으로 추정 배율을 다시 맞추고 Mongo에 저장 (관리자 사이드바에서 실행).
+    texts: 실제 입력과 비슷한 텍스트 조각들 (보통 현재 세션 샘플을 잘라서)."""
+    est = get_token_estimator()
+    pool = get_gemini_client_pool(tuple(keys or GEMINI_API_KEYS))
+    key = pool.next_key()
+    model = pool.model(key, GEMINI_MODEL, {"temperature": 0.2, "max_output_tokens": GEMINI_MAX_TOKENS})
+    samples = [(t, model.count_tokens(t).total_tokens) for t in texts if t]
+    if not samples:
+        return {"samples": 0}
+    actual = sum(n for _, n in samples)
+    before = sum(est.estimate(t) for t, _ in samples)
+    scale_before = est.scale
+    est.calibrate(samples)
+    after = sum(est.estimate(t) for t, _ in samples)
+    try:
+        coll = _mongo_aux_coll("token_calibration_coll", "ytcc_token_calibration")
+        if coll is not None:
+            coll.update_one({"_id": GEMINI_MODEL}, {"$set": {"scale": est.scale, "samples": len(samples),
+                                                              "actual_tokens": actual, "updatedAt": datetime.utcnow()}},
+                            upsert=True)
+    except Exception as e:
+        print(f"⚠️ [token estimator] calibration save failed: {e}")
+    summary = {
+        "samples": len(samples), "actual_tokens": actual,
+        "scale_before": round(scale_before, 3), "scale": round(est.scale, 3),
+        "err_before_pct": round((before - actual) / actual * 100, 1),
+        "err_after_pct": round((after - actual) / actual * 100, 1),
+    }
+    print("[METRICS] token_calibration " + " ".join(f"{k}={v}" for k, v in summary.items()))
+    return summary
+
+
 def serialize_comments_for_llm_from_file(csv_path: str,
                                          max_chars_per_comment=280,
-                                         max_total_chars=420_000,
+                                         max_total_tokens=LLM_SAMPLE_TOKEN_BUDGET,
                                          top_n=1000,
-                                         random_n=1000,
+                                         random_n=None,
                                          dedup_key="text"):
+    """인기댓글 top_n개 → 나머지를 섞어서 랜덤 댓글로 토큰 예산(max_total_tokens, 추정치)을 채움.
+    random_n을 주면 랜덤 댓글은 최대 그 개수까지. 예산에 안 들어가는 긴 댓글은 건너뛰고 짧은 것으로 계속 채움."""
     if not os.path.exists(csv_path):
         return "", 0, 0, {"error": "csv_not_found"}
 
@@ -1856,47 +2690,48 @@ def serialize_comments_for_llm_from_file(csv_path: str,
 
     df_top_likes = df_all.sort_values("likeCount", ascending=False).head(top_n)
     df_remaining = df_all.drop(df_top_likes.index)
-
-    if not df_remaining.empty:
-        take_n = min(random_n, len(df_remaining))
-        df_random = df_remaining.sample(n=take_n, random_state=42)
-    else:
-        df_random = pd.DataFrame()
-
-    df_sample = pd.concat([df_top_likes, df_random], ignore_index=True)
-    sampled_target = len(df_sample)
-
-    lines, total_chars = [], 0
-    used_top = len(df_top_likes)
-    used_random = len(df_random)
-
-    for _, r in df_sample.iterrows():
-        if total_chars >= max_total_chars:
+    df_random = df_remaining.sample(frac=1.0, random_state=42) if not df_remaining.empty else pd.DataFrame()
+    if random_n is not None:
+        df_random = df_random.head(int(random_n))
+
+    est = get_token_estimator()
+    lines, total_chars, total_tokens = [], 0, 0
+    used = {"top": 0, "random": 0}
+    misses = 0   # 연속으로 예산에 안 들어간 댓글 수 (남은 예산이 거의 없으면 그만 봄)
+
+    for kind, part in (("top", df_top_likes), ("random", df_random)):
+        # 랜덤 쪽은 전체 행이 클 수 있어서 필요한 만큼만 조금씩 직렬화
+        for start in range(0, len(part), 5000):
+            for line in _comment_lines(part.iloc[start:start + 5000], max_chars_per_comment):
+                tokens = est.estimate(line) + 1
+                if total_tokens + tokens > max_total_tokens:
+                    misses += 1
+                    if misses >= 200 or max_total_tokens - total_tokens < 8:
+                        break
+                    continue
+                misses = 0
+                lines.append(line)
+                total_chars += len(line) + 1
+                total_tokens += tokens
+                used[kind] += 1
+            else:
+                continue
             break
 
-        raw_text = str(r.get("text", "") or "").replace("\n", " ")
-        prefix = f"[{'R' if int(r.get('isReply', 0)) == 1 else 'T'}|♥{int(r.get('likeCount', 0))}] "
-        author_clean = str(r.get('author', '')).replace('\n', ' ')
-        prefix += f"{author_clean}: "
-
-        body = raw_text[:max_chars_per_comment] + '…' if len(raw_text) > max_chars_per_comment else raw_text
-
-        line = prefix + body
-        lines.append(line)
-        total_chars += len(line) + 1
-
     meta = {
         "total_rows": total_rows,
         "unique_rows": unique_rows,
         "top_n": int(top_n),
-        "random_n": int(random_n),
-        "used_top": int(used_top),
-        "used_random": int(used_random),
-        "sampled_target": int(sampled_target),
+        "random_n": int(random_n) if random_n is not None else "budget",
+        "used_top": int(used["top"]),
+        "used_random": int(used["random"]),
+        "sampled_target": int(len(df_top_likes) + len(df_random)),
         "llm_input_lines": int(len(lines)),
         "llm_input_chars": int(total_chars),
+        "llm_input_tokens_est": int(total_tokens),
         "max_chars_per_comment": int(max_chars_per_comment),
-        "max_total_chars": int(max_total_chars),
+        "max_total_tokens": int(max_total_tokens),
+        "token_scale": round(est.scale, 3),
         "dedup_key": str(dedup_key),
     }
     return "\n".join(lines), len(lines), total_chars, meta
@@ -1925,6 +2760,66 @@ def tidy_answer(text: str) -> str:
 
     return "\n".join(cleaned).strip()
 
+
+class AnswerTidier:
+    """tidy_answer의 증분 버전 (스트리밍 청크용).
+    줄바꿈이 온 줄만 확정해서 정리하고, 마지막 미완성 줄은 보류. 청크를 다 넣은 뒤 finish()는
+    tidy_answer(전체 원문)과 같은 결과. feed()는 생성 스레드, text는 UI 스레드에서 읽어도 됨."""
+    _REMOVE = re.compile(r"유튜브\s*댓글\s*분석|보고서\s*작성|분석\s*결과", re.IGNORECASE)
+
+    def __init__(self):
+        self._lines = []   # 정리가 끝난 줄
+        self._blank = []   # 다음 줄이 태그로 시작하면 지워질 빈 줄 (tidy_answer의 ^\s+(?=<)와 동일)
+        self._tail = ""    # 아직 줄바꿈이 안 온 마지막 줄
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _strip_fence(line: str) -> str:
+        line = re.sub(r"^```html", "", line, flags=re.IGNORECASE)
+        return re.sub(r"^```", "", line)
+
+    def _keep(self, line: str) -> bool:
+        return not (self._REMOVE.search(line) and len(line) < 50)
+
+    def _push(self, line: str):
+        line = self._strip_fence(line)
+        if not line.strip():
+            self._blank.append(line)
+            return
+        if line.lstrip().startswith("<"):
+            self._blank = []
+            line = line.lstrip()
+        self._lines.extend(self._blank)
+        self._blank = []
+        if self._keep(line):
+            self._lines.append(line)
+
+    def feed(self, delta: str):
+        if not delta:
+            return
+        with self._lock:
+            buf = self._tail + delta
+            *done, self._tail = buf.split("\n")
+            for line in done:
+                self._push(line.rstrip("\r"))
+
+    @property
+    def text(self) -> str:
+        """지금까지의 정리된 답변 (미완성 줄 포함, 화면 표시용)."""
+        with self._lock:
+            lines = self._lines + self._blank
+            tail = self._strip_fence(self._tail)
+            if tail.strip() and self._keep(tail):
+                lines = lines + [tail.lstrip() if tail.lstrip().startswith("<") else tail]
+            return "\n".join(lines).strip()
+
+    def finish(self) -> str:
+        with self._lock:
+            if self._tail:
+                self._push(self._tail.rstrip("\r"))
+                self._tail = ""
+        return self.text
+
 YTB_ID_RE = re.compile(r"[A-Za-z0-9_-]{11}")
 
 def extract_video_ids_from_text(text: str) -> list:
@@ -1955,10 +2850,327 @@ def strip_urls(s: str) -> str:
 
 
 # region [API Integrations: Gemini & YouTube]
+def _gemini_stream_text(resp, on_chunk) -> str:
+    """generate_content(stream=True) 응답을 읽으면서 청크(증분 텍스트)마다 on_chunk(delta) 호출, 전체 텍스트 반환."""
+    parts = []
+    for chunk in resp:
+        try:
+            delta = chunk.text
+        except ValueError:
+            # 차단/빈 후보 청크 → 건너뜀 (전체가 비면 호출부에서 prompt_feedback 확인)
+            continue
+        if delta:
+            parts.append(delta)
+            on_chunk(delta)
+    return "".join(parts)
+
+def _gemini_stream_request(model_name, text, generation_config, system_instruction=None,
+                           safety_settings=None, cached_content=None):
+    """GeminiClientPool.stream용 GenerateContentRequest (GenerativeModel.generate_content가 만드는 것과 같은 내용).
+    cached_content를 넘기면 모델은 캐시를 만든 모델로."""
+    model = getattr(cached_content, "model", None) or model_name
+    req = glm.GenerateContentRequest(
+        model=model if model.startswith(("models/", "tunedModels/")) else f"models/{model}",
+        contents=[glm.Content(role="user", parts=[glm.Part(text=text)])],
+        generation_config=glm.GenerationConfig(**(generation_config or {})),
+        safety_settings=[glm.SafetySetting(category=c, threshold=t) for c, t in (safety_settings or {}).items()],
+    )
+    if system_instruction:
+        req.system_instruction = glm.Content(parts=[glm.Part(text=system_instruction)])
+    if cached_content is not None:
+        req.cached_content = cached_content.name
+    return req
+
+def _gemini_chunk_text(chunk) -> str:
+    """스트림 원본 청크(glm.GenerateContentResponse)의 첫 후보 텍스트 (차단/빈 후보면 "")."""
+    return "".join(p.text for c in list(chunk.candidates)[:1] for p in c.content.parts)
+
+def _is_quota_error(e) -> bool:
+    msg = str(e).lower()
+    return "429" in msg or "quota" in msg or "resource_exhausted" in msg or "resource exhausted" in msg
+
+
+class GeminiClientPool:
+    """프로세스 전역 Gemini 클라이언트 풀 (호출마다 전역 genai.configure + GenerativeModel 생성하던 것 대체).
+    - 키마다 GenerativeServiceClient 1개를 만들어 모든 스레드가 공유 → 다른 스레드의 configure에 키가 바뀌지 않음
+    - (키, 모델, 설정, system prompt)별 GenerativeModel을 LRU로 재사용 (CachedContent 모델은 캐시 이름 기준)
+    - 키 선택은 정상 키 라운드로빈, 429/quota 맞은 키는 모든 세션에서 쿨다운 동안 제외
+    - CachedContent(create/get/update/delete)는 라이브러리가 전역 클라이언트만 쓰므로 configure+호출을 락 하나로 묶음"""
+    MAX_MODELS = 64
+
+    def __init__(self, keys):
+        self.keys = [k.strip() for k in (keys or []) if isinstance(k, str) and k.strip()][:10]
+        self._lock = threading.Lock()
+        self._configure_lock = threading.Lock()
+        self._clients = {}
+        self._models = OrderedDict()
+        self._rr = 0
+        self._blocked_until = {}   # key -> epoch sec
+        self._strikes = {}         # key -> 연속 429 횟수
+
+    def client(self, key):
+        with self._lock:
+            c = self._clients.get(key)
+            if c is None:
+                c = self._clients[key] = glm.GenerativeServiceClient(client_options={"api_key": key})
+            return c
+
+    def stream(self, key, request, timeout=None):
+        """StreamGenerateContent를 gRPC 호출 객체로 바로 반환 (첫 청크를 기다리지 않음, .cancel() 가능).
+        GAPIC 래퍼(generate_content(stream=True))는 첫 청크가 올 때까지 반환하지 않아서 그 사이엔 취소할 대상이 없음."""
+        rpc = self.client(key).transport.stream_generate_content
+        return rpc(request, timeout=timeout,
+                   metadata=[routing_header.to_grpc_metadata((("model", request.model),))])
+
+    def _pooled_model(self, mkey, key, build):
+        with self._lock:
+            m = self._models.get(mkey)
+            if m is not None:
+                self._models.move_to_end(mkey)
+                return m
+        m = build()
+        # GenerativeModel은 클라이언트를 넘겨받는 공개 인자가 없어서, 첫 호출 때 전역 configure 클라이언트를
+        # 채워 넣는 비공개 _client를 미리 키별 클라이언트로 지정 (google-generativeai 0.8.x 기준 →
+        # requirements.txt에서 <0.9로 고정, 올릴 때 이 속성 이름을 다시 확인)
+        m._client = self.client(key)
+        with self._lock:
+            m = self._models.setdefault(mkey, m)
+            self._models.move_to_end(mkey)
+            while len(self._models) > self.MAX_MODELS:
+                self._models.popitem(last=False)
+        return m
+
+    def model(self, key, model_name, generation_config, system_instruction=None):
+        sys_h = hashlib.sha1((system_instruction or "").encode("utf-8")).hexdigest()
+        mkey = (key, model_name, json.dumps(generation_config, sort_keys=True), sys_h)
+        return self._pooled_model(mkey, key, lambda: genai.GenerativeModel(
+            model_name, generation_config=generation_config, system_instruction=system_instruction))
+
+    def cached_model(self, key, cached_content, generation_config):
+        mkey = (key, "cached:" + cached_content.name, json.dumps(generation_config, sort_keys=True), "")
+        return self._pooled_model(mkey, key, lambda: genai.GenerativeModel.from_cached_content(
+            cached_content=cached_content, generation_config=generation_config))
+
+    def cache_call(self, key, fn):
+        """CachedContent 작업을 이 키로 실행 (전역 클라이언트를 쓰는 라이브러리 한계 → 이 작업끼리만 직렬화)."""
+        with self._configure_lock:
+            genai.configure(api_key=key)
+            return fn()
+
+    def next_key(self, exclude=()):
+        """정상 키를 라운드로빈으로. 전부 쿨다운 중이면 가장 먼저 풀리는 키 (없으면 None)."""
+        with self._lock:
+            cands = [k for k in self.keys if k not in exclude]
+            if not cands:
+                return None
+            now = time.time()
+            alive = [k for k in cands if self._blocked_until.get(k, 0) <= now]
+            if not alive:
+                return min(cands, key=lambda k: self._blocked_until.get(k, 0))
+            self._rr += 1
+            return alive[self._rr % len(alive)]
+
+    def retire(self, key):
+        with self._lock:
+            # 이미 쿨다운 중인 키 = 동시에 나가 있던 다른 요청의 429 → 한 번으로 침
+            if self._blocked_until.get(key, 0) > time.time():
+                return
+            n = self._strikes[key] = self._strikes.get(key, 0) + 1
+            cool = min(GEMINI_KEY_COOLDOWN_MAX_SEC, GEMINI_KEY_COOLDOWN_SEC * 2 ** (n - 1))
+            self._blocked_until[key] = time.time() + cool
+        print(f"⚠️ [gemini keys] key {hashlib.sha256(key.encode()).hexdigest()[:8]} retired for {cool}s (strike {n})")
+
+    def ok(self, key):
+        with self._lock:
+            self._strikes.pop(key, None)
+
+    def healthy(self, key) -> bool:
+        with self._lock:
+            return self._blocked_until.get(key, 0) <= time.time()
+
+
+@st.cache_resource
+def get_gemini_client_pool(key_tuple: tuple) -> GeminiClientPool:
+    return GeminiClientPool(list(key_tuple))
+
+
+class GeminiHedger:
+    """hedging 기준/비율 관리 (프로세스 전역). 실제로 슬롯을 받아 나간 중복 요청만 hedge로 셈.
+    - 호출 종류(우선순위 + 입력 크기 구간)별 첫 청크 지연 최근 GEMINI_HEDGE_WINDOW건 → p95가 hedge 기준
+    - 최근 GEMINI_HEDGE_WINDOW건 중 hedge한 비율이 GEMINI_HEDGE_MAX_RATE 이상이면 더 안 보냄"""
+    def __init__(self, window: int = GEMINI_HEDGE_WINDOW, max_rate: float = GEMINI_HEDGE_MAX_RATE):
+        self.max_rate = float(max_rate)
+        self.window = max(10, int(window))
+        self._lock = threading.Lock()
+        self._lat = {}                              # 호출 종류 -> deque(첫 청크 초)
+        self._recent = deque(maxlen=self.window)    # 호출마다 hedge 여부(0/1)
+        self.stats = {"calls": 0, "hedged": 0, "hedge_won": 0}
+
+    @staticmethod
+    def call_class(priority, payload_chars: int) -> str:
+        size = "s" if payload_chars < 8_000 else ("m" if payload_chars < 200_000 else "l")
+        return f"p{priority}:{size}"
+
+    def threshold(self, cls) -> float:
+        with self._lock:
+            lat = sorted(self._lat.get(cls, ()))
+        if len(lat) < GEMINI_HEDGE_MIN_SAMPLES:
+            return GEMINI_HEDGE_DEFAULT_SEC
+        return max(GEMINI_HEDGE_MIN_SEC, lat[min(len(lat) - 1, int(len(lat) * 0.95))])
+
+    def observe(self, cls, first_chunk_sec: float):
+        with self._lock:
+            self._lat.setdefault(cls, deque(maxlen=self.window)).append(float(first_chunk_sec))
+
+    def allow(self) -> bool:
+        with self._lock:
+            return sum(self._recent) < self.max_rate * max(len(self._recent), self.window)
+
+    def record(self, hedged: bool, hedge_won: bool = False):
+        with self._lock:
+            self._recent.append(1 if hedged else 0)
+            self.stats["calls"] += 1
+            self.stats["hedged"] += int(hedged)
+            self.stats["hedge_won"] += int(hedge_won)
+            rate = sum(self._recent) / len(self._recent)
+        if hedged:
+            print(f"[METRICS] gemini_hedge won={'hedge' if hedge_won else 'primary'} recent_rate={rate:.3f} "
+                  + " ".join(f"{k}={v}" for k, v in self.stats.items()))
+
+
+@st.cache_resource
+def get_gemini_hedger() -> GeminiHedger:
+    return GeminiHedger()
+
+
+def _cancel_stream(resp):
+    """진 쪽 스트리밍 응답 중단 (gRPC 스트림 cancel → 서버 생성도 멈춤). 원본 호출 객체/GAPIC 응답 둘 다."""
+    cancel = getattr(resp, "cancel", None) or getattr(getattr(resp, "_iterator", None), "cancel", None)
+    if callable(cancel):
+        try:
+            cancel()
+        except Exception:
+            pass
+
+
+def _hedged_generate(pool, key, request, cls, on_chunk=None, exclude=()):
+    """request(key) → pool.stream(...) 호출 객체 (바로 반환, 첫 청크 전에도 취소 가능). key로 먼저 보내고, 첫 청크가
+    cls의 hedge 기준보다 늦으면 다른 키로 한 번 더 보냄. 먼저 청크(또는 완료)가 온 쪽이 이기고 진 쪽은 취소.
+    각 요청은 자기 스레드에서 대기열 슬롯을 잡음 (hedge는 빈 슬롯이 바로 없으면 포기).
+    대기 콜백(on_wait)은 UI를 건드리므로 이벤트로 넘겨 호출한 스레드에서 부르고, 진 쪽은 승자가 정해지는 즉시 여기서 취소
+    → 진 쪽 스트림이 끊기면서 그 스레드도 바로 슬롯을 반납.
+    반환 (전체 텍스트, 응답, 이긴 키). 둘 다 실패하면 원래 요청의 예외."""
+    hedger = get_gemini_hedger()
+    ctx = getattr(_GEMINI_TLOCAL, "ctx", None) or {}
+    on_wait = ctx.get("on_wait")
+    events = queue.Queue()
+    lock = threading.Lock()
+    state = {"winner": None}
+    keys = {"primary": key}
+    resps = {}
+    t0 = time.time()
+
+    def _race(name, k, wait_sec, report_wait):
+        try:
+            relay = (lambda *a: events.put((name, "wait", a))) if report_wait and on_wait else None
+            with gemini_request_context(ctx.get("priority", GEMINI_PRIO_REPORT), ctx.get("user_id"), relay):
+                with GeminiInflightSlot(wait_sec=wait_sec):
+                    if state["winner"] not in (None, name):
+                        return
+                    events.put((name, "admitted", None))
+                    call = request(k)
+                    # 첫 청크를 기다리기 전에 호출 객체를 올려 둠 → 그 사이 상대가 이기면 _cancel_loser가 바로 끊음
+                    with lock:
+                        resps[name] = call
+                        lost = state["winner"] not in (None, name)
+                    if lost:
+                        _cancel_stream(call)
+                        return
+                    last = None
+                    for chunk in call:
+                        last = chunk
+                        delta = _gemini_chunk_text(chunk)
+                        if not delta:
+                            continue
+                        with lock:
+                            state["winner"] = state["winner"] or name
+                            lost = state["winner"] != name
+                        if lost:
+                            _cancel_stream(call)
+                            return
+                        events.put((name, "chunk", delta))
+            events.put((name, "done", GenerateContentResponse.from_response(last) if last is not None else None))
+        except Exception as e:
+            if isinstance(e, grpc.RpcError):
+                e = from_grpc_error(e)
+            # 승부가 난 뒤에 온 오류도 여기서 처리되도록 키 퇴역은 경주 스레드에서 (이미 쿨다운 중이면 retire가 무시)
+            if _is_quota_error(e):
+                pool.retire(k)
+            with lock:
+                lost = state["winner"] not in (None, name)
+            if not lost:   # 진 쪽 오류(취소로 인한 CANCELLED 포함)는 알릴 것 없음
+                events.put((name, "error", e))
+
+    def _cancel_loser(winner):
+        with lock:
+            resp = resps.get("hedge" if winner == "primary" else "primary")
+        if resp is not None:
+            _cancel_stream(resp)
+
+    threading.Thread(target=_race, args=("primary", key, None, True),
+                     name="gemini-primary", daemon=True).start()
+    hedge_at = t0 + hedger.threshold(cls) if GEMINI_HEDGE_ENABLED else None
+    parts, errors, first, admitted = [], {}, None, set()
+    while True:
+        timeout = max(0.0, hedge_at - time.time()) if hedge_at is not None and first is None else None
+        try:
+            name, kind, val = events.get(timeout=timeout)
+        except queue.Empty:
+            hedge_at = None   # 요청당 hedge는 한 번만
+            k2 = pool.next_key(exclude=set(exclude) | {key})
+            if k2 and pool.healthy(k2) and hedger.allow():
+                keys["hedge"] = k2
+                # hedge는 슬롯 대기 없이 (wait_sec=0) → 빈 슬롯이 없으면 TimeoutError로 조용히 빠짐
+                threading.Thread(target=_race, args=("hedge", k2, 0, False), name="gemini-hedge", daemon=True).start()
+                print(f"[gemini hedge] {cls} no first chunk after {time.time() - t0:.1f}s → duplicate on another key")
+            continue
+        if kind == "wait":
+            on_wait(*val)
+            continue
+        if kind == "admitted":
+            admitted.add(name)
+            continue
+        if kind == "chunk":
+            if first is None:
+                first = name
+                hedger.observe(cls, time.time() - t0)
+                _cancel_loser(name)
+            parts.append(val)
+            if on_chunk is not None:
+                on_chunk(val)
+            continue
+        if kind == "done":
+            with lock:
+                state["winner"] = state["winner"] or name
+            if state["winner"] != name:
+                continue
+            _cancel_loser(name)
+            hedger.record("hedge" in admitted, hedge_won=name == "hedge")
+            return "".join(parts), val, keys[name]
+        # error
+        errors[name] = val
+        other = "hedge" if name == "primary" else "primary"
+        if state["winner"] == name or other not in keys or other in errors:
+            hedger.record("hedge" in admitted)
+            raise errors.get("primary", val)
+
+
 def call_gemini_rotating(model_name, keys, system_instruction, user_payload,
-                         timeout_s=240, max_tokens=8192) -> str:
-    rk = RotatingKeys(keys, "gem_key_idx")
-    if not rk.current():
+                         timeout_s=GEMINI_TIMEOUT, max_tokens=8192, on_chunk=None) -> str:
+    # 키/클라이언트는 프로세스 전역 풀에서 (스레드 안전, st.session_state 안 씀 → 백그라운드 잡에서도 그대로 호출)
+    # on_chunk(delta)를 넘기면 스트리밍으로 생성하면서 조각마다 호출 (반환값은 그대로 전체 텍스트)
+    pool = get_gemini_client_pool(tuple(keys or ()))
+    if not pool.keys:
         raise RuntimeError("Gemini API Key가 비어 있습니다.")
 
     real_sys_inst = None if (not system_instruction or not system_instruction.strip()) else system_instruction
@@ -1971,20 +3183,44 @@ def call_gemini_rotating(model_name, keys, system_instruction, user_payload,
         HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
     }
 
-    for _ in range(len(rk.keys) or 1):
+    emitted = []
+    def _emit(delta):
+        emitted.append(len(delta))
+        on_chunk(delta)
+
+    tried = set()
+    hedge_cls = GeminiHedger.call_class((getattr(_GEMINI_TLOCAL, "ctx", None) or {}).get("priority", GEMINI_PRIO_REPORT),
+                                        len(user_payload or "") + len(real_sys_inst or ""))
+    for _ in range(len(pool.keys)):
+        key = pool.next_key(exclude=tried)
+        tried.add(key)
         try:
-            genai.configure(api_key=rk.current())
-            model = genai.GenerativeModel(
-                model_name,
-                generation_config={"temperature": 0.2, "max_output_tokens": max_tokens},
-                system_instruction=real_sys_inst 
-            )
-            with GeminiInflightSlot():
-                resp = model.generate_content(
-                    user_payload,
-                    request_options={"timeout": timeout_s},
-                    safety_settings=safety_settings 
-                )
+            model = pool.model(key, model_name, {"temperature": 0.2, "max_output_tokens": max_tokens}, real_sys_inst)
+            if GEMINI_HEDGE_ENABLED and len(pool.keys) > 1:
+                # 키가 둘 이상이면 스트리밍으로 받으면서, 첫 청크가 늦으면 다른 키와 경주 (결과는 전체 텍스트 그대로)
+                req = _gemini_stream_request(model_name, user_payload,
+                                             {"temperature": 0.2, "max_output_tokens": max_tokens},
+                                             real_sys_inst, safety_settings)
+                text, resp, won_key = _hedged_generate(
+                    pool, key, lambda k: pool.stream(k, req, timeout=timeout_s),
+                    hedge_cls, on_chunk=_emit if on_chunk is not None else None, exclude=tried)
+                pool.ok(won_key)
+                if text:
+                    return text
+            else:
+                with GeminiInflightSlot():
+                    resp = model.generate_content(
+                        user_payload,
+                        request_options={"timeout": timeout_s},
+                        safety_settings=safety_settings,
+                        stream=on_chunk is not None
+                    )
+                    if on_chunk is not None and resp:
+                        text = _gemini_stream_text(resp, _emit)
+                        if text:
+                            pool.ok(key)
+                            return text
+                pool.ok(key)
             
             if not resp: return "⚠️ AI 응답 없음"
             try:
@@ -2000,19 +3236,226 @@ def call_gemini_rotating(model_name, keys, system_instruction, user_payload,
         except Exception as e:
             if isinstance(e, TimeoutError) or "GEMINI_INFLIGHT_TIMEOUT" in str(e):
                 return "⚠️ 현재 요청이 많아 AI 분석 대기열이 꽉 찼습니다. 잠시 후 다시 시도해주세요."
-            msg = str(e).lower()
-            if "429" in msg or "quota" in msg:
-                if len(rk.keys) > 1:
-                    rk.rotate()
+            if _is_quota_error(e):
+                pool.retire(key)
+                # 이미 화면에 흘려보낸 조각이 있으면 다른 키로 처음부터 다시 받지 않음 (중복 출력 방지)
+                if not emitted and len(tried) < len(pool.keys):
                     continue
             print(f"Gemini API Error: {e}")
             raise e
     return ""
 
+def gemini_context_hash(model_name, system_instruction, large_context_text) -> str:
+    raw = "\x00".join([model_name or "", system_instruction or "", large_context_text or ""])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class GeminiCacheRegistry:
+    """프로세스 전역(+Mongo) CachedContent 레지스트리. 키 = hash(모델 + system prompt + 컨텍스트).
+    - 같은 컨텍스트로 첫 질문이 들어오면 새로 만들지 않고 기존 캐시를 같이 씀
+    - 생성 키(kid), 만료 시각, 참조 수(이 캐시를 current_cache로 들고 있는 세션 수)를 관리
+    - 참조 수(refs, $inc)와 마지막 사용 시각(lastUsed)은 Mongo 문서에 두어 레플리카끼리 공유 (메모리 값은 이 프로세스 몫)
+    - TTL 연장은 만료가 GEMINI_CACHE_REFRESH_MARGIN_MIN 이내로 남았을 때만 (후속 질문마다 update 호출 X)
+    - 만료됐거나, 참조 0인 채로 GEMINI_CACHE_IDLE_EVICT_SEC 이상 놀고 있는 캐시는 정리.
+      삭제는 Mongo에서 refs==0 조건부 find_one_and_delete에 성공한 레플리카만 (다른 레플리카가 쓰는 캐시는 안 지움)
+    """
+    SWEEP_SEC = 30
+    KEY_LOCK_STRIPES = 64
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mem = {}          # hash -> {"name", "kid", "expire_at", "refs", "last_used", "obj"}
+        # 같은 컨텍스트의 캐시 생성은 하나만. 해시마다 락을 만들면 계속 쌓이므로 고정 개수를 해시로 나눠 씀
+        self._key_locks = [threading.Lock() for _ in range(self.KEY_LOCK_STRIPES)]
+        self._last_sweep = 0.0
+        self._indexed = False
+
+    @staticmethod
+    def _kid(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+    def _coll(self):
+        try:
+            coll = _mongo_aux_coll("gemini_cache_coll", "ytcc_gemini_caches")
+        except Exception:
+            return None
+        if coll is not None and not self._indexed:
+            try:
+                from pymongo import ASCENDING  # type: ignore
+                coll.create_index([("expiresAt", ASCENDING)], expireAfterSeconds=0)
+            except Exception:
+                pass
+            self._indexed = True
+        return coll
+
+    def key_lock(self, h) -> threading.Lock:
+        return self._key_locks[int(h[:8], 16) % self.KEY_LOCK_STRIPES]
+
+    def lookup(self, h, keys):
+        """살아 있는 항목이면 {"name", "key", "expire_at", "obj"} (key는 keys 중 생성 키), 아니면 None."""
+        self.sweep(keys)
+        with self._lock:
+            entry = self._mem.get(h)
+        if entry is None and (coll := self._coll()) is not None:
+            try:
+                doc = coll.find_one({"_id": h})
+            except Exception as e:
+                print(f"⚠️ [gemini cache] load failed: {e}")
+                doc = None
+            if doc and doc.get("expiresAt"):
+                entry = {"name": doc["name"], "kid": doc["kid"], "refs": 0, "obj": None, "last_used": time.time(),
+                         "expire_at": doc["expiresAt"].replace(tzinfo=timezone.utc).timestamp()}
+                with self._lock:
+                    entry = self._mem.setdefault(h, entry)
+        if entry is None or entry["expire_at"] <= time.time() + 30:
+            return None
+        by_kid = {self._kid(k): k for k in keys}
+        if entry["kid"] not in by_kid:
+            return None
+        return {**entry, "key": by_kid[entry["kid"]]}
+
+    def put(self, h, cache_obj, key, ttl_min):
+        expire_at = time.time() + ttl_min * 60
+        with self._lock:
+            self._mem[h] = {"name": cache_obj.name, "kid": self._kid(key), "expire_at": expire_at,
+                            "refs": 0, "last_used": time.time(), "obj": cache_obj}
+        self._save(h, new=True)
+
+    def _save(self, h, new=False):
+        """new=True: 새로 만든 캐시 → 공유 참조 수도 0부터 (같은 hash의 예전 캐시 문서를 덮어씀)."""
+        coll = self._coll()
+        with self._lock:
+            entry = dict(self._mem.get(h) or {})
+        if coll is None or not entry:
+            return
+        fields = {"name": entry["name"], "kid": entry["kid"],
+                  "expiresAt": datetime.fromtimestamp(entry["expire_at"], tz=timezone.utc).replace(tzinfo=None)}
+        try:
+            if new:
+                fields.update(refs=0, lastUsed=datetime.utcnow())
+                coll.update_one({"_id": h}, {"$set": fields}, upsert=True)
+            else:
+                coll.update_one({"_id": h}, {"$set": fields, "$setOnInsert": {"refs": 0, "lastUsed": datetime.utcnow()}},
+                                upsert=True)
+        except Exception as e:
+            print(f"⚠️ [gemini cache] save failed: {e}")
+
+    def _shared_refs(self, h, delta):
+        if (coll := self._coll()) is None:
+            return
+        cond = {"_id": h} if delta > 0 else {"_id": h, "refs": {"$gt": 0}}
+        try:
+            coll.update_one(cond, {"$inc": {"refs": delta}, "$set": {"lastUsed": datetime.utcnow()}})
+        except Exception as e:
+            print(f"⚠️ [gemini cache] refs update failed: {e}")
+
+    def remember(self, h, cache_obj):
+        with self._lock:
+            if h in self._mem:
+                self._mem[h]["obj"] = cache_obj
+
+    def acquire(self, h):
+        with self._lock:
+            if h in self._mem:
+                self._mem[h]["refs"] += 1
+                self._mem[h]["last_used"] = time.time()
+        self._shared_refs(h, 1)
+
+    def release(self, h):
+        with self._lock:
+            if h in self._mem:
+                self._mem[h]["refs"] = max(0, self._mem[h]["refs"] - 1)
+                self._mem[h]["last_used"] = time.time()
+        self._shared_refs(h, -1)
+
+    def needs_refresh(self, h) -> bool:
+        with self._lock:
+            entry = self._mem.get(h)
+            if entry is None:
+                return True
+            entry["last_used"] = time.time()
+            return entry["expire_at"] - time.time() < GEMINI_CACHE_REFRESH_MARGIN_MIN * 60
+
+    def refreshed(self, h, ttl_min):
+        with self._lock:
+            if h in self._mem:
+                self._mem[h]["expire_at"] = time.time() + ttl_min * 60
+        self._save(h)
+
+    def forget(self, h):
+        with self._lock:
+            self._mem.pop(h, None)
+        if (coll := self._coll()) is not None:
+            try:
+                coll.delete_one({"_id": h})
+            except Exception:
+                pass
+
+    def sweep(self, keys):
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < self.SWEEP_SEC:
+                return
+            self._last_sweep = now
+            expired = [h for h, e in self._mem.items() if e["expire_at"] <= now]
+            idle = [(h, e) for h, e in self._mem.items()
+                    if e["expire_at"] > now and e["refs"] <= 0 and now - e["last_used"] > GEMINI_CACHE_IDLE_EVICT_SEC]
+            for h in expired:
+                self._mem.pop(h, None)
+        by_kid = {self._kid(k): k for k in keys}
+        coll = self._coll()
+        for h, e in idle:
+            key = by_kid.get(e["kid"])
+            if not key:
+                continue
+            if coll is not None:
+                # 다른 레플리카가 아직 참조 중이거나 최근에 썼으면 문서가 안 지워짐 → 메모리에서만 내려놓음
+                try:
+                    won = coll.find_one_and_delete({
+                        "_id": h, "name": e["name"], "refs": {"$lte": 0},
+                        "lastUsed": {"$lt": datetime.utcnow() - timedelta(seconds=GEMINI_CACHE_IDLE_EVICT_SEC)}})
+                except Exception as ex:
+                    print(f"⚠️ [gemini cache] evict claim failed: {ex}")
+                    won = None
+                if won is None:
+                    with self._lock:
+                        if self._mem.get(h) is e and e["refs"] <= 0:
+                            self._mem.pop(h, None)
+                    continue
+            try:
+                pool = get_gemini_client_pool(tuple(keys))
+                pool.cache_call(key, lambda: (e.get("obj") or caching.CachedContent.get(e["name"])).delete())
+                print(f"[gemini cache] evict idle cache {e['name']}")
+            except Exception as ex:
+                print(f"⚠️ [gemini cache] delete failed: {ex}")
+            # 문서는 위 조건부 삭제로 이미 지움 (그 사이 다른 레플리카가 같은 hash로 새로 만든 문서는 건드리지 않음)
+            if coll is None:
+                self.forget(h)
+            else:
+                with self._lock:
+                    self._mem.pop(h, None)
+
+
+@st.cache_resource
+def get_gemini_cache_registry() -> GeminiCacheRegistry:
+    return GeminiCacheRegistry()
+
+def release_gemini_cache(cached_info):
+    """세션이 current_cache를 버릴 때 (새 분석/새 1차 질문) 참조 수 반납."""
+    if isinstance(cached_info, dict) and cached_info.get("hash"):
+        get_gemini_cache_registry().release(cached_info["hash"])
+
+
 def call_gemini_smart_cache(model_name, keys, system_instruction, user_query, 
-                            large_context_text=None, cache_key_in_session="current_cache"):
-    rk = RotatingKeys(keys, "gem_key_idx")
-    cached_info = st.session_state.get(cache_key_in_session, None)
+                            large_context_text=None, cache_key_in_session="current_cache", session=None,
+                            on_chunk=None):
+    # session: 캐시 정보를 읽고 쓸 dict (기본 st.session_state, 백그라운드 잡은 잡 전용 dict)
+    # on_chunk: 스트리밍 조각 콜백 (call_gemini_rotating과 동일)
+    pool = get_gemini_client_pool(tuple(keys or ()))
+    gen_config = {"temperature": 0.2, "max_output_tokens": GEMINI_MAX_TOKENS}
+    model_key = None   # final_model을 만든 키 (생성 중 429면 이 키를 쿨다운)
+    session = st.session_state if session is None else session
+    cached_info = session.get(cache_key_in_session, None)
     
     active_cache = None
     final_model = None
@@ -2025,91 +3468,268 @@ def call_gemini_smart_cache(model_name, keys, system_instruction, user_query,
         HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
     }
 
+    registry = get_gemini_cache_registry()
     if cached_info and not large_context_text:
         cache_name = cached_info.get("name")
         creator_key = cached_info.get("key")
+        h = cached_info.get("hash")
         
-        genai.configure(api_key=creator_key)
         try:
-            active_cache = caching.CachedContent.get(cache_name)
-            with GeminiInflightSlot():
-                active_cache.update(ttl=timedelta(minutes=CACHE_TTL_MINUTES))
+            # 이 프로세스가 만든/받아 둔 객체가 있으면 get 호출 생략, TTL은 만료 임박일 때만 연장
+            entry = registry.lookup(h, pool.keys) if h else None
+            active_cache = (entry or {}).get("obj") or pool.cache_call(creator_key, lambda: caching.CachedContent.get(cache_name))
+            if not h or registry.needs_refresh(h):
+                with GeminiInflightSlot():
+                    pool.cache_call(creator_key, lambda: active_cache.update(ttl=timedelta(minutes=CACHE_TTL_MINUTES)))
+                if h:
+                    registry.refreshed(h, CACHE_TTL_MINUTES)
+            if h:
+                registry.remember(h, active_cache)
             
-            final_model = genai.GenerativeModel.from_cached_content(
-                cached_content=active_cache,
-                generation_config={"temperature": 0.2, "max_output_tokens": GEMINI_MAX_TOKENS}
-            )
+            final_model = pool.cached_model(creator_key, active_cache, gen_config)
+            model_key = creator_key
         except Exception as e:
             active_cache = None
-            large_context_text = st.session_state.get("sample_text_full_context", "")
+            if h:
+                registry.release(h)
+                registry.forget(h)
+            large_context_text = session.get("sample_text_full_context", "")
             if not large_context_text:
                 return "⚠️ [오류] 세션이 만료되어 복구할 데이터가 없습니다. 새로고침 해주세요."
 
     if not active_cache and large_context_text:
-        st.session_state["sample_text_full_context"] = large_context_text
-
-        for _ in range(len(rk.keys)):
-            current_key = rk.current()
-            genai.configure(api_key=current_key)
-            try:
-                # [수정 부분 시작] system_instruction이 빈 문자열이면 None으로 처리
-                real_sys_inst = system_instruction if (system_instruction and system_instruction.strip()) else None
-                # [수정 부분 끝]
-
-                with GeminiInflightSlot():
-                    active_cache = caching.CachedContent.create(
-                        model=model_name,
-                        display_name=f"ytcc_{uuid4().hex[:8]}",
-                        system_instruction=real_sys_inst,  # 수정된 변수 사용
-                        contents=[large_context_text],
-                        ttl=timedelta(minutes=CACHE_TTL_MINUTES)
-                    )
+        session["sample_text_full_context"] = large_context_text
+        real_sys_inst = system_instruction if (system_instruction and system_instruction.strip()) else None
+        h = gemini_context_hash(model_name, real_sys_inst, large_context_text)
+
+        # 다른 세션이 같은 컨텍스트로 이미 만든 캐시가 살아 있으면 그대로 공유
+        with registry.key_lock(h):
+            entry = registry.lookup(h, pool.keys)
+            if entry:
+                try:
+                    active_cache = entry.get("obj") or pool.cache_call(
+                        entry["key"], lambda: caching.CachedContent.get(entry["name"]))
+                    registry.remember(h, active_cache)
+                    registry.acquire(h)
+                    session[cache_key_in_session] = {"name": active_cache.name, "key": entry["key"], "hash": h}
+                    final_model = pool.cached_model(entry["key"], active_cache, gen_config)
+                    model_key = entry["key"]
+                    print(f"[gemini cache] reuse {active_cache.name}")
+                except Exception as e:
+                    print(f"⚠️ [gemini cache] shared cache unusable: {e}")
+                    registry.forget(h)
+                    active_cache = None
+            # 없으면 새로 생성 (같은 컨텍스트가 동시에 들어와도 한 번만 만들도록 키 락 안에서)
+            # 단, 추정 토큰이 최소 캐시 크기에 못 미치면 만들지 않고 인라인 (실패 왕복/보관비 절약)
+            tokens_est = get_token_estimator().estimate(f"{real_sys_inst or ''}\n{large_context_text}")
+            make_cache = tokens_est >= GEMINI_CACHE_MIN_TOKENS
+            if not active_cache:
+                print(f"[METRICS] gemini_context tokens_est={tokens_est} decision={'cache' if make_cache else 'inline'}")
+            tried = set()
+            for _ in range(len(pool.keys) if not active_cache and make_cache else 0):
+                current_key = pool.next_key(exclude=tried)
+                tried.add(current_key)
+                try:
+                    # [수정 부분 시작] system_instruction이 빈 문자열이면 None으로 처리
+                    real_sys_inst = system_instruction if (system_instruction and system_instruction.strip()) else None
+                    # [수정 부분 끝]
+
+                    with GeminiInflightSlot():
+                        active_cache = pool.cache_call(current_key, lambda: caching.CachedContent.create(
+                            model=model_name,
+                            display_name=f"ytcc_{uuid4().hex[:8]}",
+                            system_instruction=real_sys_inst,  # 수정된 변수 사용
+                            contents=[large_context_text],
+                            ttl=timedelta(minutes=CACHE_TTL_MINUTES)
+                        ))
+                    registry.put(h, active_cache, current_key, CACHE_TTL_MINUTES)
+                    registry.acquire(h)
                 
-                st.session_state[cache_key_in_session] = {
-                    "name": active_cache.name,
-                    "key": current_key
-                }
+                    session[cache_key_in_session] = {
+                        "name": active_cache.name,
+                        "key": current_key,
+                        "hash": h
+                    }
                 
-                final_model = genai.GenerativeModel.from_cached_content(
-                    cached_content=active_cache,
-                    generation_config={"temperature": 0.2, "max_output_tokens": GEMINI_MAX_TOKENS}
-                )
-                break
-            except Exception as e:
-                msg = str(e).lower()
-                if "too short" in msg or "argument" in msg:
-                    active_cache = None
+                    final_model = pool.cached_model(current_key, active_cache, gen_config)
+                    model_key = current_key
                     break
-                if "429" in msg or "quota" in msg:
-                    rk.rotate()
-                    continue
-                raise e
+                except Exception as e:
+                    msg = str(e).lower()
+                    if "too short" in msg or "argument" in msg:
+                        # 추정치가 실제보다 컸던 경우 → 관리자 '토큰 추정 보정'으로 배율을 다시 맞출 것
+                        print(f"⚠️ [gemini cache] create rejected at tokens_est={tokens_est}: {e}")
+                        active_cache = None
+                        break
+                    if _is_quota_error(e):
+                        pool.retire(current_key)
+                        continue
+                    raise e
 
     try:
-        if final_model:
+        inline_ctx = session.get("sample_text_full_context", "")
+        if final_model and GEMINI_HEDGE_ENABLED and len(pool.keys) > 1 and inline_ctx:
+            # 캐시는 만든 키에서만 쓸 수 있어서, hedge는 다른 키에 컨텍스트를 인라인으로 붙여 보냄
+            inline_sys = system_instruction if (system_instruction and system_instruction.strip()) else None
+            cached_req = _gemini_stream_request(model_name, user_query, gen_config,
+                                                safety_settings=safety_settings, cached_content=active_cache)
+            inline_req = _gemini_stream_request(model_name, f"{inline_ctx}\n\n{user_query}", gen_config,
+                                                inline_sys, safety_settings)
+            def _request(k):
+                return pool.stream(k, cached_req if k == model_key else inline_req, timeout=GEMINI_TIMEOUT)
+            hedge_cls = GeminiHedger.call_class((getattr(_GEMINI_TLOCAL, "ctx", None) or {}).get("priority", GEMINI_PRIO_REPORT),
+                                                len(inline_ctx) + len(user_query or ""))
+            text, resp, won_key = _hedged_generate(pool, model_key, _request, hedge_cls, on_chunk=on_chunk)
+            if text: return text
+        elif final_model:
             with GeminiInflightSlot():
-                resp = final_model.generate_content(user_query, safety_settings=safety_settings)
+                resp = final_model.generate_content(user_query, safety_settings=safety_settings,
+                                                    stream=on_chunk is not None,
+                                                    request_options={"timeout": GEMINI_TIMEOUT})
+                if on_chunk is not None and resp:
+                    text = _gemini_stream_text(resp, on_chunk)
+                    if text: return text
         else:
+            # 인라인: 후속 질문(large_context_text=None)은 세션에 남긴 1차 컨텍스트를 다시 붙여서 보냄
+            large_context_text = large_context_text or session.get("sample_text_full_context", "")
             full_payload = f"{system_instruction}\n\n{large_context_text or ''}\n\n{user_query}"
-            return call_gemini_rotating(model_name, keys, None, full_payload)
+            return call_gemini_rotating(model_name, keys, None, full_payload, on_chunk=on_chunk)
 
         if resp and resp.text: return resp.text
         return "⚠️ [시스템] AI 응답 없음 (빈 내용)"
     except Exception as e:
+        if model_key and _is_quota_error(e):
+            pool.retire(model_key)
         if isinstance(e, TimeoutError) or "GEMINI_INFLIGHT_TIMEOUT" in str(e):
             return "⚠️ 현재 요청이 많아 AI 분석 대기열이 꽉 찼습니다. 잠시 후 다시 시도해주세요."
         return f"⚠️ [시스템] 처리 중 에러: {e}"
 
-def yt_search_videos(rt, keyword, max_results, order="viewCount",
-                     published_after=None, published_before=None):
-    video_ids, token = [], None
-    while len(video_ids) < max_results:
-        params = {
-            "q": keyword, "part": "id", "type": "video", "order": order,
-            "maxResults": min(50, max_results - len(video_ids))
-        }
-        if published_after: params["publishedAfter"] = published_after
-        if published_before: params["publishedBefore"] = published_before
+def _snap_rfc3339(ts: str, bucket_min: int, up: bool) -> str:
+    """RFC3339(UTC) 시각을 bucket_min 단위로 내림(up=False)/올림(up=True)."""
+    if not ts:
+        return ts
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00")).astimezone(timezone.utc)
+    except Exception:
+        return ts
+    step = bucket_min * 60
+    epoch = int(dt.timestamp())
+    snapped = (epoch // step) * step
+    if up and snapped < epoch:
+        snapped += step
+    return datetime.fromtimestamp(snapped, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+
+def _normalize_search_keyword(keyword: str) -> str:
+    import unicodedata
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", keyword or "")).strip().lower()
+
+
+class SearchResultCache:
+    """프로세스 전역 + Mongo(TTL) search.list 결과 캐시.
+    키 = (정규화 키워드, order, 버킷 단위로 맞춘 기간, max_results)."""
+    KEY_LOCK_STRIPES = 64
+
+    def __init__(self, ttl_min: int = YT_SEARCH_CACHE_TTL_MIN):
+        self.ttl_sec = ttl_min * 60
+        self._lock = threading.Lock()
+        self._mem = {}         # key -> (expires_at, ids)
+        # 같은 검색이 동시에 들어오면 하나만 API 호출. 키마다 락을 만들면 계속 쌓이므로 고정 개수를 키 해시로 나눠 씀
+        self._key_locks = [threading.Lock() for _ in range(self.KEY_LOCK_STRIPES)]
+        self._indexed = False
+
+    @staticmethod
+    def make_key(keyword, order, published_after, published_before, max_results) -> str:
+        raw = json.dumps([_normalize_search_keyword(keyword), order, published_after or "",
+                          published_before or "", int(max_results)], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _coll(self):
+        try:
+            coll = _mongo_aux_coll("search_cache_coll", "ytcc_search_cache")
+        except Exception:
+            return None
+        if coll is not None and not self._indexed:
+            try:
+                from pymongo import ASCENDING  # type: ignore
+                coll.create_index([("expiresAt", ASCENDING)], expireAfterSeconds=0)
+            except Exception:
+                pass
+            self._indexed = True
+        return coll
+
+    def key_lock(self, key) -> threading.Lock:
+        return self._key_locks[int(key[:8], 16) % self.KEY_LOCK_STRIPES]
+
+    def get(self, key):
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit and hit[0] > time.time():
+                return list(hit[1])
+        coll = self._coll()
+        if coll is None:
+            return None
+        try:
+            doc = coll.find_one({"_id": key})
+        except Exception as e:
+            print(f"⚠️ [search cache] load failed: {e}")
+            return None
+        if not doc or not doc.get("expiresAt") or doc["expiresAt"] <= datetime.utcnow():
+            return None
+        ids = list(doc.get("video_ids") or [])
+        remain = (doc["expiresAt"] - datetime.utcnow()).total_seconds()
+        with self._lock:
+            self._mem[key] = (time.time() + remain, ids)
+        return list(ids)
+
+    def put(self, key, ids, meta: dict = None):
+        with self._lock:
+            self._mem[key] = (time.time() + self.ttl_sec, list(ids))
+            if len(self._mem) > 2000:
+                now = time.time()
+                self._mem = {k: v for k, v in self._mem.items() if v[0] > now}
+        coll = self._coll()
+        if coll is None:
+            return
+        try:
+            coll.update_one({"_id": key}, {"$set": {
+                "video_ids": list(ids), "meta": meta or {},
+                "expiresAt": datetime.utcnow() + timedelta(seconds=self.ttl_sec),
+            }}, upsert=True)
+        except Exception as e:
+            print(f"⚠️ [search cache] save failed: {e}")
+
+
+@st.cache_resource
+def get_search_result_cache() -> SearchResultCache:
+    return SearchResultCache()
+
+
+def yt_search_videos(rt, keyword, max_results, order="viewCount",
+                     published_after=None, published_before=None):
+    # 기간을 버킷 경계로 넓혀서 조회 → 같은 버킷 안의 반복 질의는 캐시 적중 (search.list = 100 units/page)
+    published_after = _snap_rfc3339(published_after, YT_SEARCH_CACHE_BUCKET_MIN, up=False)
+    published_before = _snap_rfc3339(published_before, YT_SEARCH_CACHE_BUCKET_MIN, up=True)
+    cache = get_search_result_cache()
+    key = cache.make_key(keyword, order, published_after, published_before, max_results)
+    if (hit := cache.get(key)) is not None:
+        return hit
+    with cache.key_lock(key):
+        if (hit := cache.get(key)) is not None:
+            return hit
+        video_ids = _yt_search_videos_uncached(rt, keyword, max_results, order, published_after, published_before)
+        cache.put(key, video_ids, {"q": keyword, "order": order, "after": published_after, "before": published_before})
+    return video_ids
+
+def _yt_search_videos_uncached(rt, keyword, max_results, order="viewCount",
+                               published_after=None, published_before=None):
+    video_ids, token = [], None
+    while len(video_ids) < max_results:
+        params = {
+            "q": keyword, "part": "id", "type": "video", "order": order,
+            "maxResults": min(50, max_results - len(video_ids))
+        }
+        if published_after: params["publishedAfter"] = published_after
+        if published_before: params["publishedBefore"] = published_before
         if token: params["pageToken"] = token
 
         resp = rt.execute(lambda s: s.search().list(**params))
@@ -2117,125 +3737,1328 @@ def yt_search_videos(rt, keyword, max_results, order="viewCount",
                          if it["id"]["videoId"] not in video_ids)
         if not (token := resp.get("nextPageToken")):
             break
-        time.sleep(0.25)
     return video_ids
 
-def yt_video_statistics(rt, video_ids):
-    rows = []
-    for i in range(0, len(video_ids), 50):
-        batch = video_ids[i:i+50]
-        if not batch: continue
+def _video_stats_row(item) -> dict:
+    stats, snip, cont = item.get("statistics", {}), item.get("snippet", {}), item.get("contentDetails", {})
 
-        resp = rt.execute(lambda s: s.videos().list(part="statistics,snippet,contentDetails", id=",".join(batch)))
-        for item in resp.get("items", []):
-            stats, snip, cont = item.get("statistics", {}), item.get("snippet", {}), item.get("contentDetails", {})
-            
-            # 1. Duration 변환 (ISO -> 초 -> MM:SS)
-            dur = cont.get("duration", "")
-            h, m, s = re.search(r"(\d+)H", dur), re.search(r"(\d+)M", dur), re.search(r"(\d+)S", dur)
-            dur_sec = (int(h.group(1))*3600 if h else 0) + (int(m.group(1))*60 if m else 0) + (int(s.group(1)) if s else 0)
-            
-            if dur_sec >= 3600:
-                dur_fmt = f"{dur_sec // 3600}:{(dur_sec % 3600) // 60:02}:{dur_sec % 60:02}"
-            else:
-                dur_fmt = f"{dur_sec // 60}:{dur_sec % 60:02}"
+    # 1. Duration 변환 (ISO -> 초 -> MM:SS)
+    dur = cont.get("duration", "")
+    h, m, s = re.search(r"(\d+)H", dur), re.search(r"(\d+)M", dur), re.search(r"(\d+)S", dur)
+    dur_sec = (int(h.group(1))*3600 if h else 0) + (int(m.group(1))*60 if m else 0) + (int(s.group(1)) if s else 0)
+
+    if dur_sec >= 3600:
+        dur_fmt = f"{dur_sec // 3600}:{(dur_sec % 3600) // 60:02}:{dur_sec % 60:02}"
+    else:
+        dur_fmt = f"{dur_sec // 60}:{dur_sec % 60:02}"
 
-            # 2. PublishedAt 변환 (UTC -> KST 문자열)
-            pub_raw = snip.get("publishedAt", "")
+    # 2. PublishedAt 변환 (UTC -> KST 문자열)
+    pub_raw = snip.get("publishedAt", "")
+    pub_kst = pub_raw
+    if pub_raw:
+        try:
+            # 'Z'를 '+00:00'으로 바꿔서 파싱 후 KST로 변환
+            dt = datetime.fromisoformat(pub_raw.replace("Z", "+00:00"))
+            dt = dt.astimezone(KST)
+            pub_kst = dt.strftime("%Y-%m-%d %H:%M:%S")
+        except Exception:
             pub_kst = pub_raw
-            if pub_raw:
-                try:
-                    # 'Z'를 '+00:00'으로 바꿔서 파싱 후 KST로 변환
-                    dt = datetime.fromisoformat(pub_raw.replace("Z", "+00:00"))
-                    dt = dt.astimezone(KST)
-                    pub_kst = dt.strftime("%Y-%m-%d %H:%M:%S")
-                except Exception:
-                    pub_kst = pub_raw
-
-            vid_id = item.get("id")
-            rows.append({
-                "video_id": vid_id,
-                "video_url": f"https://www.youtube.com/watch?v={vid_id}",
-                "title": snip.get("title", ""),
-                "channelTitle": snip.get("channelTitle", ""),
-                "publishedAt": pub_kst,   # [수정됨] KST 적용
-                "duration": dur_fmt,      # [수정됨] MM:SS 적용
-                "shortType": "Shorts" if dur_sec <= 60 else "Clip",
-                "viewCount": int(stats.get("viewCount", 0) or 0),
-                "likeCount": int(stats.get("likeCount", 0) or 0),
-                "commentCount": int(stats.get("commentCount", 0) or 0)
-            })
-        time.sleep(0.25)
-    return rows
 
-def yt_all_replies(rt, parent_id, video_id, title="", short_type="Clip", cap=None):
+    vid_id = item.get("id")
+    return {
+        "video_id": vid_id,
+        "video_url": f"https://www.youtube.com/watch?v={vid_id}",
+        "title": snip.get("title", ""),
+        "channelTitle": snip.get("channelTitle", ""),
+        "publishedAt": pub_kst,   # [수정됨] KST 적용
+        "duration": dur_fmt,      # [수정됨] MM:SS 적용
+        "shortType": "Shorts" if dur_sec <= 60 else "Clip",
+        "viewCount": int(stats.get("viewCount", 0) or 0),
+        "likeCount": int(stats.get("likeCount", 0) or 0),
+        "commentCount": int(stats.get("commentCount", 0) or 0)
+    }
+
+
+class VideoStatsService:
+    """프로세스 전역 videos.list 통계 캐시 + 요청 합치기(coalescer).
+    - video_id별 TTL 캐시(최대 max_items개 LRU): 몇 분 전에 다른 사용자가 조회한 영상은 API 호출 없이 반환
+    - 동시에 들어온 여러 세션의 미스 ID를 짧은 대기창(YT_STATS_BATCH_WINDOW_SEC) 동안 모아
+      50개 단위 호출로 합치고, 그 배치들은 순차가 아니라 병렬로 실행
+    - 같은 ID를 이미 다른 세션이 조회 중이면 그 결과(Future)를 같이 기다림
+    """
+    BATCH = 50
+
+    def __init__(self, keys, ttl_sec: int = YT_STATS_CACHE_TTL_SEC, window_sec: float = YT_STATS_BATCH_WINDOW_SEC,
+                 max_items: int = YT_STATS_CACHE_MAX_ITEMS):
+        self.keys = list(keys)
+        self.ttl_sec = ttl_sec
+        self.window_sec = window_sec
+        self.max_items = max(1, int(max_items))
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()   # vid -> (expires_at, row or None), LRU 순
+        self._inflight = {}   # vid -> Future
+        self._pending = []
+        self._timer = None
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="yt-stats")
+
+    def _fetch_batch(self, batch):
+        try:
+            rt = get_thread_youtube_client(self.keys)
+            resp = rt.execute(lambda s: s.videos().list(part="statistics,snippet,contentDetails", id=",".join(batch)))
+            found = {it.get("id"): _video_stats_row(it) for it in resp.get("items", [])}
+        except Exception as e:
+            with self._lock:
+                futs = [self._inflight.pop(v, None) for v in batch]
+            for f in futs:
+                if f is not None and not f.done():
+                    f.set_exception(e)
+            return
+        expires = time.time() + self.ttl_sec
+        with self._lock:
+            futs = []
+            for v in batch:
+                # 삭제/비공개 영상은 None으로 캐시 (같은 TTL 동안 다시 묻지 않음)
+                self._cache[v] = (expires, found.get(v))
+                self._cache.move_to_end(v)
+                futs.append((self._inflight.pop(v, None), found.get(v)))
+            while len(self._cache) > self.max_items:
+                self._cache.popitem(last=False)
+        for f, row in futs:
+            if f is not None and not f.done():
+                f.set_result(row)
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending, self._timer = self._pending, [], None
+        for i in range(0, len(pending), self.BATCH):
+            self._pool.submit(self._fetch_batch, pending[i:i + self.BATCH])
+
+    def get(self, video_ids, timeout: float = 120) -> list:
+        from concurrent.futures import Future
+        ids = list(dict.fromkeys(v for v in (video_ids or []) if v))
+        now = time.time()
+        waits, hits, full_batches = {}, {}, []
+        with self._lock:
+            for v in ids:
+                hit = self._cache.get(v)
+                if hit and hit[0] > now:
+                    self._cache.move_to_end(v)
+                    hits[v] = hit[1]
+                    continue
+                f = self._inflight.get(v)
+                if f is None:
+                    f = self._inflight[v] = Future()
+                    self._pending.append(v)
+                waits[v] = f
+            # 50개가 찼으면 바로 보내고, 나머지는 대기창 동안 다른 세션 요청과 합침
+            while len(self._pending) >= self.BATCH:
+                full_batches.append(self._pending[:self.BATCH])
+                self._pending = self._pending[self.BATCH:]
+            if self._pending and self._timer is None:
+                self._timer = threading.Timer(self.window_sec, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+        for batch in full_batches:
+            self._pool.submit(self._fetch_batch, batch)
+
+        rows = []
+        for v in ids:
+            if v in waits:
+                row = waits[v].result(timeout=timeout)
+            else:
+                row = hits.get(v)
+            if row is not None:
+                rows.append(row)
+        return rows
+
+
+@st.cache_resource
+def get_video_stats_service(key_tuple: tuple) -> VideoStatsService:
+    return VideoStatsService(key_tuple)
+
+
+def yt_video_statistics(rt, video_ids):
+    return get_video_stats_service(tuple(rt.pool.keys)).get(video_ids)
+
+def _yt_comment_row(video_id, title, short_type, comment_id, parent_id, sn):
+    return {
+        "video_id": video_id, "video_title": title, "shortType": short_type,
+        "comment_id": comment_id, "parent_id": parent_id, "isReply": 1 if parent_id else 0,
+        "author": sn.get("authorDisplayName", ""), "text": sn.get("textDisplay", "") or "",
+        "publishedAt": sn.get("publishedAt", ""), "likeCount": int(sn.get("likeCount", 0) or 0)
+    }
+
+def yt_all_replies(rt, parent_id, video_id, title="", short_type="Clip", cap=None, cancel=None):
     replies, token = [], None
     while not (cap is not None and len(replies) >= cap):
+        if cancel is not None and cancel.is_cancelled(): break
         try:
             resp = rt.execute(lambda s: s.comments().list(part="snippet", parentId=parent_id, maxResults=100, pageToken=token, textFormat="plainText"))
-        except HttpError: break
+        except YouTubeApiError: break
 
         for c in resp.get("items", []):
-            sn = c["snippet"]
-            replies.append({
-                "video_id": video_id, "video_title": title, "shortType": short_type,
-                "comment_id": c.get("id", ""), "parent_id": parent_id, "isReply": 1,
-                "author": sn.get("authorDisplayName", ""), "text": sn.get("textDisplay", "") or "",
-                "publishedAt": sn.get("publishedAt", ""), "likeCount": int(sn.get("likeCount", 0) or 0)
-            })
+            replies.append(_yt_comment_row(video_id, title, short_type, c.get("id", ""), parent_id, c["snippet"]))
         if not (token := resp.get("nextPageToken")): break
-        time.sleep(0.2)
     return replies[:cap] if cap is not None else replies
 
+@st.cache_resource
+def get_reply_expansion_pool() -> ThreadPoolExecutor:
+    """답글 페이징(comments.list) 전용 공유 풀. 영상 워커들이 여기에 던져놓고 결과만 모음."""
+    return ThreadPoolExecutor(max_workers=YT_REPLY_EXPAND_WORKERS, thread_name_prefix="yt-replies")
+
+def _expand_replies(rt_keys, parent_id, video_id, title, short_type, cap, cancel):
+    rt = get_thread_youtube_client(rt_keys)
+    return yt_all_replies(rt, parent_id, video_id, title, short_type, cap=cap, cancel=cancel)
+
+def _plan_thread_page(items, video_id, title, short_type, include_replies, budget_left):
+    """commentThreads 한 페이지를 (행 묶음, 답글 확장 요청) 목록으로 변환.
+    - 인라인 replies.comments로 답글이 다 오면 그대로 사용
+    - totalReplyCount가 인라인 개수보다 많은 스레드만 comments.list 확장 대상
+    - budget_left(None=무제한) 안에서 totalReplyCount 기준으로 캡을 나눠줌
+    반환: [(top_row, inline_rows, expand_cap_or_0)], 남은 budget
+    """
+    plan = []
+    for it in items:
+        if budget_left is not None and budget_left <= 0:
+            break
+        top = it["snippet"]["topLevelComment"]["snippet"]
+        thread_id = it["snippet"]["topLevelComment"]["id"]
+        top_row = _yt_comment_row(video_id, title, short_type, thread_id, "", top)
+        if budget_left is not None:
+            budget_left -= 1
+        inline_rows, expand_cap = [], 0
+        total_replies = int(it["snippet"].get("totalReplyCount", 0) or 0)
+        if include_replies and total_replies > 0:
+            inline = (it.get("replies") or {}).get("comments") or []
+            if len(inline) >= total_replies:
+                inline_rows = [_yt_comment_row(video_id, title, short_type, c.get("id", ""), thread_id, c["snippet"])
+                               for c in inline]
+                if budget_left is not None:
+                    inline_rows = inline_rows[:max(0, budget_left)]
+                    budget_left -= len(inline_rows)
+            else:
+                expand_cap = total_replies if budget_left is None else min(total_replies, max(0, budget_left))
+                if budget_left is not None:
+                    budget_left -= expand_cap
+        plan.append((top_row, inline_rows, expand_cap))
+    return plan, budget_left
+
+def _items_newer_than(items, since):
+    """order=time 페이지에서 watermark(since)보다 새 스레드만 남김. (남은 items, watermark 도달 여부)"""
+    if not since:
+        return items, False
+    newer = [it for it in items
+             if (it["snippet"]["topLevelComment"]["snippet"].get("publishedAt") or "") > since]
+    return newer, len(newer) < len(items)
+
 def yt_all_comments_sync(rt_keys, video_id, title="", short_type="Clip",
-                         include_replies=True, max_per_video=None):
-    # 워커 스레드에서 YouTube client를 1개만 재사용 (build() 남발 방지)
+                         include_replies=True, max_per_video=None, cancel=None,
+                         since=None, info=None, on_rows=None, page_token=None):
+    """since(publishedAt watermark)가 있으면 order=time으로 그 시점까지만 페이징.
+    info(dict)가 주어지면 끝까지(또는 watermark까지) 다 읽었는지 info["complete"]에 기록.
+    on_rows(page_rows, next_page_token)가 주어지면 페이지마다 바로 넘겨줌 (writer 단계로 스트리밍).
+    page_token을 주면 그 페이지부터 이어서 수집 (중단된 잡 재개용)."""
+    info = info if info is not None else {}
+    info["complete"] = False
+    if cancel is not None and cancel.is_cancelled():
+        return []
+    # 워커 스레드에서 YouTube client를 1개만 재사용
     rt = get_thread_youtube_client(rt_keys)
-    rows, token = [], None
+    reply_pool = get_reply_expansion_pool() if include_replies else None
+    rows, token = [], page_token
     while not (max_per_video is not None and len(rows) >= max_per_video):
+        if cancel is not None and cancel.is_cancelled(): break
         try:
-            resp = rt.execute(lambda s: s.commentThreads().list(part="snippet,replies", videoId=video_id, maxResults=100, pageToken=token, textFormat="plainText"))
-        except HttpError: break
-
-        for it in resp.get("items", []):
-            top = it["snippet"]["topLevelComment"]["snippet"]
-            thread_id = it["snippet"]["topLevelComment"]["id"]
-            rows.append({
-                "video_id": video_id, "video_title": title, "shortType": short_type,
-                "comment_id": thread_id, "parent_id": "", "isReply": 0,
-                "author": top.get("authorDisplayName", ""), "text": top.get("textDisplay", "") or "",
-                "publishedAt": top.get("publishedAt", ""), "likeCount": int(top.get("likeCount", 0) or 0)
-            })
-            if include_replies and int(it["snippet"].get("totalReplyCount", 0) or 0) > 0:
-                cap = None if max_per_video is None else max(0, max_per_video - len(rows))
-                if cap == 0: break
-                rows.extend(yt_all_replies(rt, thread_id, video_id, title, short_type, cap=cap))
-        if not (token := resp.get("nextPageToken")): break
-        time.sleep(0.2)
+            resp = rt.execute(lambda s: s.commentThreads().list(part="snippet,replies", videoId=video_id, maxResults=100, order="time", pageToken=token, textFormat="plainText"))
+        except YouTubeApiError: break
+
+        items, reached = _items_newer_than(resp.get("items", []), since)
+        budget_left = None if max_per_video is None else max_per_video - len(rows)
+        plan, _ = _plan_thread_page(items, video_id, title, short_type, include_replies, budget_left)
+        # 인라인으로 부족한 스레드만 공유 풀에서 동시에 확장
+        expansions = {
+            i: reply_pool.submit(_expand_replies, rt_keys, top_row["comment_id"], video_id, title, short_type, cap, cancel)
+            for i, (top_row, _, cap) in enumerate(plan) if cap > 0
+        }
+        page_start = len(rows)
+        for i, (top_row, inline_rows, _) in enumerate(plan):
+            rows.append(top_row)
+            rows.extend(inline_rows)
+            if i in expansions:
+                try:
+                    rows.extend(expansions[i].result())
+                except Exception:
+                    pass
+        token = None if reached else resp.get("nextPageToken")
+        if on_rows is not None and len(rows) > page_start:
+            on_rows(rows[page_start:], token)
+        if not token:
+            info["complete"] = True
+            break
     return rows[:max_per_video] if max_per_video is not None else rows
 
+
+# ---- 영상별 댓글 저장소 (watermark 증분 갱신) ----
+def _comment_store_coll():
+    if not YT_COMMENT_STORE_ENABLED:
+        return None
+    try:
+        coll = _mongo_aux_coll("comment_store_coll", "ytcc_comment_store")
+    except Exception:
+        return None
+    from pymongo import ASCENDING  # type: ignore
+    # expiresAt TTL → 오래 안 쓰인 영상 댓글은 Mongo가 알아서 지움
+    _mongo_aux_ensure_indexes("comment_store_coll", coll,
+                              [([("expiresAt", ASCENDING)], {"expireAfterSeconds": 0})], "comment store")
+    return coll
+
+def comment_store_load(video_id, include_replies, max_per_video):
+    """재사용 가능한 저장 항목이면 {"rows", "watermark", "complete", "include_replies"} 반환, 아니면 None."""
+    coll = _comment_store_coll()
+    if coll is None:
+        return None
+    try:
+        doc = coll.find_one({"_id": video_id})
+    except Exception as e:
+        print(f"⚠️ [comment store] load failed: {e}")
+        return None
+    if not doc or not doc.get("watermark"):
+        return None
+    updated = doc.get("updatedAt")
+    if not updated or datetime.utcnow() - updated > timedelta(hours=YT_COMMENT_STORE_MAX_AGE_HOURS):
+        return None
+    stored_replies = bool(doc.get("include_replies"))
+    if include_replies and not stored_replies:
+        return None
+    rows = json.loads(_ungzip_b64_to_bytes(doc.get("rows_b64gz") or "").decode("utf-8") or "[]")
+    if not include_replies:
+        rows = [r for r in rows if int(r.get("isReply", 0)) == 0]
+    complete = bool(doc.get("complete"))
+    # 예전 수집이 더 작은 캡으로 잘렸다면 오래된 쪽이 비어 있으니 재사용 불가
+    if not complete and (max_per_video is None or len(rows) < max_per_video):
+        return None
+    return {"rows": rows, "watermark": doc["watermark"], "complete": complete,
+            "include_replies": stored_replies}
+
+def comment_store_save(video_id, rows, include_replies, complete):
+    coll = _comment_store_coll()
+    if coll is None or not rows:
+        return
+    tops = [r.get("publishedAt") or "" for r in rows if int(r.get("isReply", 0)) == 0]
+    if not tops:
+        return
+    try:
+        raw = json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        now = datetime.utcnow()
+        coll.update_one({"_id": video_id}, {"$set": {
+            "rows_b64gz": _b64_gzip_bytes(raw),
+            "row_count": len(rows),
+            "watermark": max(tops),
+            "include_replies": bool(include_replies),
+            "complete": bool(complete),
+            "updatedAt": now,
+            "expiresAt": now + timedelta(hours=YT_COMMENT_STORE_MAX_AGE_HOURS),
+        }}, upsert=True)
+    except Exception as e:
+        print(f"⚠️ [comment store] save failed: {e}")
+
+def _merge_store_rows(fresh_rows, stored_rows, title, short_type, max_per_video):
+    seen, merged = set(), []
+    for r in fresh_rows:
+        seen.add(r.get("comment_id"))
+        merged.append(r)
+    for r in stored_rows:
+        if r.get("comment_id") in seen:
+            continue
+        merged.append({**r, "video_title": title, "shortType": short_type})
+    truncated = max_per_video is not None and len(merged) > max_per_video
+    return (merged[:max_per_video] if truncated else merged), truncated
+
+def _store_plan(entry, fresh_rows, info, title, short_type, include_replies, max_per_video, cancelled):
+    """수집 결과 + 저장 항목 → (반환할 rows, 저장할지 여부, complete)"""
+    if entry:
+        rows, truncated = _merge_store_rows(fresh_rows, entry["rows"], title, short_type, max_per_video)
+        complete = entry["complete"] and info.get("complete") and not truncated
+        # 답글 없이 요청했는데 저장본엔 답글이 있으면 덮어쓰지 않음
+        savable = info.get("complete") and entry["include_replies"] == bool(include_replies)
+    else:
+        rows = fresh_rows
+        complete = bool(info.get("complete"))
+        savable = complete or (max_per_video is not None and len(rows) >= max_per_video)
+    return rows, (savable and not cancelled), complete
+
+def yt_comments_with_store(rt_keys, video_id, title="", short_type="Clip",
+                           include_replies=True, max_per_video=None, cancel=None, on_rows=None):
+    """저장소에 있는 영상은 watermark 이후 새 댓글만 받아 병합 → 비용이 새 댓글 수에 비례.
+    on_rows가 있으면 새 댓글은 페이지마다, 저장본에서 가져온 댓글은 마지막에 한 번 넘겨줌."""
+    entry = comment_store_load(video_id, include_replies, max_per_video)
+    info = {}
+    fresh = yt_all_comments_sync(rt_keys, video_id, title, short_type, include_replies, max_per_video,
+                                 cancel, since=entry["watermark"] if entry else None, info=info, on_rows=on_rows)
+    cancelled = cancel is not None and cancel.is_cancelled()
+    rows, save, complete = _store_plan(entry, fresh, info, title, short_type, include_replies, max_per_video, cancelled)
+    if on_rows is not None and len(rows) > len(fresh) and not cancelled:
+        on_rows(rows[len(fresh):], None)
+    if save:
+        comment_store_save(video_id, rows, include_replies, complete)
+    return rows
+
+def _water_fill(demands, cap) -> list:
+    """수요(demands)를 넘지 않으면서 합이 cap이 되도록 정수 배분 (작은 수요부터 채우고 남는 걸 균등 분배)."""
+    alloc = [0] * len(demands)
+    remaining = max(0, int(cap))
+    order = sorted(range(len(demands)), key=lambda i: demands[i])
+    for n, i in enumerate(order):
+        left = len(order) - n
+        share = remaining // left
+        if demands[i] <= share:
+            alloc[i] = demands[i]
+            remaining -= demands[i]
+            continue
+        # 여기부터는 전부 수요가 균등분 이상 → 균등분(+나머지 1씩)으로 마감
+        extra = remaining - share * left
+        for k, j in enumerate(order[n:]):
+            alloc[j] = share + (1 if k < extra else 0)
+        break
+    return alloc
+
+def plan_comment_budgets(video_rows, max_total_comments, max_per_video):
+    """yt_video_statistics 결과로 영상별 댓글 예산(comment_budget)을 정해 우선순위 순으로 반환.
+    - commentCount == 0 (댓글 없음/사용 중지) 영상은 호출 자체를 생략
+    - 수요 = min(commentCount, max_per_video); 합이 전체 상한을 넘으면 water-filling으로 배분
+      → 댓글 적은 영상은 전부, 많은 영상은 같은 수준까지만 받아서 한 영상이 예산을 독점하지 않음
+    - 정렬: 조회수 → 댓글수 (상한 도달로 끊기더라도 대표성 높은 영상이 먼저 수집되게)
+    """
+    videos = [v for v in video_rows if int(v.get("commentCount") or 0) > 0]
+    videos.sort(key=lambda v: (int(v.get("viewCount") or 0), int(v.get("commentCount") or 0)), reverse=True)
+    demands = [min(int(v["commentCount"]), max_per_video) if max_per_video else int(v["commentCount"])
+               for v in videos]
+    budgets = _water_fill(demands, max_total_comments) if sum(demands) > max_total_comments else demands
+    plan = [{**v, "comment_budget": b} for v, b in zip(videos, budgets) if b > 0]
+    print(f"[METRICS] comment_plan videos={len(video_rows)} skipped_zero={len(video_rows) - len(videos)} "
+          f"planned={len(plan)} budget_sum={sum(budgets)} demand_sum={sum(demands)}")
+    return plan
+
+
+COMMENT_COLUMNS = ["video_id", "video_title", "shortType", "comment_id", "parent_id",
+                   "isReply", "author", "text", "publishedAt", "likeCount"]
+
+class CommentCsvWriter:
+    """수집 워커 → (bounded queue) → 전용 writer 스레드 → CSV append.
+    - 워커는 페이지 단위 행 묶음을 put; writer가 밀리면 put이 막혀서 자연스럽게 backpressure
+    - limit(전체 상한)까지만 받고, 넘치는 묶음은 잘라낸 뒤 False 반환 → 호출측이 수집 취소
+    - close()가 반환되는 순간 파일이 완성됨 (메인/UI 스레드는 DataFrame 변환·쓰기를 하지 않음)
+    - resume_rows > 0이면 기존 파일 뒤에 이어 씀; on_written(mark, n, 파일 오프셋)은 실제로 파일에 쓴 뒤 호출
+    - put은 락 안에서 closed 확인 + 자리 예약(_pending)만 하고 큐 대기는 락 밖에서. close는 closed를 세운 뒤
+      예약된 put이 다 들어갈 때까지 기다렸다가 종료 표시 → 수집 executor를 기다리지 않고 close해도
+      종료 표시 뒤에 묶음이 들어가거나(유실) writer 스레드가 끝난 큐에서 put이 영원히 막히는 일이 없고,
+      큐가 찬 동안에도 다른 워커/이벤트 루프가 락에서 막히지 않음
+    """
+    _STOP = object()
+
+    def __init__(self, out_csv: str, limit: int = None, max_batches: int = 64,
+                 resume_rows: int = 0, on_written=None):
+        self.out_csv = out_csv
+        self.limit = limit
+        self.accepted = int(resume_rows or 0)
+        self.written = self.accepted
+        self.on_written = on_written
+        self.error = None
+        self.closed = False
+        self._lock = threading.RLock()
+        self._cv = threading.Condition(self._lock)
+        self._pending = 0   # 자리를 예약하고 큐에 넣는 중인 put 수 (close가 이게 0이 될 때까지 기다림)
+        self._q = queue.Queue(maxsize=max(1, int(max_batches)))
+        self._thread = threading.Thread(target=self._run, name="comment-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            append = self.written > 0 and os.path.exists(self.out_csv)
+            with open(self.out_csv, "a" if append else "w", encoding="utf-8-sig", newline="") as f:
+                w = csv.DictWriter(f, fieldnames=COMMENT_COLUMNS, extrasaction="ignore")
+                if not append:
+                    w.writeheader()
+                while True:
+                    item = self._q.get()
+                    if item is self._STOP:
+                        break
+                    batch, mark = item
+                    w.writerows(batch)
+                    self.written += len(batch)
+                    f.flush()
+                    if self.on_written is not None and mark is not None:
+                        self.on_written(mark, len(batch), f.tell())
+        except Exception as e:
+            self.error = e
+            # 워커가 put에서 영원히 막히지 않게 큐를 비워줌
+            while True:
+                try:
+                    if self._q.get_nowait() is self._STOP:
+                        break
+                except queue.Empty:
+                    time.sleep(0.05)
+
+    def _take(self, rows) -> tuple:
+        with self._lock:
+            if self.limit is not None:
+                room = max(0, self.limit - self.accepted)
+                rows = rows[:room]
+            self.accepted += len(rows)
+            full = self.limit is not None and self.accepted >= self.limit
+        return rows, not full
+
+    def _reserve(self, rows, mark):
+        """락 안에서 closed 확인 + 상한만큼 잘라 받기. 큐에 넣을 게 있으면 _pending 예약.
+        반환 (넣을 묶음 또는 None, 더 받을지). close() 뒤면 (None, False)."""
+        with self._lock:
+            if self.closed:
+                return None, False
+            rows, more = self._take(list(rows or []))
+            if not rows and mark is None:
+                return None, more
+            self._pending += 1
+            return (rows, mark), more
+
+    def _unreserve(self) -> bool:
+        with self._cv:
+            self._pending -= 1
+            self._cv.notify_all()
+            return not self.closed
+
+    def put(self, rows, mark=None) -> bool:
+        """rows를 큐에 넣음(가득 차면 대기, 락은 잡지 않은 채로). 상한에 도달했으면 False.
+        mark는 체크포인트용 꼬리표 (video_id, next_page_token, done) — 행 없이 mark만 보내도 됨.
+        close() 뒤에 들어온 묶음은 버림 (False). 넣는 사이 close됐으면 묶음은 쓰이고 False."""
+        item, more = self._reserve(rows, mark)
+        if item is None:
+            return more
+        try:
+            self._q.put(item)
+        finally:
+            alive = self._unreserve()
+        return more and alive
+
+    async def put_async(self, rows, mark=None) -> bool:
+        """put과 같음. 큐가 차 있으면 이벤트 루프를 막지 않고 잠깐씩 양보하며 재시도
+        (락은 예약/해제 때만 잠깐 잡고, 락을 쥔 쪽이 대기하는 일이 없어서 루프가 락에서 멈추지 않음)."""
+        item, more = self._reserve(rows, mark)
+        if item is None:
+            return more
+        try:
+            while True:
+                try:
+                    self._q.put_nowait(item)
+                    break
+                except queue.Full:
+                    await asyncio.sleep(0.02)
+        finally:
+            alive = self._unreserve()
+        return more and alive
+
+    def close(self) -> int:
+        with self._cv:
+            self.closed = True
+            # 예약된 묶음이 큐에 다 들어간 뒤에 종료 표시 (writer는 계속 비우고 있으므로 기다림이 끝남)
+            while self._pending:
+                self._cv.wait()
+        self._q.put(self._STOP)
+        self._thread.join()
+        if self.error:
+            raise self.error
+        return self.written
+
+
+class FirstTurnCheckpoint:
+    """1차 분석 잡의 재개 지점: 해석된 schema, 수집 CSV 경로, 총 기록 건수와 바이트 오프셋,
+    영상별 {다음 page token, 기록 건수, 완료 여부}.
+    writer가 파일에 실제로 쓴 뒤에만 갱신되고, persist(snapshot)는 몇 초 간격으로만 호출
+    (영상 수백 개 × 페이지마다 DB 쓰기 방지) → 재개할 때 CSV를 마지막 저장 오프셋까지만 새 경로로 옮겨 이어 씀.
+    원래 파일은 single-flight로 다른 요청(last_csv)이 같이 쓰고 있을 수 있어서 자르지 않음."""
+    FLUSH_SEC = 2.0
+
+    def __init__(self, state: dict = None, persist=None):
+        state = state or {}
+        self.out_csv = state.get("out_csv") or os.path.join(BASE_DIR, f"collect_{uuid4().hex}.csv")
+        self.schema = state.get("schema")
+        self.collect_done = bool(state.get("collect_done"))
+        self.videos = {k: dict(v) for k, v in (state.get("videos") or {}).items()}
+        self.rows_written = int(state.get("rows_written") or 0)
+        self.csv_bytes = int(state.get("csv_bytes") or 0)
+        try:
+            # 마지막 체크포인트 이후에 쓰인 꼬리는 버림 (재개하면 그 페이지부터 다시 받음)
+            if self.rows_written and os.path.getsize(self.out_csv) >= self.csv_bytes:
+                self.out_csv = self._copy_prefix(self.out_csv, self.csv_bytes)
+            else:
+                self.rows_written = 0
+        except OSError:
+            self.rows_written = 0
+        # CSV가 사라졌으면(/tmp 초기화 등) 수집은 처음부터
+        if not self.rows_written:
+            self.videos, self.collect_done, self.csv_bytes = {}, False, 0
+        self._persist = persist
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    @staticmethod
+    def _copy_prefix(src_path: str, n_bytes: int) -> str:
+        out_csv = os.path.join(BASE_DIR, f"collect_{uuid4().hex}.csv")
+        with open(src_path, "rb") as src, open(out_csv, "wb") as dst:
+            remaining = n_bytes
+            while remaining > 0:
+                buf = src.read(min(1 << 20, remaining))
+                if not buf:
+                    break
+                dst.write(buf)
+                remaining -= len(buf)
+        return out_csv
+
+    def on_written(self, mark, n: int, offset: int):
+        video_id, token, done = mark
+        with self._lock:
+            v = self.videos.setdefault(video_id, {"token": None, "rows": 0, "done": False})
+            v["rows"] += n
+            # 완료 표시(token 없음)는 마지막 page token을 지우지 않음 → 예산에서 멈춘 영상을 나중에 더 받을 수 있게
+            if token or not done:
+                v["token"] = token
+            v["done"] = v["done"] or bool(done)
+            self.rows_written += n
+            self.csv_bytes = offset
+        self.flush()
+
+    def resume_point(self, video_id):
+        """반환: ("fresh"|"continue"|"skip", page_token, 이미 기록한 건수)"""
+        with self._lock:
+            v = self.videos.get(video_id)
+        if not v:
+            return "fresh", None, 0
+        if v.get("done") or not v.get("token"):
+            return "skip", None, v.get("rows", 0)
+        return "continue", v["token"], v.get("rows", 0)
+
+    def stopped_with_token(self) -> dict:
+        """끝났지만 다음 page token이 남은 영상 (예산에서 멈춘 영상) → {video_id: {"token", "rows", "done"}}"""
+        with self._lock:
+            return {k: dict(v) for k, v in self.videos.items() if v.get("done") and v.get("token")}
+
+    def reopen(self, video_ids):
+        """완료 표시를 풀어서 resume_point가 저장된 token부터 이어 받게 함."""
+        with self._lock:
+            for vid in video_ids:
+                if vid in self.videos:
+                    self.videos[vid]["done"] = False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"out_csv": self.out_csv, "schema": self.schema, "collect_done": self.collect_done,
+                    "rows_written": self.rows_written, "csv_bytes": self.csv_bytes,
+                    "videos": {k: dict(v) for k, v in self.videos.items()}}
+
+    def flush(self, force: bool = False):
+        now = time.time()
+        if self._persist is None or (not force and now - self._last_flush < self.FLUSH_SEC):
+            return
+        self._last_flush = now
+        self._persist(self.snapshot())
+
+
+class VideoFeed:
+    """검색→통계 단계가 계획을 마친 영상을 수집 단계로 흘려보내는 스트림.
+    producer는 put(videos) 후 마지막에 close(); 수집 엔진은 list처럼 순회하면 되고
+    len()은 지금까지 들어온 영상 수(진행률 분모)."""
+    _END = object()
+
+    def __init__(self, cancel=None):
+        self.cancel = cancel
+        self._q = queue.Queue()
+        self._count = 0
+
+    def put(self, videos):
+        for v in videos:
+            self._count += 1
+            self._q.put(v)
+
+    def close(self):
+        self._q.put(self._END)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        while True:
+            if self.cancel is not None and self.cancel.is_cancelled():
+                return
+            try:
+                v = self._q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if v is self._END:
+                return
+            yield v
+
+
+def _open_collect_writer(max_total_comments, checkpoint=None):
+    if checkpoint is None:
+        return CommentCsvWriter(os.path.join(BASE_DIR, f"collect_{uuid4().hex}.csv"), limit=max_total_comments)
+    return CommentCsvWriter(checkpoint.out_csv, limit=max_total_comments,
+                            resume_rows=checkpoint.rows_written, on_written=checkpoint.on_written)
+
 def parallel_collect_comments_streaming(video_list, rt_keys, include_replies,
-                                        max_total_comments, max_per_video, prog_bar):
-    out_csv = os.path.join(BASE_DIR, f"collect_{uuid4().hex}.csv")
-    wrote_header, total_written, done, total_videos = False, 0, 0, len(video_list)
-
-    with ThreadPoolExecutor(max_workers=8) as ex:
-        futures = {
-            ex.submit(yt_all_comments_sync, rt_keys, v["video_id"], v.get("title", ""),
-                      v.get("shortType", "Clip"), include_replies, max_per_video): v for v in video_list
-        }
+                                        max_total_comments, max_per_video, prog_bar, cancel=None,
+                                        checkpoint=None):
+    done = 0
+    cancel = cancel or CollectCancelToken()
+    writer = _open_collect_writer(max_total_comments, checkpoint)
+    out_csv = writer.out_csv
+
+    def collect_one(v):
+        vid, budget = v["video_id"], v.get("comment_budget", max_per_video)
+        title, short_type = v.get("title", ""), v.get("shortType", "Clip")
+
+        def on_rows(rows, token):
+            if not writer.put(rows, (vid, token, False)):
+                cancel.cancel("max_total_comments")
+
+        mode, token, got = checkpoint.resume_point(vid) if checkpoint is not None else ("fresh", None, 0)
+        # 결과 행은 writer로 이미 흘려보냈으니 건수만 반환 (as_completed가 행 목록을 붙잡고 있지 않게)
+        if mode == "skip":
+            return 0
+        if mode == "continue":
+            n = len(yt_all_comments_sync(rt_keys, vid, title, short_type, include_replies,
+                                         None if budget is None else max(0, budget - got), cancel,
+                                         on_rows=on_rows, page_token=token))
+        else:
+            n = len(yt_comments_with_store(rt_keys, vid, title, short_type, include_replies, budget, cancel,
+                                           on_rows=on_rows))
+        if not cancel.is_cancelled():
+            writer.put([], (vid, None, True))
+        return n
+
+    def mark_done(f):
+        nonlocal done
+        try:
+            f.result()
+        except Exception: pass
+        done += 1
+        total_videos = len(video_list)
+        prog_bar.progress(min(0.90, 0.50 + (done / total_videos) * 0.40 if total_videos > 0 else 0.50), text="댓글 수집중…")
+
+    # with 블록을 쓰면 종료 시 shutdown(wait=True)로 남은 영상 페이징을 다 기다리게 됨
+    # → 상한 도달 시 토큰으로 진행 중 작업을 페이지 경계에서 멈추고, 대기 중 작업은 버린 뒤 바로 반환
+    ex = ThreadPoolExecutor(max_workers=8)
+    try:
+        # video_list가 VideoFeed면 영상이 도착하는 대로 제출 (앞 영상 수집이 뒤쪽 검색/통계와 겹침)
+        futures = set()
+        for v in video_list:
+            if cancel.is_cancelled(): break
+            futures.add(ex.submit(collect_one, v))
+            for f in [f for f in futures if f.done()]:
+                futures.discard(f)
+                mark_done(f)
         for f in as_completed(futures):
+            if cancel.is_cancelled(): break
+            mark_done(f)
+    finally:
+        ex.shutdown(wait=False, cancel_futures=True)
+        # 상한 도달 후 페이지 경계 전에 끝난 워커의 put은 writer가 잘라내고, close 뒤의 put은 writer가 버림
+        total_written = writer.close()
+    return out_csv, total_written
+
+
+class AsyncCommentCollector:
+    """aiohttp로 commentThreads/comments REST 엔드포인트를 직접 호출하는 수집기.
+    - 영상당 스레드 1개 대신, 모든 영상을 코루틴으로 띄우고 in-flight 요청 수만 제한
+      (전체 상한 max_inflight + 키별 상한 max_inflight_per_key)
+    - 쿼터/레이트 제한 걸린 키는 이번 수집 동안 제외하고 다른 키로 재시도
+    """
+    def __init__(self, keys, include_replies=True, max_per_video=None,
+                 max_inflight=YT_ASYNC_MAX_INFLIGHT, max_inflight_per_key=YT_ASYNC_MAX_INFLIGHT_PER_KEY,
+                 base_url=YT_API_BASE_URL, cancel=None, writer=None, checkpoint=None):
+        self.keys = [k.strip() for k in (keys or []) if isinstance(k, str) and k.strip()][:10]
+        if not self.keys:
+            raise RuntimeError("YouTube API Key가 비어 있습니다.")
+        self.include_replies = bool(include_replies)
+        self.max_per_video = max_per_video
+        self.max_inflight = max(1, int(max_inflight))
+        self.max_inflight_per_key = max(1, int(max_inflight_per_key))
+        self.base_url = base_url.rstrip("/")
+        self.cancel = cancel or CollectCancelToken()
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.pool = get_youtube_key_pool(tuple(self.keys))
+        self.limiter = get_youtube_rate_limiter()
+        self.api_calls = 0
+        self._inflight = {k: 0 for k in self.keys}
+        self._global_sem = None
+        self._key_cond = None
+
+    async def _acquire_key(self, cost: int = 1) -> str:
+        async with self._key_cond:
+            while True:
+                alive = self.pool.healthy_keys()
+                if not alive:
+                    raise YouTubeApiError(403, "quotaExceeded: all YouTube API keys exhausted")
+                free = [k for k in alive if self._inflight[k] < self.max_inflight_per_key]
+                if free:
+                    key = min(free, key=lambda k: (self._inflight[k], self.pool.usage(k)))
+                    self._inflight[key] += 1
+                    self.pool.charge(key, cost)
+                    return key
+                await self._key_cond.wait()
+
+    async def _release_key(self, key: str):
+        async with self._key_cond:
+            self._inflight[key] -= 1
+            self._key_cond.notify_all()
+
+    async def _get(self, session, endpoint: str, params: dict) -> dict:
+        cost = YT_QUOTA_COST.get(f"{endpoint}.list", 1)
+        throttled = 0
+        for _ in range(len(self.keys) + YT_MAX_RETRIES):
+            async with self._global_sem:
+                key = await self._acquire_key(cost)
+                charged = True
+                try:
+                    if (wait := self.limiter.key_wait(key)) > 0:
+                        await asyncio.sleep(wait)
+                    await self.limiter.aimd.acquire_async()
+                    try:
+                        self.api_calls += 1
+                        async with session.get(f"{self.base_url}/{endpoint}",
+                                               params=_yt_params(f"{endpoint}.list", params, key)) as resp:
+                            if resp.status == 200:
+                                data = _yt_json_loads(await resp.read())
+                                self.limiter.aimd.on_success()
+                                return data
+                            body = await resp.text()
+                            err = YouTubeApiError(resp.status, body, _yt_retry_after_header(resp.headers))
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        # 응답을 못 받은 호출은 쿼터가 안 쓰였다고 보고 선차감분 반납
+                        self.pool.refund(key, cost)
+                        charged = False
+                        err = YouTubeApiError(503, f"{type(e).__name__}: {e}")
+                    finally:
+                        self.limiter.aimd.release()
+                finally:
+                    await self._release_key(key)
+            kind = _yt_error_kind(err.status, err.message.lower())
+            if kind == "quota":
+                print(f"⚠️ [YouTube API/async] 쿼터 소진 키 감지 → 다른 키로 재시도 (used={self.pool.usage(key)})")
+                self.pool.mark_exhausted(key)
+                continue
+            if kind == "throttle" and throttled < YT_MAX_RETRIES:
+                if charged:
+                    self.pool.refund(key, cost)
+                self.limiter.aimd.on_throttle()
+                await asyncio.sleep(self.limiter.backoff(throttled, err.retry_after))
+                throttled += 1
+                continue
+            raise err
+        raise YouTubeApiError(403, "quotaExceeded: all keys exhausted")
+
+    async def _all_replies(self, session, parent_id, video_id, title, short_type, cap=None):
+        replies, token = [], None
+        while not (cap is not None and len(replies) >= cap):
+            if self.cancel.is_cancelled(): break
+            try:
+                resp = await self._get(session, "comments", {
+                    "part": "snippet", "parentId": parent_id, "maxResults": 100,
+                    "pageToken": token, "textFormat": "plainText"})
+            except YouTubeApiError: break
+            for c in resp.get("items", []):
+                replies.append(_yt_comment_row(video_id, title, short_type, c.get("id", ""), parent_id, c["snippet"]))
+            if not (token := resp.get("nextPageToken")): break
+        return replies[:cap] if cap is not None else replies
+
+    async def collect_video(self, session, video_id, title="", short_type="Clip", since=None, info=None,
+                            max_per_video=None, page_token=None):
+        info = info if info is not None else {}
+        info["complete"] = False
+        max_per_video = self.max_per_video if max_per_video is None else max_per_video
+        rows, token = [], page_token
+        while not (max_per_video is not None and len(rows) >= max_per_video):
+            if self.cancel.is_cancelled(): break
+            try:
+                resp = await self._get(session, "commentThreads", {
+                    "part": "snippet,replies", "videoId": video_id, "maxResults": 100,
+                    "order": "time", "pageToken": token, "textFormat": "plainText"})
+            except YouTubeApiError: break
+
+            items, reached = _items_newer_than(resp.get("items", []), since)
+            budget_left = None if max_per_video is None else max_per_video - len(rows)
+            plan, _ = _plan_thread_page(items, video_id, title, short_type,
+                                        self.include_replies, budget_left)
+            expanded = await asyncio.gather(*[
+                self._all_replies(session, top_row["comment_id"], video_id, title, short_type, cap=cap)
+                if cap > 0 else asyncio.sleep(0, result=[])
+                for top_row, _, cap in plan
+            ], return_exceptions=True)
+            page_start = len(rows)
+            for (top_row, inline_rows, _), more in zip(plan, expanded):
+                rows.append(top_row)
+                rows.extend(inline_rows)
+                if isinstance(more, list):
+                    rows.extend(more)
+            token = None if reached else resp.get("nextPageToken")
+            if len(rows) > page_start:
+                await self._emit(rows[page_start:], (video_id, token, False))
+            if not token:
+                info["complete"] = True
+                break
+        return rows[:max_per_video] if max_per_video is not None else rows
+
+    async def _emit(self, rows, mark=None):
+        if self.writer is not None and not await self.writer.put_async(rows, mark):
+            self.cancel.cancel("max_total_comments")
+
+    async def collect_video_with_store(self, session, video_id, title="", short_type="Clip", max_per_video=None):
+        max_per_video = self.max_per_video if max_per_video is None else max_per_video
+        mode, token, got = (self.checkpoint.resume_point(video_id) if self.checkpoint is not None
+                            else ("fresh", None, 0))
+        if mode == "skip":
+            return 0
+        if mode == "continue":
+            rows = await self.collect_video(session, video_id, title, short_type,
+                                            max_per_video=None if max_per_video is None else max(0, max_per_video - got),
+                                            page_token=token)
+            if not self.cancel.is_cancelled():
+                await self._emit([], (video_id, None, True))
+            return len(rows)
+        entry = await asyncio.to_thread(comment_store_load, video_id, self.include_replies, max_per_video)
+        info = {}
+        fresh = await self.collect_video(session, video_id, title, short_type,
+                                         since=entry["watermark"] if entry else None, info=info,
+                                         max_per_video=max_per_video)
+        cancelled = self.cancel.is_cancelled()
+        rows, save, complete = _store_plan(entry, fresh, info, title, short_type, self.include_replies,
+                                           max_per_video, cancelled)
+        if len(rows) > len(fresh) and not cancelled:
+            await self._emit(rows[len(fresh):], (video_id, None, False))
+        if not cancelled:
+            await self._emit([], (video_id, None, True))
+        if save:
+            await asyncio.to_thread(comment_store_save, video_id, rows, self.include_replies, complete)
+        return len(rows)
+
+    async def run(self, video_list, on_video_done):
+        """영상 하나가 끝날 때마다 on_video_done() 호출. 취소 토큰이 켜지면 남은 작업 취소.
+        video_list가 VideoFeed면 별도 스레드에서 꺼내 오면서 도착하는 대로 작업을 띄움."""
+        self._global_sem = asyncio.Semaphore(self.max_inflight)
+        self._key_cond = asyncio.Condition()
+        connector = aiohttp.TCPConnector(limit=self.max_inflight, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=YT_HTTP_TIMEOUT_SEC)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers={"Accept-Encoding": "gzip"}) as session:
+            def start(v):
+                return asyncio.create_task(self.collect_video_with_store(session, v["video_id"], v.get("title", ""),
+                                                                         v.get("shortType", "Clip"),
+                                                                         v.get("comment_budget")))
+
+            end = object()
+            streaming = isinstance(video_list, VideoFeed)
+            it = iter(video_list)
+            tasks = set() if streaming else {start(v) for v in video_list}
+            feeder = asyncio.ensure_future(asyncio.to_thread(next, it, end)) if streaming else None
             try:
-                if comm := f.result():
-                    dfc = pd.DataFrame(comm)
-                    dfc.to_csv(out_csv, index=False, mode="a" if wrote_header else "w", header=not wrote_header, encoding="utf-8-sig")
-                    wrote_header = True
-                    total_written += len(dfc)
-            except Exception: pass
-            done += 1
-            prog_bar.progress(min(0.90, 0.50 + (done / total_videos) * 0.40 if total_videos > 0 else 0.50), text="댓글 수집중…")
-            if total_written >= max_total_comments: break
+                while tasks or feeder is not None:
+                    done, _ = await asyncio.wait(tasks | ({feeder} if feeder is not None else set()),
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    for fut in done:
+                        if fut is feeder:
+                            v = fut.result()
+                            feeder = None
+                            if v is not end and not self.cancel.is_cancelled():
+                                tasks.add(start(v))
+                                feeder = asyncio.ensure_future(asyncio.to_thread(next, it, end))
+                            continue
+                        tasks.discard(fut)
+                        try:
+                            fut.result()
+                        except Exception:
+                            pass
+                        on_video_done()
+                    if self.cancel.is_cancelled():
+                        break
+            finally:
+                if feeder is not None:
+                    feeder.cancel()
+                for t in tasks:
+                    t.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def async_collect_comments_streaming(video_list, rt_keys, include_replies,
+                                     max_total_comments, max_per_video, prog_bar, cancel=None, checkpoint=None):
+    state = {"done": 0}
+    writer = _open_collect_writer(max_total_comments, checkpoint)
+    out_csv = writer.out_csv
+
+    def on_video_done():
+        state["done"] += 1
+        total_videos = len(video_list)
+        prog_bar.progress(min(0.90, 0.50 + (state["done"] / total_videos) * 0.40 if total_videos > 0 else 0.50), text="댓글 수집중…")
+
+    collector = AsyncCommentCollector(rt_keys, include_replies, max_per_video,
+                                      cancel=cancel or getattr(video_list, "cancel", None), writer=writer,
+                                      checkpoint=checkpoint)
+    try:
+        asyncio.run(collector.run(video_list, on_video_done))
+    finally:
+        total_written = writer.close()
+    print(f"[METRICS] collect engine=async api_calls={collector.api_calls} healthy_keys={len(collector.pool.healthy_keys())}")
     return out_csv, total_written
+
+
+def collect_comments_streaming(video_list, rt_keys, include_replies,
+                               max_total_comments, max_per_video, prog_bar, cancel=None, checkpoint=None):
+    """YT_COLLECT_ENGINE에 따라 수집 엔진 선택 + 처리량을 같은 포맷으로 로그에 남김 (엔진 간 비교용)."""
+    engine = "async" if (YT_COLLECT_ENGINE == "async" and _AIOHTTP_AVAILABLE) else "thread"
+    t0 = time.time()
+    if engine == "async":
+        out_csv, total = async_collect_comments_streaming(video_list, rt_keys, include_replies,
+                                                          max_total_comments, max_per_video, prog_bar, cancel,
+                                                          checkpoint)
+    else:
+        out_csv, total = parallel_collect_comments_streaming(video_list, rt_keys, include_replies,
+                                                             max_total_comments, max_per_video, prog_bar, cancel,
+                                                             checkpoint)
+    elapsed = max(1e-6, time.time() - t0)
+    print(f"[METRICS] collect engine={engine} videos={len(video_list)} rows={total} "
+          f"elapsed={elapsed:.1f}s rows_per_sec={total / elapsed:.0f}")
+    return out_csv, total
+
+
+def _search_hashtag(base_kw: str) -> str:
+    clean_kw = base_kw.replace(" ", "")
+    return clean_kw if clean_kw.startswith("#") else f"#{clean_kw}"
+
+def _feed_planned_videos(rt_keys, feed, search_keywords, known_ids, published_after, published_before,
+                         max_total_comments, max_per_video, exclude_ost, stats_rows, timings):
+    """[producer 스레드] 키워드 검색(동시) → 50개씩 통계 → 예산 배분 → feed.put.
+    전체 영상 수를 미리 모르니 배치마다 '남은 예산 × 배치 비중'만큼만 나눠 줌
+    (비중 분모 = 아직 배분 안 된 확인된 ID + 진행 중 검색당 최대 결과 수 추정치)."""
+    t0 = time.time()
+    BATCH, PER_SEARCH = VideoStatsService.BATCH, 100
+    seen, pending = set(), []
+    remaining = max_total_comments
+
+    def add_ids(ids):
+        for vid in ids:
+            if vid and vid not in seen:
+                seen.add(vid)
+                pending.append(vid)
+
+    def plan_batch(rows, searches_left):
+        nonlocal remaining
+        if exclude_ost:
+            rows = [r for r in rows if not re.search(r"\bOST\b", str(r.get("title", "")), re.IGNORECASE)]
+        stats_rows.extend(rows)
+        outstanding = len(pending) + searches_left * PER_SEARCH + inflight_ids()
+        share = remaining if outstanding <= 0 else remaining * len(rows) // (len(rows) + outstanding)
+        plan = plan_comment_budgets(rows, share, max_per_video)
+        remaining -= sum(v["comment_budget"] for v in plan)
+        if plan and "first_feed" not in timings:
+            timings["first_feed"] = time.time() - t0
+        feed.put(plan)
+
+    add_ids(known_ids)
+    search_ex = ThreadPoolExecutor(max_workers=max(1, min(4, len(search_keywords))))
+    stats_ex = ThreadPoolExecutor(max_workers=4)
+    searches = {search_ex.submit(lambda kw: yt_search_videos(get_thread_youtube_client(rt_keys), kw, PER_SEARCH,
+                                                             "viewCount", published_after, published_before), kw)
+                for kw in search_keywords}
+    stats_jobs = {}
+    inflight_ids = lambda: sum(stats_jobs.values())
+    try:
+        while searches or stats_jobs or pending:
+            if feed.cancel is not None and feed.cancel.is_cancelled():
+                break
+            # 검색이 끝났거나 50개가 모이면 바로 통계 배치로 넘김
+            while len(pending) >= BATCH or (pending and not searches):
+                batch, pending[:] = pending[:BATCH], pending[BATCH:]
+                stats_jobs[stats_ex.submit(get_video_stats_service(tuple(rt_keys)).get, batch)] = len(batch)
+            if not (searches or stats_jobs):
+                break
+            done, _ = wait(searches | set(stats_jobs), return_when=FIRST_COMPLETED)
+            for f in done:
+                if f in searches:
+                    searches.discard(f)
+                    try:
+                        add_ids(f.result())
+                    except Exception as e:
+                        print(f"⚠️ [pipeline] search failed: {e}")
+                    if not searches:
+                        timings["search"] = time.time() - t0
+                    continue
+                stats_jobs.pop(f)
+                try:
+                    rows = f.result()
+                except Exception as e:
+                    print(f"⚠️ [pipeline] statistics failed: {e}")
+                    rows = []
+                plan_batch(rows, len(searches))
+        timings.setdefault("search", time.time() - t0)
+        timings["stats"] = time.time() - t0
+    finally:
+        search_ex.shutdown(wait=False, cancel_futures=True)
+        stats_ex.shutdown(wait=False, cancel_futures=True)
+        feed.close()
+
+def _top_up_budgets(checkpoint, stats_rows, leftover, max_per_video) -> list:
+    """commentCount로 잡은 예산보다 덜 나온 영상들의 남는 예산(leftover)을, 예산에서 멈춰 다음 page token이
+    남아 있는 영상에 다시 나눠 줌 (남은 수요 기준 water-filling). 반환: 이어 받을 영상 목록 (comment_budget = 누적 예산).
+    고른 영상은 체크포인트에서 완료 표시를 풀어서 수집 엔진이 저장된 token부터 이어 받게 함."""
+    if leftover <= 0:
+        return []
+    progress = checkpoint.stopped_with_token()
+    videos, demands = [], []
+    for row in stats_rows:
+        v = progress.get(row.get("video_id"))
+        if not v:
+            continue
+        demand = int(row.get("commentCount") or 0)
+        demand = min(demand, max_per_video) if max_per_video else demand
+        if demand - v["rows"] > 0:
+            videos.append((row, v["rows"]))
+            demands.append(demand - v["rows"])
+    if not videos:
+        return []
+    extra = _water_fill(demands, leftover) if sum(demands) > leftover else demands
+    plan = [{**row, "comment_budget": got + e} for (row, got), e in zip(videos, extra) if e > 0]
+    checkpoint.reopen([v["video_id"] for v in plan])
+    print(f"[METRICS] comment_plan top_up videos={len(plan)} leftover={leftover} budget_sum={sum(extra)}")
+    return plan
+
+def collect_first_turn_pipelined(rt_keys, search_keywords, extra_ids, published_after, published_before,
+                                 include_replies, prog_bar, exclude_ost=False,
+                                 max_total_comments=MAX_TOTAL_COMMENTS, max_per_video=MAX_COMMENTS_PER_VID,
+                                 cancel=None, checkpoint=None):
+    """검색·통계·댓글 수집을 겹쳐 실행. 첫 통계 배치가 나오자마자 그 영상들의 댓글 수집이 시작됨.
+    checkpoint가 있으면 이미 끝난 영상은 건너뛰고, 중간에 멈춘 영상은 저장된 page token부터 이어 받음.
+    반환: (csv_path, 수집 건수, 통계 DataFrame)"""
+    t0 = time.time()
+    cancel = CollectCancelToken(parent=cancel)
+    feed = VideoFeed(cancel)
+    # 영상별 진행(page token/건수)은 남은 예산 재배분에도 씀 → 잡 체크포인트가 없으면 저장 안 하는 임시 체크포인트
+    checkpoint = checkpoint if checkpoint is not None else FirstTurnCheckpoint()
+    stats_rows, timings = [], {}
+    producer = threading.Thread(target=_feed_planned_videos, name="first-turn-feed", daemon=True, args=(
+        rt_keys, feed, search_keywords, extra_ids, published_after, published_before,
+        max_total_comments, max_per_video, exclude_ost, stats_rows, timings))
+    producer.start()
+    try:
+        csv_path, total = collect_comments_streaming(feed, rt_keys, include_replies, max_total_comments,
+                                                     max_per_video, prog_bar, cancel, checkpoint)
+        top_up = ([] if cancel.is_cancelled() else
+                  _top_up_budgets(checkpoint, stats_rows, max_total_comments - total, max_per_video))
+        if top_up:
+            csv_path, total = collect_comments_streaming(top_up, rt_keys, include_replies, max_total_comments,
+                                                         max_per_video, prog_bar, cancel, checkpoint)
+    finally:
+        cancel.cancel("done")
+        producer.join()
+    elapsed = time.time() - t0
+    print(f"[METRICS] first_turn pipeline searches={len(search_keywords)} videos={len(stats_rows)} rows={total} "
+          f"search_done={timings.get('search', 0):.1f}s stats_done={timings.get('stats', 0):.1f}s "
+          f"first_collect_start={timings.get('first_feed', elapsed):.1f}s total={elapsed:.1f}s")
+    return csv_path, total, pd.DataFrame(stats_rows)
+
+
+def collect_flight_key(search_keywords, known_ids, published_after, published_before,
+                       include_replies, own_ip_mode) -> str:
+    """같은 수집인지 판단하는 키. 기간은 search 캐시와 같은 버킷으로 맞춰서 몇 분 차이 요청도 합쳐짐."""
+    raw = json.dumps([
+        sorted({_normalize_search_keyword(k) for k in search_keywords}),
+        sorted(set(known_ids or [])),
+        _snap_rfc3339(published_after, YT_SEARCH_CACHE_BUCKET_MIN, up=False),
+        _snap_rfc3339(published_before, YT_SEARCH_CACHE_BUCKET_MIN, up=True),
+        bool(include_replies), bool(own_ip_mode),
+    ], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class CollectFlight:
+    """진행 중(또는 막 끝난) 공유 수집 1건. progress_value/text는 JobProgressBar가 채움."""
+    def __init__(self, key):
+        self.key = key
+        self.owner = uuid4().hex
+        self.progress_value, self.progress_text = 0.0, "댓글 수집중…"
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.done_at = None
+        self.cancel = CollectCancelToken()
+        self.event = threading.Event()
+
+    def reusable(self) -> bool:
+        if not self.event.is_set():
+            return not self.cancel.is_cancelled()
+        return (self.result is not None and self.error is None and not self.cancel.is_cancelled()
+                and time.time() - self.done_at < COLLECT_FLIGHT_REUSE_MIN * 60)
+
+
+class CollectFlightCoordinator:
+    """1차 수집 single-flight.
+    - 프로세스 안: 같은 키의 두 번째 요청은 진행 중인 flight에 붙어서 같은 CSV를 받음
+    - 레플리카 간: Mongo lease를 잡은 쪽만 수집하고, 나머지는 진행률을 따라가다가 결과 CSV(b64gz 청크)를 내려받음
+    - 붙어 있던 요청이 전부 취소되면 수집도 취소
+    """
+    CHUNK_CHARS = 8 * 1024 * 1024
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._indexed = False
+
+    def _coll(self, chunks: bool = False):
+        name_key, default = (("collect_flight_chunks_coll", "ytcc_collect_flight_chunks") if chunks
+                             else ("collect_flights_coll", "ytcc_collect_flights"))
+        try:
+            coll = _mongo_aux_coll(name_key, default)
+        except Exception:
+            return None
+        if coll is not None and not self._indexed:
+            try:
+                from pymongo import ASCENDING  # type: ignore
+                for c in (_mongo_aux_coll("collect_flights_coll", "ytcc_collect_flights"),
+                          _mongo_aux_coll("collect_flight_chunks_coll", "ytcc_collect_flight_chunks")):
+                    c.create_index([("expiresAt", ASCENDING)], expireAfterSeconds=0)
+            except Exception as e:
+                print(f"⚠️ [collect flight] index failed: {e}")
+            self._indexed = True
+        return coll
+
+    def run(self, key, collect_fn, prog_bar, cancel=None):
+        """collect_fn(prog_bar, cancel) -> (csv_path, total, df_stats). 취소되면 None."""
+        with self._lock:
+            self._flights = {k: f for k, f in self._flights.items() if f.reusable()}
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = CollectFlight(key)
+            flight.waiters += 1
+        if leader:
+            threading.Thread(target=self._fly, args=(flight, collect_fn), name=f"collect-flight-{key[:8]}",
+                             daemon=True).start()
+        else:
+            print(f"[collect flight] attach {key[:12]} waiters={flight.waiters}")
+        while not flight.event.wait(0.3):
+            prog_bar.progress(flight.progress_value, text=flight.progress_text)
+            if cancel is not None and cancel.is_cancelled():
+                self._detach(flight)
+                return None
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _detach(self, flight):
+        with self._lock:
+            flight.waiters -= 1
+            if flight.waiters <= 0 and not flight.event.is_set():
+                flight.cancel.cancel("no waiters")
+
+    def _fly(self, flight, collect_fn):
+        try:
+            flight.result = self._lead_or_follow(flight, collect_fn)
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done_at = time.time()
+            flight.event.set()
+
+    def _lead_or_follow(self, flight, collect_fn):
+        coll = self._coll()
+        if coll is None:
+            return collect_fn(JobProgressBar(flight), flight.cancel)
+        while not flight.cancel.is_cancelled():
+            now = datetime.utcnow()
+            lease = {"owner": flight.owner, "status": "running", "leaseUntil": now + timedelta(seconds=COLLECT_FLIGHT_LEASE_SEC),
+                     "expiresAt": now + timedelta(minutes=COLLECT_FLIGHT_REUSE_MIN + 60)}
+            try:
+                # lease가 없거나, 만료됐거나, 재사용 기간이 지난 결과면 내가 수집
+                won = coll.find_one_and_update(
+                    {"_id": flight.key, "$or": [{"leaseUntil": {"$lt": now}, "status": "running"},
+                                                {"status": "failed"},
+                                                {"status": "done", "doneAt": {"$lt": now - timedelta(minutes=COLLECT_FLIGHT_REUSE_MIN)}}]},
+                    {"$set": lease})
+                if won is None:
+                    coll.insert_one({"_id": flight.key, **lease})
+                return self._lead(coll, flight, collect_fn)
+            except pymongo.errors.DuplicateKeyError:
+                pass
+            except Exception as e:
+                print(f"⚠️ [collect flight] lease failed, collecting locally: {e}")
+                return collect_fn(JobProgressBar(flight), flight.cancel)
+            doc = coll.find_one({"_id": flight.key}) or {}
+            if doc.get("status") == "done":
+                return self._download(flight, doc)
+            flight.progress_value = float(doc.get("progress") or flight.progress_value)
+            flight.progress_text = "같은 조건의 수집이 다른 서버에서 진행 중… 결과를 기다리는 중"
+            time.sleep(1.0)
+        return None
+
+    def _lead(self, coll, flight, collect_fn):
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(COLLECT_FLIGHT_LEASE_SEC / 3):
+                try:
+                    coll.update_one({"_id": flight.key, "owner": flight.owner}, {"$set": {
+                        "leaseUntil": datetime.utcnow() + timedelta(seconds=COLLECT_FLIGHT_LEASE_SEC),
+                        "progress": flight.progress_value}})
+                except Exception as e:
+                    print(f"⚠️ [collect flight] lease renew failed: {e}")
+
+        threading.Thread(target=renew, name=f"collect-flight-lease-{flight.key[:8]}", daemon=True).start()
+        try:
+            result = collect_fn(JobProgressBar(flight), flight.cancel)
+        except Exception:
+            stop.set()
+            coll.update_one({"_id": flight.key, "owner": flight.owner}, {"$set": {"status": "failed"}})
+            raise
+        stop.set()
+        if flight.cancel.is_cancelled():
+            coll.update_one({"_id": flight.key, "owner": flight.owner}, {"$set": {"status": "failed"}})
+        else:
+            self._publish(coll, flight, result)
+        return result
+
+    def _publish(self, coll, flight, result):
+        csv_path, total, df_stats = result
+        chunks = self._coll(chunks=True)
+        try:
+            with open(csv_path, "rb") as f:
+                blob = _b64_gzip_bytes(f.read())
+            now = datetime.utcnow()
+            expires = now + timedelta(minutes=COLLECT_FLIGHT_REUSE_MIN + 5)
+            parts = [blob[i:i + self.CHUNK_CHARS] for i in range(0, len(blob), self.CHUNK_CHARS)] or [""]
+            chunks.delete_many({"flight": flight.key})
+            chunks.insert_many([{"_id": f"{flight.key}:{flight.owner}:{i}", "flight": flight.key, "owner": flight.owner,
+                                 "seq": i, "data": part, "expiresAt": expires} for i, part in enumerate(parts)])
+            stats_raw = df_stats.to_json(orient="records", force_ascii=False).encode("utf-8")
+            coll.update_one({"_id": flight.key, "owner": flight.owner}, {"$set": {
+                "status": "done", "doneAt": now, "expiresAt": expires, "total": int(total),
+                "parts": len(parts), "stats_b64gz": _b64_gzip_bytes(stats_raw)}})
+        except Exception as e:
+            print(f"⚠️ [collect flight] publish failed: {e}")
+            coll.update_one({"_id": flight.key, "owner": flight.owner}, {"$set": {"status": "failed"}})
+
+    def _download(self, flight, doc):
+        chunks = self._coll(chunks=True)
+        parts = list(chunks.find({"flight": flight.key, "owner": doc.get("owner")}).sort("seq", 1))
+        if len(parts) != int(doc.get("parts") or 0):
+            raise RuntimeError("collect flight result is incomplete")
+        out_csv = os.path.join(BASE_DIR, f"collect_{uuid4().hex}.csv")
+        with open(out_csv, "wb") as f:
+            f.write(_ungzip_b64_to_bytes("".join(p["data"] for p in parts)))
+        stats = json.loads(_ungzip_b64_to_bytes(doc.get("stats_b64gz") or "").decode("utf-8") or "[]")
+        print(f"[collect flight] reuse remote result {flight.key[:12]} rows={doc.get('total')}")
+        return out_csv, int(doc.get("total") or 0), pd.DataFrame(stats)
+
+
+@st.cache_resource
+def get_collect_flights() -> CollectFlightCoordinator:
+    return CollectFlightCoordinator()
 # endregion
 
 
@@ -2305,30 +5128,59 @@ def render_metadata_and_downloads():
                 if sample_cnt is not None and sample_chars is not None:
                     st.caption(f"AI 입력 샘플: {sample_cnt:,}줄 / {sample_chars:,} chars")
 
+def render_message_content(content, role="assistant", target=None):
+    # target: st.empty() 자리표시자 등 (스트리밍 중 같은 자리에 다시 그릴 때)
+    target = target or st
+    if isinstance(content, str) and role == "assistant" and ("<div" in content or "<style" in content):
+        report_style = """
+        <style>
+        .yt-report { font-family: "Helvetica Neue", Arial, sans-serif; line-height: 1.6; color: #333; }
+        .yt-report .header { border-bottom: 2px solid #eee; padding-bottom: 10px; margin-bottom: 15px; }
+        .yt-report .badge { background: #f0f2f6; color: #31333F; padding: 2px 8px; border-radius: 4px; font-size: 0.85em; margin-right: 5px; font-weight: 600; }
+        .yt-report .card { background: white; border: 1px solid #ddd; border-radius: 8px; padding: 15px; margin-bottom: 15px; box-shadow: 0 1px 3px rgba(0,0,0,0.05); }
+        .yt-report h3 { font-size: 1.1em; margin-top: 0; margin-bottom: 10px; color: #000; font-weight: 700; }
+        .yt-report .quote { border-left: 3px solid #ff4b4b; padding-left: 10px; color: #555; font-style: italic; margin: 5px 0; font-size: 0.95em; background: #fafafa; padding: 5px 10px; }
+        .yt-report table { width: 100%; border-collapse: collapse; font-size: 0.9em; margin: 10px 0; }
+        .yt-report th { text-align: left; border-bottom: 2px solid #ddd; padding: 5px; color: #555; background-color: #f9fafb; }
+        .yt-report td { border-bottom: 1px solid #eee; padding: 8px 5px; vertical-align: top; }
+        </style>
+        """
+        full_html = f"<div class='yt-report'>{report_style}{content}</div>"
+        target.markdown(full_html, unsafe_allow_html=True)
+    else:
+        target.markdown(content)
+
+
+class StreamingAnswerView:
+    """Gemini 스트리밍 조각을 AnswerTidier로 정리하면서 자리표시자에 점진적으로 그림.
+    렌더링은 GEMINI_STREAM_RENDER_SEC 간격으로만 (조각마다 그리지 않음)."""
+    def __init__(self, placeholder, min_interval=GEMINI_STREAM_RENDER_SEC):
+        self.placeholder = placeholder
+        self.min_interval = float(min_interval)
+        self.tidier = AnswerTidier()
+        self.first_chunk_at = None
+        self._t0 = time.time()
+        self._last_render = 0.0
+
+    def feed(self, delta: str):
+        self.tidier.feed(delta)
+        now = time.time()
+        if self.first_chunk_at is None:
+            self.first_chunk_at = now
+            print(f"[METRICS] gemini_stream first_chunk_sec={now - self._t0:.2f}")
+        if now - self._last_render >= self.min_interval:
+            self.render()
+
+    def render(self):
+        self._last_render = time.time()
+        if text := self.tidier.text:
+            render_message_content(text, "assistant", target=self.placeholder)
+
+
 def render_chat():
     for msg in st.session_state.chat:
         with st.chat_message(msg.get("role", "user")):
-            content = msg.get("content", "")
-            
-            if isinstance(content, str) and msg.get("role") == "assistant" and ("<div" in content or "<style" in content):
-                report_style = """
-                <style>
-                .yt-report { font-family: "Helvetica Neue", Arial, sans-serif; line-height: 1.6; color: #333; }
-                .yt-report .header { border-bottom: 2px solid #eee; padding-bottom: 10px; margin-bottom: 15px; }
-                .yt-report .badge { background: #f0f2f6; color: #31333F; padding: 2px 8px; border-radius: 4px; font-size: 0.85em; margin-right: 5px; font-weight: 600; }
-                .yt-report .card { background: white; border: 1px solid #ddd; border-radius: 8px; padding: 15px; margin-bottom: 15px; box-shadow: 0 1px 3px rgba(0,0,0,0.05); }
-                .yt-report h3 { font-size: 1.1em; margin-top: 0; margin-bottom: 10px; color: #000; font-weight: 700; }
-                .yt-report .quote { border-left: 3px solid #ff4b4b; padding-left: 10px; color: #555; font-style: italic; margin: 5px 0; font-size: 0.95em; background: #fafafa; padding: 5px 10px; }
-                .yt-report table { width: 100%; border-collapse: collapse; font-size: 0.9em; margin: 10px 0; }
-                .yt-report th { text-align: left; border-bottom: 2px solid #ddd; padding: 5px; color: #555; background-color: #f9fafb; }
-                .yt-report td { border-bottom: 1px solid #eee; padding: 8px 5px; vertical-align: top; }
-                </style>
-                """
-                full_html = f"<div class='yt-report'>{report_style}{content}</div>"
-                st.markdown(full_html, unsafe_allow_html=True)
-                
-            else:
-                st.markdown(content)
+            render_message_content(msg.get("content", ""), msg.get("role", "user"))
 # endregion
 
 
@@ -2385,26 +5237,785 @@ def parse_light_block_to_schema(light_text: str) -> dict:
     return {"start_iso": start_iso, "end_iso": end_iso, "keywords": keywords, "options": options, "raw": raw}
 
 
-def run_pipeline_first_turn(user_query: str, extra_video_ids=None, only_these_videos: bool = False):
+# ---- LIGHT_PROMPT 로컬 해석 ----
+# 자주 오는 형태("최근 24시간 X", "12월 한달간 X", "지난주 X")는 규칙으로 바로 해석.
+# 결과는 LIGHT_PROMPT 응답과 같은 5줄 블록으로 만들어 parse_light_block_to_schema를 그대로 통과시킴.
+_KO_COUNT = {"한": 1, "두": 2, "세": 3, "네": 4, "다섯": 5, "여섯": 6, "일곱": 7, "여덟": 8, "아홉": 9, "열": 10}
+_KO_SPAN_WORDS = {"하루": (1, "일"), "이틀": (2, "일"), "사흘": (3, "일"), "나흘": (4, "일"), "보름": (15, "일"),
+                  "일주일": (1, "주")}
+# 앞뒤가 한글로 붙어 있으면 제목 속 글자("한일전", "열일곱")로 보고 기간으로 치지 않음 (뒤에 붙는 조사 의/에만 허용)
+_LIGHT_REL_RE = re.compile(
+    r"(?:최근|지난|요즘|근|과거)?\s*(?:(?<![가-힣])(\d+|한|두|세|네|다섯|여섯|일곱|여덟|아홉|열)\s*(시간|일|주일|주|개월|달)|"
+    r"(?<![가-힣])(하루|이틀|사흘|나흘|보름|일주일))\s*(?:간|동안|치|사이|내|이내)?(?=$|[^가-힣]|[의에])")
+_LIGHT_NAMED_RE = re.compile(r"오늘(?:\s*하루)?|금일|어제|그제|그저께|이번\s*주|금주|지난\s*주|저번\s*주|이번\s*달|금월|"
+                             r"지난\s*달|저번\s*달|올해|금년|작년|지난\s*해")
+_LIGHT_DAY = r"(?:(\d{4})\s*년\s*)?(?:(\d{1,2})\s*월\s*(\d{1,2})\s*일|(\d{1,2})/(\d{1,2}))"
+_LIGHT_DAY_RANGE_RE = re.compile(_LIGHT_DAY + r"\s*(?:~|-|부터|에서)\s*(?:" + _LIGHT_DAY + r"|(\d{1,2})\s*일)\s*(?:까지)?")
+_LIGHT_DAY_RE = re.compile(_LIGHT_DAY + r"(?:\s*(?:하루|당일|동안|간))?")
+_LIGHT_MONTH_RE = re.compile(r"(?:(\d{4})\s*년\s*)?(\d{1,2})\s*월(?!\s*\d)(?:\s*(?:한\s*달\s*(?:간|동안)?|전체|내내|동안|간|중))?")
+_LIGHT_OPT_RE = {
+    "replies": re.compile(r"답글|대댓글|답장|replies", re.I),
+    "official": re.compile(r"공식\s*(?:채널|계정|영상)"),
+    "unofficial": re.compile(r"비공식|팬\s*채널|개인\s*채널"),
+    "en": re.compile(r"영어|영문|해외|외국|글로벌"),
+    "ko": re.compile(r"한국어|국내"),
+}
+# 이/가/의/로는 제목 끝 글자와 겹치는 경우가 많아서("정년이") 떼지 않음 → 남으면 Gemini로
+_LIGHT_PARTICLES = (r"에\s*대한", r"에\s*대해서", r"에\s*대해", "이랑", "에서", "으로", "한테", "은", "는", "을", "를",
+                    "에", "도", "만", "과", "와", "랑")
+_LIGHT_TAIL_WORDS = ("해주세요", "해줄래", "해줘", "알려줘", "보여줘", "어때요", "어때", "어떤지", "어떰", "좀",
+                     "반응", "요약", "분석", "정리", "여론", "분위기", "평가", "댓글", "관련")
+_LIGHT_FILLERS = {"반응", "요약", "분석", "정리", "여론", "분위기", "평가", "댓글", "댓글들", "시청자", "시청자들", "유튜브",
+                  "관련", "대한", "대해", "대해서", "해줘", "해주세요", "알려줘", "보여줘", "어때", "어떤지", "좀", "줘", "주세요",
+                  "궁금해", "궁금", "까지", "부터", "기간", "동안", "최근", "지난", "요즘", "사람들", "반응들", "전체", "영상",
+                  "채널", "공식", "비공식", "답글", "대댓글", "포함", "위주", "중심", "어떻게", "뭐래", "어땠어", "있어", "보여",
+                  "해외", "국내", "영어", "한국어", "팬", "개인", "보고서", "리포트", "알려", "해봐", "부탁해", "부탁",
+                  "포함", "포함해서", "포함해", "포함한", "같이"}
+
+
+def _shift_months(dt: datetime, months: int) -> datetime:
+    y, m = divmod(dt.month - 1 + months, 12)
+    y, m = dt.year + y, m + 1
+    last = (datetime(y + (m == 12), m % 12 + 1, 1) - timedelta(days=1)).day
+    return dt.replace(year=y, month=m, day=min(dt.day, last))
+
+
+def _light_day(now, y, mo, d, mo2=None, d2=None):
+    """(년, 월, 일) 또는 (월/일) 캡처 → 날짜. 연도가 없고 오늘보다 뒤면 작년으로."""
+    mo, d = int(mo or mo2), int(d or d2)
+    day = datetime(int(y) if y else now.year, mo, d, tzinfo=KST)
+    if not y and day.date() > now.date():
+        day = day.replace(year=day.year - 1)
+    return day
+
+
+def _light_local_period(q: str, now: datetime):
+    """질문에서 기간 표현을 찾아 (start, end, 매칭 구간 목록). 기간 표현이 정확히 1개일 때만 기간을 돌려줌."""
+    found = []   # (start, end, span)
+    day0 = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    taken = []
+
+    def free(m):
+        return all(m.end() <= a or m.start() >= b for a, b in taken)
+
+    for m in _LIGHT_DAY_RANGE_RE.finditer(q):
+        g = m.groups()
+        try:
+            a = _light_day(now, *g[0:5])
+            b = (a.replace(day=int(g[10])) if g[10] else _light_day(now, *g[5:10]))
+            if g[10] is None and not g[5] and b < a:
+                b = b.replace(year=a.year)
+        except ValueError:
+            return None
+        found.append((a, min(b + timedelta(days=1) - timedelta(seconds=1), now), m.span()))
+        taken.append(m.span())
+    for m in _LIGHT_DAY_RE.finditer(q):
+        if not free(m):
+            continue
+        try:
+            a = _light_day(now, *m.groups())
+        except ValueError:
+            return None
+        found.append((a, min(a + timedelta(days=1) - timedelta(seconds=1), now), m.span()))
+        taken.append(m.span())
+    for m in _LIGHT_MONTH_RE.finditer(q):
+        if not free(m):
+            continue
+        y, mo = m.group(1), int(m.group(2))
+        if not 1 <= mo <= 12:
+            return None
+        a = datetime(int(y) if y else now.year, mo, 1, tzinfo=KST)
+        if not y and a > now:
+            a = a.replace(year=a.year - 1)
+        found.append((a, min(_shift_months(a, 1) - timedelta(seconds=1), now), m.span()))
+        taken.append(m.span())
+    for m in _LIGHT_NAMED_RE.finditer(q):
+        if not free(m):
+            continue
+        w = re.sub(r"\s+", "", m.group(0)).replace("오늘하루", "오늘")
+        monday = day0 - timedelta(days=day0.weekday())
+        month1 = day0.replace(day=1)
+        year1 = day0.replace(month=1, day=1)
+        a, b = {
+            "오늘": (day0, now), "금일": (day0, now),
+            "어제": (day0 - timedelta(days=1), day0 - timedelta(seconds=1)),
+            "그제": (day0 - timedelta(days=2), day0 - timedelta(days=1, seconds=1)),
+            "그저께": (day0 - timedelta(days=2), day0 - timedelta(days=1, seconds=1)),
+            "이번주": (monday, now), "금주": (monday, now),
+            "지난주": (monday - timedelta(days=7), monday - timedelta(seconds=1)),
+            "저번주": (monday - timedelta(days=7), monday - timedelta(seconds=1)),
+            "이번달": (month1, now), "금월": (month1, now),
+            "지난달": (_shift_months(month1, -1), month1 - timedelta(seconds=1)),
+            "저번달": (_shift_months(month1, -1), month1 - timedelta(seconds=1)),
+            "올해": (year1, now), "금년": (year1, now),
+            "작년": (year1.replace(year=year1.year - 1), year1 - timedelta(seconds=1)),
+            "지난해": (year1.replace(year=year1.year - 1), year1 - timedelta(seconds=1)),
+        }[w]
+        found.append((a, b, m.span()))
+        taken.append(m.span())
+    for m in _LIGHT_REL_RE.finditer(q):
+        if not free(m) or not m.group(0).strip():
+            continue
+        if m.group(3):
+            n, unit = _KO_SPAN_WORDS[m.group(3)]
+        else:
+            n = int(m.group(1)) if m.group(1).isdigit() else _KO_COUNT[m.group(1)]
+            unit = m.group(2)
+        if n <= 0:
+            return None
+        if unit == "시간":
+            a = now - timedelta(hours=n)
+        elif unit == "일":
+            a = now - timedelta(days=n)
+        elif unit in ("주", "주일"):
+            a = now - timedelta(weeks=n)
+        else:
+            a = _shift_months(now, -n)
+        found.append((a, now, m.span()))
+        taken.append(m.span())
+
+    if len(found) != 1 or found[0][0] >= found[0][1]:
+        return None
+    return found[0]
+
+
+def _light_local_keyword(q: str):
+    """기간/옵션/군더더기를 걷어낸 뒤 남는 토큰이 정확히 1개면 그게 키워드.
+    1글자 토큰이 남으면 기간 표현이 제목을 잘못 자른 것일 수 있으니 None (→ Gemini)."""
+    quoted = re.findall(r"[\"'“”‘’「『]([^\"'“”‘’」』]{2,40})[\"'“”‘’」』]", q)
+    if len(quoted) == 1:
+        return quoted[0].strip()
+    for rx in _LIGHT_OPT_RE.values():
+        q = rx.sub(" ", q)
+    tokens = []
+    for tok in re.split(r"[\s,.!?~…·()\[\]{}:;]+", q):
+        for _ in range(3):
+            for suf in _LIGHT_TAIL_WORDS + _LIGHT_PARTICLES:
+                t2 = re.sub(f"(?:{suf})$", "", tok)
+                if t2 != tok and len(t2) >= 2:
+                    tok = t2
+                    break
+        if tok and tok not in _LIGHT_FILLERS and not re.fullmatch(r"[^가-힣A-Za-z0-9]+|\d+", tok):
+            tokens.append(tok)
+    if any(len(t) < 2 for t in tokens):
+        return None
+    return tokens[0] if len(tokens) == 1 else None
+
+
+def parse_query_locally(user_query: str, now: datetime = None):
+    """LIGHT_PROMPT 없이 규칙으로 해석. 기간 1개 + 키워드 1개가 확실하면 schema(dict), 아니면 None (→ Gemini)."""
+    now = (now or now_kst()).astimezone(KST).replace(microsecond=0)
+    q = strip_urls(user_query or "")
+    if not q:
+        return None
+    period = _light_local_period(q, now)
+    if period is None:
+        return None
+    start, end, (a, b) = period
+    keyword = _light_local_keyword(q[:a] + " " + q[b:])
+    if not keyword:
+        return None
+    opts = {
+        "include_replies": "true" if _LIGHT_OPT_RE["replies"].search(q) else "false",
+        "channel_filter": ("unofficial" if _LIGHT_OPT_RE["unofficial"].search(q)
+                           else "official" if _LIGHT_OPT_RE["official"].search(q) else "any"),
+        "lang": "en" if _LIGHT_OPT_RE["en"].search(q) else "ko" if _LIGHT_OPT_RE["ko"].search(q) else "auto",
+    }
+    light = (
+        f"- 한 줄 요약: {keyword} 관련 유튜브 반응 ({to_iso_kst(start)[:10]} ~ {to_iso_kst(end)[:10]})\n"
+        f"- 기간(KST): {to_iso_kst(start)} ~ {to_iso_kst(end)}\n"
+        f"- 키워드: [{keyword}]\n"
+        f"- 옵션: {{ include_replies: {opts['include_replies']}, channel_filter: \"{opts['channel_filter']}\", lang: \"{opts['lang']}\" }}\n"
+        f"- 원문: {user_query}"
+    )
+    return parse_light_block_to_schema(light)
+
+
+# 해석기 벤치마크 기본 질의 (실제 사용 패턴). search_logs의 Gemini 해석 이력과 함께 비교에 사용
+LIGHT_PARSE_BENCHMARK_QUERIES = (
+    "최근 24시간 태풍상사 반응 요약해줘",
+    "12월 한달간 프로보노 반응 분석해줘",
+    "지난주 폭싹속았수다 반응",
+    "최근 48시간 정경호 반응 어때?",
+    "최근 일주일 흑백요리사 반응 정리해줘",
+    "어제 런닝맨 반응 알려줘",
+    "이번달 나혼자산다 댓글 반응",
+    "최근 3일간 오징어게임 여론",
+    "11월 1일부터 11월 15일까지 정년이 반응",
+    "10/1~10/7 태풍상사 반응 분석",
+    "최근 2주 백번의추억 반응 분석해줘",
+    "오늘 하루 환승연애 반응 좀 알려줘",
+    "지난달 우리영화 반응 요약",
+    "최근 한 달 동안 \"은중과 상연\" 반응",
+    "최근 72시간 미지의서울 답글까지 포함해서 분석해줘",
+    "태풍상사 반응 요약해줘",
+    "최근 24시간 폭싹 속았수다 아이유 연기 반응",
+    "한일전 반응 요약",
+    "한일가왕전 반응",
+    "열일곱 반응",
+)
+# 로컬 해석기가 틀리기 쉬운 질의의 정답 (Gemini가 내는 것과 같은 schema). 기간이 없으면 start/end=None
+# → 로컬은 해석하지 말고 Gemini로 넘겨야 정답. live 여부와 상관없이 매번 비교함
+LIGHT_PARSE_BENCHMARK_EXPECTED = {
+    "한일전 반응 요약": {"keywords": ["한일전"], "start_iso": None, "end_iso": None},
+    "한일가왕전 반응": {"keywords": ["한일가왕전"], "start_iso": None, "end_iso": None},
+    "열일곱 반응": {"keywords": ["열일곱"], "start_iso": None, "end_iso": None},
+}
+
+
+def _light_schema_matches(a: dict, b: dict, tol_sec: int = 600) -> tuple:
+    """(키워드 일치, 기간 일치). 기간은 양 끝이 tol_sec 이내면 같은 것으로 봄 (Gemini의 '지금'과 로컬의 '지금' 차이)."""
+    norm = lambda kws: [_normalize_search_keyword(k).replace(" ", "") for k in (kws or [])][:1]
+    kw_ok = bool(a.get("keywords")) and norm(a.get("keywords")) == norm(b.get("keywords"))
+    try:
+        period_ok = all(abs((datetime.fromisoformat(a[k]) - datetime.fromisoformat(b[k])).total_seconds()) <= tol_sec
+                        for k in ("start_iso", "end_iso"))
+    except Exception:
+        period_ok = False
+    return kw_ok, period_ok
+
+
+def benchmark_light_parser(history_limit: int = 300, live: bool = False):
+    """로컬 해석기 vs Gemini(LIGHT_PROMPT) 정확도·지연 비교.
+    - 이력: search_logs에 남은 Gemini 해석 결과를 정답으로, 당시 시각(timestamp) 기준으로 로컬 해석을 다시 돌려 비교
+    - 정답표: LIGHT_PARSE_BENCHMARK_EXPECTED와 비교 (기간 없는 정답을 로컬이 해석하면 오답)
+    - live=True: LIGHT_PARSE_BENCHMARK_QUERIES를 지금 양쪽으로 실제 해석해서 비교 (Gemini 호출 발생)
+    반환: (요약 dict, 질의별 DataFrame)"""
+    rows = []
+
+    def add(source, query, ref_schema, ref_ms, now):
+        t0 = time.perf_counter()
+        local = parse_query_locally(query, now=now)
+        local_ms = (time.perf_counter() - t0) * 1000
+        kw_ok, period_ok = _light_schema_matches(local, ref_schema) if local else (False, False)
+        rows.append({"source": source, "query": query, "covered": local is not None,
+                     "local_keyword": (local or {}).get("keywords", [""])[0] if local else "",
+                     "gemini_keyword": (ref_schema.get("keywords") or [""])[0],
+                     "keyword_match": kw_ok, "period_match": period_ok, "correct": kw_ok and period_ok,
+                     "local_ms": round(local_ms, 3), "gemini_ms": ref_ms})
+
+    try:
+        client = init_mongo()
+        col = client.get_database("yt_dashboard").get_collection("search_logs") if client else None
+        docs = list(col.find({"parser": {"$ne": "local"}, "raw_query": {"$type": "string"}})
+                    .sort("timestamp", -1).limit(int(history_limit))) if col is not None else []
+    except Exception as e:
+        print(f"⚠️ [light bench] history load failed: {e}")
+        docs = []
+    for d in docs:
+        if not (d.get("range_start") and d.get("range_end") and d.get("timestamp")):
+            continue
+        ts = d["timestamp"].replace(tzinfo=timezone.utc).astimezone(KST)
+        add("history", d["raw_query"], {"keywords": d.get("keywords"), "start_iso": d["range_start"],
+                                        "end_iso": d["range_end"]}, d.get("parse_ms"), ts)
+
+    for q, ref in LIGHT_PARSE_BENCHMARK_EXPECTED.items():
+        add("expected", q, ref, None, now_kst())
+
+    if live and GEMINI_API_KEYS:
+        for q in LIGHT_PARSE_BENCHMARK_QUERIES:
+            t0 = time.perf_counter()
+            with gemini_request_context(GEMINI_PRIO_LIGHT, "light-bench"):
+                light = call_gemini_rotating(GEMINI_MODEL, GEMINI_API_KEYS, "", LIGHT_PROMPT.replace("{USER_QUERY}", q))
+            gem_ms = (time.perf_counter() - t0) * 1000
+            add("live", q, parse_light_block_to_schema(light), round(gem_ms, 1), now_kst())
+
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return {"queries": 0}, df
+    covered = df[df["covered"]]
+    gem_ms = pd.to_numeric(df["gemini_ms"], errors="coerce").dropna()
+    summary = {
+        "queries": int(len(df)),
+        "coverage": round(float(df["covered"].mean()), 3),
+        "accuracy_on_covered": round(float(covered["correct"].mean()), 3) if len(covered) else None,
+        "local_ms_p50": round(float(df["local_ms"].median()), 3),
+        "gemini_ms_p50": round(float(gem_ms.median()), 1) if len(gem_ms) else None,
+    }
+    print("[METRICS] light_parse_bench " + " ".join(f"{k}={v}" for k, v in summary.items()))
+    return summary, df
+
+
+FULL_CORPUS_MAP_PROMPT = (
+    "너는 유튜브 댓글 분석가다. 아래는 수집한 전체 댓글 중 한 묶음(청크)이다. 최종 보고서에 쓸 중간 요약을 만들어라.\n"
+    "- HTML, 인사말, 서론 없이 '-' 항목으로만, 2,000자 이내\n"
+    "- [주요 화제]: 많이 언급된 화제/인물/장면을 비중이 큰 순서로, 대략적인 댓글 수와 함께\n"
+    "- [여론]: 긍정/부정/중립 대략 비율과 그 이유\n"
+    "- [대표 댓글]: 화제별 대표 댓글 원문 그대로 3~8개 (앞의 [T|♥좋아요] 표시 포함)\n"
+    "- [특이사항]: 논란, 반응 변화, 반복되는 요청 등\n"
+    "청크에 없는 내용은 추측하지 마라."
+)
+FULL_CORPUS_COMBINE_PROMPT = (
+    "아래는 같은 주제의 댓글 청크별 중간 요약 여러 개다. 같은 형식([주요 화제]/[여론]/[대표 댓글]/[특이사항])의 "
+    "중간 요약 하나로 합쳐라. 댓글 수는 합산하고, 비율은 댓글 수 기준으로 다시 계산하고, 대표 댓글은 원문 그대로 "
+    "가장 대표적인 것만 남겨라. 3,000자 이내, HTML 없이."
+)
+
+
+def _comment_lines(df: pd.DataFrame, max_chars_per_comment: int = 280) -> pd.Series:
+    """serialize_comments_for_llm_from_file과 같은 줄 형식([T|♥좋아요] 작성자: 본문)을 벡터 연산으로 (전체 댓글용)."""
+    text = df["text"].fillna("").astype(str).str.replace("\n", " ", regex=False)
+    body = text.where(text.str.len() <= max_chars_per_comment, text.str[:max_chars_per_comment] + "…")
+    is_reply = pd.to_numeric(df["isReply"], errors="coerce").fillna(0).astype(int) == 1
+    kind = is_reply.map({True: "R", False: "T"})
+    likes = pd.to_numeric(df["likeCount"], errors="coerce").fillna(0).astype(int).astype(str)
+    author = df["author"].fillna("").astype(str).str.replace("\n", " ", regex=False)
+    return "[" + kind + "|♥" + likes + "] " + author + ": " + body
+
+
+def build_corpus_chunks(csv_path: str, split: str = FULL_CORPUS_SPLIT,
+                        chunk_tokens: int = FULL_CORPUS_CHUNK_TOKENS) -> list:
+    """전체 댓글 → map 입력 청크 [{"label", "text", "comments", "chars", "tokens"}] (토큰은 TokenEstimator 추정치).
+    split="video": 영상별 머리글 + 좋아요순, 작은 영상은 한 청크에 같이 담고 큰 영상은 여러 청크로 나눔
+    split="time": 작성 시각순, 날짜(KST) 머리글"""
+    try:
+        df = pd.read_csv(csv_path)
+    except Exception as e:
+        print(f"⚠️ [full corpus] csv read failed: {e}")
+        return []
+    if df.empty:
+        return []
+
+    df["_line"] = _comment_lines(df)
+    if split == "time":
+        ts = pd.to_datetime(df["publishedAt"], errors="coerce", utc=True).dt.tz_convert(KST)
+        df = df.assign(_ts=ts).sort_values("_ts", kind="stable")
+        df["_group"] = df["_ts"].dt.strftime("%Y-%m-%d").fillna("날짜 미상")
+    else:
+        df["likeCount"] = pd.to_numeric(df["likeCount"], errors="coerce").fillna(0)
+        df = df.sort_values(["video_id", "likeCount"], ascending=[True, False], kind="stable")
+        df["_group"] = (df["video_title"].fillna("").astype(str).str.replace("\n", " ", regex=False)
+                        + " (" + df["video_id"].astype(str) + ")")
+
+    est = get_token_estimator()
+    chunks = []
+    cur, cur_chars, cur_tokens, cur_n, labels = [], 0, 0, 0, []
+
+    def _flush():
+        if cur_n:
+            label = labels[0] + (f" 외 {len(labels) - 1}개" if len(labels) > 1 else "")
+            chunks.append({"label": label, "text": "\n".join(cur), "comments": cur_n,
+                           "chars": cur_chars, "tokens": cur_tokens})
+
+    for group, lines in df.groupby("_group", sort=False)["_line"]:
+        in_cur, started = False, False   # 현재 청크에 이 그룹 머리글이 있는지 / 앞 청크에서 이미 시작했는지
+        for line in lines:
+            tokens = est.estimate(line) + 1
+            header = f"## {group} (이어서)" if started else f"## {group}"
+            head_tokens = 0 if in_cur else est.estimate(header) + 1
+            # 머리글 + 첫 줄이 안 들어가면 머리글째 다음 청크로 (빈 머리글, 실제로 안 담긴 그룹의 '외 N개' 방지)
+            if cur_n and cur_tokens + head_tokens + tokens > chunk_tokens:
+                _flush()
+                cur, cur_chars, cur_tokens, cur_n, labels = [], 0, 0, 0, []
+                in_cur, head_tokens = False, est.estimate(header) + 1
+            if not in_cur:
+                cur.append(header)
+                cur_chars += len(header) + 1
+                cur_tokens += head_tokens
+                labels.append(group)
+                in_cur = True
+            started = True
+            cur.append(line)
+            cur_chars += len(line) + 1
+            cur_tokens += tokens
+            cur_n += 1
+    _flush()
+    return chunks
+
+
+def _summarize_parts(parts, system_prompt, user_id=None, cancel=None, on_done=None):
+    """parts(청크 텍스트 목록)를 Gemini로 동시에 요약. 동시 수는 대기열(MAX_GEMINI_INFLIGHT)이 제한하고
+    키는 클라이언트 풀이 돌려가며 고름. 실패한 조각은 None. 취소되면 남은 조각은 건너뜀."""
+    results = [None] * len(parts)
+
+    def _one(i):
+        if cancel is not None and cancel.is_cancelled():
+            return i, None
+        try:
+            # 워커 스레드마다 대기열 컨텍스트를 다시 잡음 (thread-local) → 같은 사용자 차례 규칙 그대로 적용
+            with gemini_request_context(GEMINI_PRIO_REPORT, user_id):
+                out = call_gemini_rotating(GEMINI_MODEL, GEMINI_API_KEYS, system_prompt, parts[i],
+                                           max_tokens=FULL_CORPUS_MAP_MAX_TOKENS)
+        except Exception as e:
+            print(f"⚠️ [full corpus] part {i + 1}/{len(parts)} failed: {e}")
+            return i, None
+        return i, (out if out and not out.startswith("⚠️") else None)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_GEMINI_INFLIGHT, len(parts))),
+                            thread_name_prefix="full-corpus") as ex:
+        for fut in as_completed([ex.submit(_one, i) for i in range(len(parts))]):
+            i, out = fut.result()
+            results[i] = out
+            if on_done is not None:
+                on_done()
+    return results
+
+
+def summarize_corpus_map_reduce(csv_path: str, prog_bar=None, user_id=None, cancel=None,
+                                split: str = FULL_CORPUS_SPLIT, progress_range=(0.90, 0.97)):
+    """전체 댓글 모드의 map 단계. 청크별 부분 요약을 동시에 받고, 합친 길이가 FULL_CORPUS_REDUCE_MAX_TOKENS를
+    넘으면 묶어서 다시 요약(combine). 반환 (부분 요약 텍스트, meta). 취소되면 텍스트는 None."""
+    t0 = time.perf_counter()
+    chunks = build_corpus_chunks(csv_path, split=split)
+    meta = {"split": split, "chunks": len(chunks), "comments": sum(c["comments"] for c in chunks),
+            "chars": sum(c["chars"] for c in chunks), "tokens_est": sum(c["tokens"] for c in chunks),
+            "failed": 0, "combine_rounds": 0}
+    if not chunks:
+        return "", meta
+    meta["chunk_sec"] = round(time.perf_counter() - t0, 2)
+
+    lo, hi = progress_range
+    n, done = len(chunks), [0]
+    done_lock = threading.Lock()
+
+    def _on_done():
+        with done_lock:
+            done[0] += 1
+            k = done[0]
+        if prog_bar is not None:
+            prog_bar.progress(lo + (hi - lo) * k / n, text=f"전체 댓글 부분 요약 {k}/{n}…")
+
+    if prog_bar is not None:
+        prog_bar.progress(lo, text=f"전체 댓글 부분 요약 0/{n}…")
+    payloads = [f"[청크 {i + 1}/{n}] {c['label']} · 댓글 {c['comments']:,}개\n{c['text']}" for i, c in enumerate(chunks)]
+    outs = _summarize_parts(payloads, FULL_CORPUS_MAP_PROMPT, user_id, cancel, _on_done)
+    if cancel is not None and cancel.is_cancelled():
+        return None, meta
+    meta["failed"] = sum(1 for o in outs if o is None)
+    parts = [f"### 청크 {i + 1} · {c['label']} · 댓글 {c['comments']:,}개\n{o.strip()}"
+             for i, (c, o) in enumerate(zip(chunks, outs)) if o]
+    meta["map_sec"] = round(time.perf_counter() - t0, 2)
+
+    # 부분 요약이 너무 길면 보고서 입력 한도 안으로 들어올 때까지 묶어서 다시 요약
+    est = get_token_estimator()
+    while len(parts) > 1 and sum(est.estimate(x) + 1 for x in parts) > FULL_CORPUS_REDUCE_MAX_TOKENS:
+        if prog_bar is not None:
+            prog_bar.progress(hi, text=f"부분 요약 {len(parts)}개 합치는 중…")
+        groups, cur, cur_tokens = [], [], 0
+        for x in parts:
+            # 묶음마다 최소 2개 → 라운드마다 개수가 줄어듦
+            x_tokens = est.estimate(x) + 1
+            if len(cur) >= 2 and cur_tokens + x_tokens > FULL_CORPUS_REDUCE_MAX_TOKENS:
+                groups.append(cur)
+                cur, cur_tokens = [], 0
+            cur.append(x)
+            cur_tokens += x_tokens
+        groups.append(cur)
+        outs = _summarize_parts(["\n\n".join(g) for g in groups], FULL_CORPUS_COMBINE_PROMPT, user_id, cancel)
+        if cancel is not None and cancel.is_cancelled():
+            return None, meta
+        # combine이 실패한 묶음은 원래 부분 요약을 그대로 둠
+        parts = [f"### 묶음 {i + 1}\n{o.strip()}" if o else "\n\n".join(g) for i, (g, o) in enumerate(zip(groups, outs))]
+        meta["combine_rounds"] += 1
+    meta["reduce_input_tokens_est"] = sum(est.estimate(x) + 1 for x in parts)
+    meta["map_reduce_sec"] = round(time.perf_counter() - t0, 2)
+    print("[METRICS] full_corpus_map " + " ".join(f"{k}={v}" for k, v in meta.items()))
+    return "\n\n".join(parts), meta
+
+
+def _log_full_corpus_run(meta: dict, user_id=None):
+    """전체 댓글 모드 실행 기록 (댓글 규모 대비 소요 시간 벤치마크용, TTL 90일)."""
+    try:
+        coll = _mongo_aux_coll("full_corpus_runs_coll", "ytcc_full_corpus_runs")
+        if coll is None:
+            return
+        from pymongo import ASCENDING  # type: ignore
+        coll.create_index([("expiresAt", ASCENDING)], expireAfterSeconds=0)
+        now = datetime.utcnow()
+        coll.insert_one({**meta, "user_id": user_id, "createdAt": now, "expiresAt": now + timedelta(days=90)})
+    except Exception as e:
+        print(f"⚠️ [full corpus] run log failed: {e}")
+
+
+def benchmark_full_corpus(limit: int = 200):
+    """전체 댓글 모드 실행 기록으로 댓글 수 대비 소요 시간(wall) 추세를 계산.
+    반환 (요약 dict, 실행별 DataFrame). 기울기는 최소제곱 (초 / 1만 댓글)."""
+    rows = []
+    try:
+        coll = _mongo_aux_coll("full_corpus_runs_coll", "ytcc_full_corpus_runs")
+        if coll is not None:
+            rows = list(coll.find({}, {"_id": 0, "comments": 1, "chars": 1, "tokens_est": 1, "chunks": 1, "split": 1,
+                                       "map_sec": 1, "report_sec": 1, "wall_sec": 1, "createdAt": 1})
+                        .sort("createdAt", -1).limit(int(limit)))
+    except Exception as e:
+        print(f"⚠️ [full corpus] bench load failed: {e}")
+    df = pd.DataFrame(rows)
+    if df.empty or "wall_sec" not in df:
+        return {"runs": 0}, df
+    df = df.dropna(subset=["comments", "wall_sec"]).sort_values("comments")
+    x, y = df["comments"].astype(float) / 10_000, df["wall_sec"].astype(float)
+    slope = float(((x - x.mean()) * (y - y.mean())).sum() / ((x - x.mean()) ** 2).sum()) if x.nunique() > 1 else None
+    summary = {
+        "runs": len(df),
+        "comments_p50": int(df["comments"].median()),
+        "wall_sec_p50": round(float(y.median()), 1),
+        "sec_per_10k_p50": round(float((y / x.clip(lower=1e-4)).median()), 1),
+        "slope_sec_per_10k": round(slope, 1) if slope is not None else None,
+        "intercept_sec": round(float(y.mean() - slope * x.mean()), 1) if slope is not None else None,
+    }
+    print("[METRICS] full_corpus_bench " + " ".join(f"{k}={v}" for k, v in summary.items()))
+    return summary, df
+
+
+@st.cache_resource
+def get_kiwi():
+    """형태소 분석기 (kiwipiepy). 없으면 None → 댓글 검색 인덱스 비활성."""
+    try:
+        from kiwipiepy import Kiwi
+    except ModuleNotFoundError:
+        print("⚠️ [comment index] kiwipiepy not installed, retrieval disabled")
+        return None
+    return Kiwi(num_workers=COMMENT_INDEX_KIWI_WORKERS, model_type="knlm")
+
+
+class CommentBM25Index:
+    """수집 댓글 전체의 BM25 역색인 (세션 = 수집 CSV 하나).
+    - 어절(공백 단위) 단위로 형태소 분석 결과를 재사용 → 같은 어절은 한 번만 분석 (댓글은 어절 중복이 많음)
+    - 색인어: 명사/동사·형용사 어간/어근/외국어/한자
+    - postings는 numpy 배열, 검색은 질의어별로 점수 배열에 더하고 argpartition으로 상위 k개"""
+    KEEP_TAGS = {"NNG", "NNP", "VV", "VA", "XR", "SL", "SH"}
+    K1, B = 1.2, 0.75
+    _kiwi_lock = threading.Lock()   # Kiwi 객체는 한 번에 한 스레드만 (빌드는 조각 단위로 잡아서 검색이 끼어들 수 있게)
+
+    def __init__(self, csv_path: str):
+        self.csv_path = csv_path
+        self.lines = []
+        self.postings = {}
+        self.norm = None
+        self.idf = {}
+        self.stats = {}
+
+    @classmethod
+    def _analyze(cls, kiwi, words) -> dict:
+        """어절 목록 → {어절: (색인어, ...)}."""
+        out = {}
+        for start in range(0, len(words), 2000):
+            batch = words[start:start + 2000]
+            with cls._kiwi_lock:
+                results = list(kiwi.tokenize(batch))
+            for w, toks in zip(batch, results):
+                out[w] = tuple(t.form.lower() if t.tag == "SL" else t.form for t in toks if t.tag in cls.KEEP_TAGS)
+        return out
+
+    def query_terms(self, kiwi, text: str) -> list:
+        words = list(dict.fromkeys((text or "").split()))
+        analyzed = self._analyze(kiwi, words) if words else {}
+        return list(dict.fromkeys(t for w in words for t in analyzed.get(w, ())))
+
+    def build(self, kiwi, df: pd.DataFrame = None):
+        t0 = time.perf_counter()
+        df = pd.read_csv(self.csv_path) if df is None else df
+        self.lines = _comment_lines(df).tolist() if not df.empty else []
+        texts = df["text"].fillna("").astype(str).tolist() if not df.empty else []
+        docs_words = [t.split() for t in texts]
+        vocab = list({w for words in docs_words for w in words})
+        t1 = time.perf_counter()
+        analyzed = self._analyze(kiwi, vocab)
+        t2 = time.perf_counter()
+
+        ids, tfs = {}, {}
+        lengths = np.zeros(len(docs_words), dtype=np.float32)
+        for doc_id, words in enumerate(docs_words):
+            counts = {}
+            for w in words:
+                for term in analyzed.get(w, ()):
+                    counts[term] = counts.get(term, 0) + 1
+            lengths[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                ids.setdefault(term, []).append(doc_id)
+                tfs.setdefault(term, []).append(tf)
+        n_docs = max(1, len(docs_words))
+        avgdl = float(lengths.mean()) if len(lengths) else 1.0
+        self.norm = self.K1 * (1 - self.B + self.B * lengths / max(avgdl, 1e-6))
+        self.postings = {t: (np.asarray(ids[t], dtype=np.int32), np.asarray(tfs[t], dtype=np.float32)) for t in ids}
+        self.idf = {t: math.log(1 + (n_docs - len(v[0]) + 0.5) / (len(v[0]) + 0.5)) for t, v in self.postings.items()}
+        self.stats = {
+            "docs": len(docs_words), "unique_words": len(vocab), "terms": len(self.postings),
+            "postings": int(sum(len(v[0]) for v in self.postings.values())),
+            "read_sec": round(t1 - t0, 2), "tokenize_sec": round(t2 - t1, 2),
+            "build_sec": round(time.perf_counter() - t0, 2),
+        }
+        print("[METRICS] comment_index_build " + " ".join(f"{k}={v}" for k, v in self.stats.items()))
+        return self
+
+    def search(self, kiwi, query: str, k: int = COMMENT_INDEX_TOP_K) -> list:
+        """질문과 관련도 높은 댓글 줄([T|♥좋아요] 작성자: 본문) 상위 k개. 같은 본문은 하나만."""
+        terms = [t for t in self.query_terms(kiwi, query) if t in self.postings]
+        if not terms or self.norm is None:
+            return []
+        scores = np.zeros(len(self.lines), dtype=np.float32)
+        for t in terms:
+            doc_ids, tf = self.postings[t]
+            scores[doc_ids] += self.idf[t] * tf * (self.K1 + 1) / (tf + self.norm[doc_ids])
+        n_pos = int((scores > 0).sum())
+        if not n_pos:
+            return []
+        top = np.argpartition(-scores, min(len(scores) - 1, k * 3))[:k * 3]
+        top = top[np.argsort(-scores[top])]
+        out, seen = [], set()
+        for i in top:
+            if scores[i] <= 0:
+                break
+            body = self.lines[i].split(": ", 1)[-1]
+            if body in seen:
+                continue
+            seen.add(body)
+            out.append(self.lines[i])
+            if len(out) >= k:
+                break
+        return out
+
+
+class CommentIndexRegistry:
+    """세션별(수집 CSV 경로별) 댓글 검색 인덱스. 빌드는 전용 워커 1개에서 차례로 (CPU 과점유 방지),
+    프로세스 전역 LRU(COMMENT_INDEX_MAX_SESSIONS개)."""
+    def __init__(self, max_items: int = COMMENT_INDEX_MAX_SESSIONS):
+        self.max_items = max(1, int(max_items))
+        self._lock = threading.Lock()
+        self._items = OrderedDict()    # csv_path -> CommentBM25Index | Future(빌드 중)
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="comment-index")
+
+    def _build(self, csv_path):
+        kiwi = get_kiwi()
+        if kiwi is None:
+            return None
+        try:
+            index = CommentBM25Index(csv_path).build(kiwi)
+        except Exception as e:
+            print(f"⚠️ [comment index] build failed: {e}")
+            index = None
+        with self._lock:
+            if index is None:
+                self._items.pop(csv_path, None)
+            elif csv_path in self._items:
+                self._items[csv_path] = index
+        return index
+
+    def build_async(self, csv_path):
+        if not COMMENT_INDEX_ENABLED or not csv_path or not os.path.exists(csv_path):
+            return
+        with self._lock:
+            if csv_path in self._items:
+                self._items.move_to_end(csv_path)
+                return
+            self._items[csv_path] = self._pool.submit(self._build, csv_path)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def get(self, csv_path):
+        """완성된 인덱스 (아직 빌드 중이거나 없으면 None, 없으면 빌드 시작 → 불러온 세션도 다음 질문부터 사용)."""
+        with self._lock:
+            item = self._items.get(csv_path)
+            if item is not None:
+                self._items.move_to_end(csv_path)
+        if item is None:
+            self.build_async(csv_path)
+            return None
+        return item if isinstance(item, CommentBM25Index) else None
+
+
+@st.cache_resource
+def get_comment_index_registry() -> CommentIndexRegistry:
+    return CommentIndexRegistry()
+
+
+def retrieve_followup_comments(question: str, history=None, csv_path: str = None, k: int = COMMENT_INDEX_TOP_K) -> list:
+    """후속 질문 근거 댓글 검색. 앞 대화를 가리키는 질문("그럼 그건 왜?")이면 직전 질문까지 질의에 넣음."""
+    if not COMMENT_INDEX_ENABLED:
+        return []
+    csv_path = csv_path or st.session_state.get("last_csv")
+    index = get_comment_index_registry().get(csv_path) if csv_path else None
+    if index is None:
+        return []
+    query = strip_urls(question)
+    if _FOLLOWUP_REF_RE.search(question or ""):
+        prev = [m.get("content", "") for m in (history or []) if m.get("role") == "user"][-1:]
+        query = f"{prev[0] if prev else ''} {query}"
+    t0 = time.perf_counter()
+    hits = index.search(get_kiwi(), query, k)
+    print(f"[METRICS] comment_index_query ms={(time.perf_counter() - t0) * 1000:.1f} hits={len(hits)} docs={len(index.lines)}")
+    return hits
+
+
+# 댓글 검색 벤치마크 기본 질의 (후속 질문 실제 패턴)
+COMMENT_INDEX_BENCHMARK_QUERIES = [
+    "주인공 연기력에 대한 반응은 어때?", "OST 반응 알려줘", "결말에 대한 호불호", "시청률 얘기하는 댓글",
+    "캐스팅 논란 있어?", "배우들 케미 어때", "다음 화 기대하는 반응", "작가 대본 비판",
+]
+
+
+def benchmark_comment_index(csv_path: str, target_rows: int = 120_000, queries=None):
+    """댓글 검색 인덱스 빌드 시간/질의 지연 측정. CSV가 target_rows보다 작으면 행을 반복해 채움
+    (반복분은 어절이 겹쳐서 실제보다 빌드가 빠르게 나옴 → replicated=True로 표시). 반환 (요약 dict, 질의별 DataFrame)."""
+    kiwi = get_kiwi()
+    if kiwi is None or not csv_path or not os.path.exists(csv_path):
+        return {"error": "unavailable"}, pd.DataFrame()
+    df = pd.read_csv(csv_path)
+    replicated = 0 < len(df) < target_rows
+    if replicated:
+        df = pd.concat([df] * (target_rows // len(df) + 1), ignore_index=True).head(target_rows)
+    index = CommentBM25Index(csv_path).build(kiwi, df=df)
+    rows = []
+    for q in (queries or COMMENT_INDEX_BENCHMARK_QUERIES):
+        t0 = time.perf_counter()
+        hits = index.search(kiwi, q)
+        rows.append({"query": q, "ms": round((time.perf_counter() - t0) * 1000, 2), "hits": len(hits),
+                     "top": hits[0][:80] if hits else ""})
+    qdf = pd.DataFrame(rows)
+    summary = {**index.stats, "replicated": replicated,
+               "query_ms_p50": round(float(qdf["ms"].median()), 2),
+               "query_ms_p95": round(float(qdf["ms"].quantile(0.95)), 2)}
+    print("[METRICS] comment_index_bench " + " ".join(f"{k}={v}" for k, v in summary.items()))
+    return summary, qdf
+
+
+def _queue_progress(prog_bar, value):
+    """Gemini 대기열 on_wait 콜백 → 진행 바 문구로 순번/예상 대기 표시 (pos=0이면 입장)."""
+    return lambda pos, eta: prog_bar.progress(
+        value, text=f"AI 대기열 {pos}번째 · 예상 대기 약 {eta:.0f}초" if pos else "AI 분석중…")
+
+
+def run_pipeline_first_turn(user_query: str, extra_video_ids=None, only_these_videos: bool = False,
+                            session=None, prog_bar=None, user_id=None, checkpoint=None, cancel=None,
+                            on_chunk=None):
+    """1차 분석. 기본은 Streamlit 세션에서 바로 실행하고,
+    백그라운드 잡(FirstTurnJob)은 session(dict)/prog_bar/checkpoint/cancel을 넘겨서 실행.
+    on_chunk(delta): 보고서 생성 중 스트리밍 조각 콜백 (잡이 받아서 화면에 점진적으로 그림)"""
+    session = st.session_state if session is None else session
+    bg_session = None if session is st.session_state else session
     extra_video_ids = list(dict.fromkeys(extra_video_ids or []))
-    prog_bar = st.progress(0, text="준비 중…")
+    prog_bar = prog_bar or st.progress(0, text="준비 중…")
 
     if not GEMINI_API_KEYS: return "오류: Gemini API Key가 설정되지 않았습니다."
     prog_bar.progress(0.05, text="해석중…")
     
-    light = call_gemini_rotating(GEMINI_MODEL, GEMINI_API_KEYS, "", LIGHT_PROMPT.replace("{USER_QUERY}", user_query))
-    schema = parse_light_block_to_schema(light)
-    st.session_state["last_schema"] = schema
-    log_search_history(user_query, schema)
+    if checkpoint is not None and checkpoint.schema:
+        schema = checkpoint.schema
+    else:
+        # 흔한 형태는 로컬 규칙으로 바로 해석, 애매하면 LIGHT_PROMPT(Gemini)
+        t0 = time.perf_counter()
+        schema = parse_query_locally(user_query) if LIGHT_LOCAL_PARSE_ENABLED else None
+        parser = "local"
+        if schema is None:
+            parser = "gemini"
+            with gemini_request_context(GEMINI_PRIO_LIGHT, user_id, on_wait=_queue_progress(prog_bar, 0.05)):
+                light = call_gemini_rotating(GEMINI_MODEL, GEMINI_API_KEYS, "", LIGHT_PROMPT.replace("{USER_QUERY}", user_query))
+            schema = parse_light_block_to_schema(light)
+        parse_ms = round((time.perf_counter() - t0) * 1000, 1)
+        print(f"[METRICS] light_parse parser={parser} ms={parse_ms} keywords={schema.get('keywords')}")
+        log_search_history(user_query, schema, user_id=user_id, parser=parser, parse_ms=parse_ms)
+        if checkpoint is not None:
+            checkpoint.schema = schema
+            checkpoint.flush(force=True)
+    session["last_schema"] = schema
 
     prog_bar.progress(0.10, text="영상 수집중…")
     if not YT_API_KEYS: return "오류: YouTube API Key가 설정되지 않았습니다."
     
-    rt = get_session_youtube_client(YT_API_KEYS)
     start_dt, end_dt = datetime.fromisoformat(schema["start_iso"]), datetime.fromisoformat(schema["end_iso"])
     kw_main = schema.get("keywords", [])
 
-    own_mode = bool(st.session_state.get("own_ip_mode", False))
+    own_mode = bool(session.get("own_ip_mode", False))
     pgc_ids = []
     
     # [수정됨] 자사 IP 모드 - DB 직접 검색 (메모리 최적화)
@@ -2423,53 +6034,67 @@ def run_pipeline_first_turn(user_query: str, extra_video_ids=None, only_these_vi
             pass
 
     if only_these_videos and extra_video_ids:
-        all_ids = extra_video_ids
+        search_keywords, known_ids = [], extra_video_ids
     else:
-        all_ids = []
-        # UGC 검색 (유튜브 API)
-        for base_kw in (kw_main or ["유튜브"]):
-            from urllib.parse import quote
-            clean_kw = base_kw.replace(" ", "")
-            search_kw = clean_kw if clean_kw.startswith("#") else f"#{clean_kw}"
-            if search_kw:
-                all_ids.extend(yt_search_videos(rt, search_kw, 100, "viewCount", kst_to_rfc3339_utc(start_dt), kst_to_rfc3339_utc(end_dt)))
-        
-        if extra_video_ids:
-            all_ids.extend(extra_video_ids)
-            
+        # UGC 검색 (유튜브 API) - 키워드별 검색은 파이프라인에서 동시에 실행
+        search_keywords = [kw for kw in (_search_hashtag(k) for k in (kw_main or ["유튜브"])) if kw]
+        known_ids = list(extra_video_ids)
         # PGC(자사 IP) 아이디 합치기
         if own_mode and pgc_ids:
-            all_ids.extend(pgc_ids)
-
-    all_ids = list(dict.fromkeys(all_ids))
-    prog_bar.progress(0.40, text="댓글 수집 준비중…")
-
-    df_stats = pd.DataFrame(yt_video_statistics(rt, all_ids))
-    
-    # OST 제외 필터 (제목 기준)
-    if bool(st.session_state.get("own_ip_mode", False)) and (not df_stats.empty) and ("title" in df_stats.columns):
-        df_stats = df_stats[~df_stats["title"].astype(str).str.contains(r"\bOST\b", case=False, na=False)]
-    
-    st.session_state["last_df"] = df_stats
-
-    csv_path, total_cnt = parallel_collect_comments_streaming(
-        df_stats.to_dict('records'), YT_API_KEYS, bool(schema.get("options", {}).get("include_replies")),
-        MAX_TOTAL_COMMENTS, MAX_COMMENTS_PER_VID, prog_bar
+            known_ids.extend(pgc_ids)
+
+    prog_bar.progress(0.40, text="영상 검색·댓글 수집중…")
+
+    # 검색 → 통계(50개 배치) → 예산 배분 → 댓글 수집을 겹쳐서 실행
+    # OST 제외 필터(제목 기준)는 자사 IP 모드에서 통계 배치마다 적용
+    # 같은 조건의 수집이 이미 돌고 있으면(다른 세션/레플리카 포함) 새로 돌리지 않고 그 결과를 공유
+    include_replies = bool(schema.get("options", {}).get("include_replies"))
+    published_after, published_before = kst_to_rfc3339_utc(start_dt), kst_to_rfc3339_utc(end_dt)
+    flight_key = collect_flight_key(search_keywords, known_ids, published_after, published_before,
+                                    include_replies, own_mode)
+    collected = get_collect_flights().run(
+        flight_key,
+        lambda bar, flight_cancel: collect_first_turn_pipelined(
+            YT_API_KEYS, search_keywords, known_ids, published_after, published_before,
+            include_replies, bar, exclude_ost=own_mode, cancel=flight_cancel, checkpoint=checkpoint
+        ),
+        prog_bar, cancel
     )
-    st.session_state["last_csv"] = csv_path
+    if collected is None:
+        return "분석이 취소되었습니다."
+    csv_path, total_cnt, df_stats = collected
+    session["last_df"] = df_stats
+    session["last_csv"] = csv_path
+    if cancel is not None and cancel.is_cancelled():
+        return "분석이 취소되었습니다."
+    if checkpoint is not None:
+        checkpoint.collect_done = True
+        checkpoint.flush(force=True)
 
     if total_cnt == 0:
         prog_bar.empty()
         return "지정 조건에서 댓글을 찾을 수 없습니다. 다른 조건으로 시도해 보세요."
 
+    # 후속 질문용 댓글 검색 인덱스는 보고서 생성과 겹쳐서 백그라운드로 빌드
+    get_comment_index_registry().build_async(csv_path)
+
     prog_bar.progress(0.90, text="AI 분석중…")
 
     sample_text, sample_cnt, sample_chars, sample_meta = serialize_comments_for_llm_from_file(csv_path)
 
-    st.session_state["sample_text"] = sample_text
-    st.session_state["sample_count"] = sample_cnt
-    st.session_state["sample_chars"] = sample_chars
-    st.session_state["sample_meta"] = sample_meta
+    session["sample_text"] = sample_text
+    session["sample_count"] = sample_cnt
+    session["sample_chars"] = sample_chars
+    session["sample_meta"] = sample_meta
+
+    # 전체 댓글 모드: 샘플과 별도로 전체 댓글 부분 요약(map)을 만들어 보고서 입력에 같이 넣음 (인용은 샘플 원문에서)
+    full_mode = bool(session.get("full_corpus_mode", False))
+    corpus_summary, corpus_meta, t_full = "", {}, time.perf_counter()
+    if full_mode:
+        corpus_summary, corpus_meta = summarize_corpus_map_reduce(csv_path, prog_bar, user_id, cancel)
+        if corpus_summary is None:
+            return "분석이 취소되었습니다."
+    report_prog = 0.97 if full_mode else 0.90
 
     sys = load_first_turn_system_prompt()
 
@@ -2479,7 +6104,9 @@ def run_pipeline_first_turn(user_query: str, extra_video_ids=None, only_these_vi
     analysis_scope_line = (
         f"{sample_cnt:,}개 (추출: 인기댓글 {used_top:,}개 + 랜덤 {used_random:,}개, "
     )
-    st.session_state["analysis_scope_line"] = analysis_scope_line
+    if corpus_summary:
+        analysis_scope_line = f"전체 {corpus_meta['comments']:,}개 부분 요약({corpus_meta['chunks']}개 청크) + 원문 " + analysis_scope_line
+    session["analysis_scope_line"] = analysis_scope_line
 
     metrics_block = (
         "[METRICS]\n"
@@ -2488,25 +6115,50 @@ def run_pipeline_first_turn(user_query: str, extra_video_ids=None, only_these_vi
         f"SAMPLE_RULE=top_like:{used_top}/{sample_meta.get('top_n', 1000)}, random:{used_random}/{sample_meta.get('random_n', 1000)}\n"
         f"LLM_INPUT_LINES={sample_cnt}\n"
         f"LLM_INPUT_CHARS={sample_chars}\n"
+        f"LLM_INPUT_TOKENS_EST={sample_meta.get('llm_input_tokens_est', 'NA')}\n"
         f"ANALYSIS_COMMENT_COUNT_LINE={analysis_scope_line}\n"
     )
+    if corpus_summary:
+        metrics_block += (
+            "ANALYSIS_MODE=full_corpus\n"
+            f"FULL_CORPUS_COMMENTS={corpus_meta['comments']}\n"
+            f"FULL_CORPUS_CHUNKS={corpus_meta['chunks']} (split={corpus_meta['split']}, failed={corpus_meta['failed']})\n"
+        )
 
+    corpus_block = (
+        f"[전체 댓글 부분 요약] (수집 댓글 전체 {corpus_meta['comments']:,}개 기준. 화제 비중/여론 비율은 이 요약을 우선, "
+        f"인용은 아래 [댓글 샘플] 원문 사용):\n{corpus_summary}\n\n"
+    ) if corpus_summary else ""
     large_context_text = (
         f"{metrics_block}\n"
         f"[키워드]: {', '.join(kw_main)}\n"
         f"[기간(KST)]: {schema['start_iso']} ~ {schema['end_iso']}\n\n"
+        f"{corpus_block}"
         f"[댓글 샘플]:\n{sample_text}\n"
     )
     user_query_part = f"[사용자 원본 질문]: {user_query}"
 
-    if "current_cache" in st.session_state:
-        del st.session_state["current_cache"]
-
-    answer_md_raw = call_gemini_smart_cache(
-        GEMINI_MODEL, GEMINI_API_KEYS, sys, user_query_part,
-        large_context_text=large_context_text,
-        cache_key_in_session="current_cache"
-    )
+    if "current_cache" in session:
+        release_gemini_cache(session["current_cache"])
+        del session["current_cache"]
+    # 보고서 호출(가장 비싼 단계) 직전에 한 번 더 → 취소된 잡이 캐시 생성/보고서 생성까지 가지 않게
+    if cancel is not None and cancel.is_cancelled():
+        prog_bar.empty()
+        return "분석이 취소되었습니다."
+
+    t_report = time.perf_counter()
+    with gemini_request_context(GEMINI_PRIO_REPORT, user_id, on_wait=_queue_progress(prog_bar, report_prog)):
+        answer_md_raw = call_gemini_smart_cache(
+            GEMINI_MODEL, GEMINI_API_KEYS, sys, user_query_part,
+            large_context_text=large_context_text,
+            cache_key_in_session="current_cache", session=bg_session, on_chunk=on_chunk
+        )
+    if corpus_summary:
+        corpus_meta.update(report_sec=round(time.perf_counter() - t_report, 2),
+                           wall_sec=round(time.perf_counter() - t_full, 2))
+        print(f"[METRICS] full_corpus comments={corpus_meta['comments']} chunks={corpus_meta['chunks']} "
+              f"map_sec={corpus_meta.get('map_reduce_sec')} report_sec={corpus_meta['report_sec']} wall_sec={corpus_meta['wall_sec']}")
+        _log_full_corpus_run(corpus_meta, user_id)
 
     prog_bar.progress(1.0, text="완료")
     time.sleep(0.5)
@@ -2516,11 +6168,242 @@ def run_pipeline_first_turn(user_query: str, extra_video_ids=None, only_these_vi
     return tidy_answer(answer_md_raw)
 
 
+# 이전 대화를 가리키는 질문("그럼 그건 왜?", "좀 더 자세히")은 직전 질문까지 키에 넣음
+_FOLLOWUP_REF_RE = re.compile(r"그거|그것|그건|그게|그럼|그러면|그래서|방금|아까|위에서|위의|앞에서|앞의|이어서|좀\s*더|더\s*자세히")
+
+def _normalize_followup_question(q: str) -> str:
+    q = _normalize_search_keyword(strip_urls(q))
+    return re.sub(r"[\s?!.,~…]+", " ", q).strip()
+
+
+class FollowupAnswerCache:
+    """후속 질문 답변 캐시. 프로세스 전역 LRU + Mongo(TTL) ytcc_followup_answers.
+    키 = (컨텍스트 해시, 정규화 질문, 최근 대화 digest). 최근 대화는 질문이 앞 대화를 가리킬 때만 포함
+    (어시스턴트 답변은 매번 달라서 넣으면 같은 질문도 절대 안 맞음)."""
+    def __init__(self, max_items: int = FOLLOWUP_ANSWER_CACHE_MEM_ITEMS, ttl_hours: int = FOLLOWUP_ANSWER_CACHE_TTL_HOURS):
+        self.max_items = max(1, int(max_items))
+        self.ttl_sec = ttl_hours * 3600
+        self._lock = threading.Lock()
+        self._mem = OrderedDict()   # key -> (expires_at, answer)
+        self._indexed = False
+        self.stats = {"mem": 0, "mongo": 0, "miss": 0}
+
+    @staticmethod
+    def context_hash(session) -> str:
+        # 1차 분석 때 만든 Gemini 캐시 해시가 있으면 그대로, 없으면(불러온 세션 등) 스키마+샘플로 계산
+        h = (session.get("current_cache") or {}).get("hash")
+        if h:
+            return h
+        ctx = session.get("sample_text_full_context") or session.get("sample_text") or ""
+        return gemini_context_hash(GEMINI_MODEL, json.dumps(session.get("last_schema") or {}, ensure_ascii=False,
+                                                            sort_keys=True, default=str), ctx)
+
+    @staticmethod
+    def make_key(context_hash, question, chat) -> str:
+        digest = ""
+        if _FOLLOWUP_REF_RE.search(question or ""):
+            prev = [m.get("content", "") for m in (chat or []) if m.get("role") == "user"][-1:]
+            digest = hashlib.sha1(_normalize_followup_question(prev[0] if prev else "").encode("utf-8")).hexdigest()
+        raw = json.dumps([context_hash, _normalize_followup_question(question), digest], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _coll(self):
+        try:
+            coll = _mongo_aux_coll("followup_answer_coll", "ytcc_followup_answers")
+        except Exception:
+            return None
+        if coll is not None and not self._indexed:
+            try:
+                from pymongo import ASCENDING  # type: ignore
+                coll.create_index([("expiresAt", ASCENDING)], expireAfterSeconds=0)
+            except Exception:
+                pass
+            self._indexed = True
+        return coll
+
+    def _remember(self, key, expires_at, answer):
+        with self._lock:
+            self._mem[key] = (expires_at, answer)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_items:
+                self._mem.popitem(last=False)
+
+    def _count(self, kind):
+        with self._lock:
+            self.stats[kind] += 1
+            total = sum(self.stats.values())
+            hits = self.stats["mem"] + self.stats["mongo"]
+        print(f"[METRICS] followup_answer_cache result={kind} hits={hits} total={total} hit_rate={hits / total:.2f}")
+
+    def get(self, key):
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit and hit[0] > time.time():
+                self._mem.move_to_end(key)
+                answer = hit[1]
+            else:
+                answer = None
+                self._mem.pop(key, None)
+        if answer is not None:
+            self._count("mem")
+            return answer
+        coll = self._coll()
+        doc = None
+        if coll is not None:
+            try:
+                doc = coll.find_one({"_id": key})
+            except Exception as e:
+                print(f"⚠️ [followup cache] load failed: {e}")
+        if not doc or not doc.get("expiresAt") or doc["expiresAt"] <= datetime.utcnow() or not doc.get("answer"):
+            self._count("miss")
+            return None
+        remain = (doc["expiresAt"] - datetime.utcnow()).total_seconds()
+        self._remember(key, time.time() + remain, doc["answer"])
+        self._count("mongo")
+        return doc["answer"]
+
+    def put(self, key, answer, question="", context_hash=""):
+        # 에러/차단 안내문은 캐시하지 않음
+        if not answer or answer.startswith(("⚠️", "오류")):
+            return
+        self._remember(key, time.time() + self.ttl_sec, answer)
+        coll = self._coll()
+        if coll is None:
+            return
+        now = datetime.utcnow()
+        try:
+            coll.update_one({"_id": key}, {"$set": {
+                "answer": answer, "question": question, "context_hash": context_hash,
+                "createdAt": now, "expiresAt": now + timedelta(seconds=self.ttl_sec),
+            }}, upsert=True)
+        except Exception as e:
+            print(f"⚠️ [followup cache] save failed: {e}")
+
+
+@st.cache_resource
+def get_followup_answer_cache() -> FollowupAnswerCache:
+    return FollowupAnswerCache()
+
+
+FOLLOWUP_SUMMARY_PROMPT = (
+    "아래는 유튜브 댓글 분석 챗봇과 사용자의 이전 대화(앞에 [기존 요약]이 있으면 그것까지)다. "
+    "다음 질문에 답할 때 참고할 수 있게 한국어 평문 요약 하나로 합쳐라.\n"
+    "- 사용자가 물어본 것과, 답변의 핵심 결론/수치/인물/화제만 남김 (인용 댓글 원문, 표, 꾸밈말은 뺌)\n"
+    "- 1,500자 이내, HTML/마크다운 없이"
+)
+
+
+def _compact_message_text(content: str, max_tokens: int = FOLLOWUP_MESSAGE_MAX_TOKENS) -> str:
+    """채팅 메시지 → 후속 질문 payload용 평문. 1차 보고서 HTML의 표는 'a | b' 줄로, 나머지 태그는 제거하고
+    추정 토큰이 max_tokens를 넘으면 뒤를 자름."""
+    s = re.sub(r"<\s*(style|script)[^>]*>.*?<\s*/\s*\1\s*>", "", content or "", flags=re.I | re.S)
+    s = re.sub(r"</\s*t[dh]\s*>", " | ", s, flags=re.I)
+    s = re.sub(r"</\s*(tr|h[1-6]|div)\s*>", "\n", s, flags=re.I)
+    s = _strip_html_to_text(s)
+    s = re.sub(r"[ \t]+", " ", s)
+    s = re.sub(r"\s*\|\s*(?=\n|$)", "", s)
+    s = re.sub(r"\n\s*\n+", "\n", s).strip()
+    n = get_token_estimator().estimate(s)
+    if n > max_tokens:
+        s = s[:int(len(s) * max_tokens / n)].rstrip() + " …(생략)"
+    return s
+
+
+def _followup_history_lines(messages) -> str:
+    return "\n".join(f"[이전 {'Q' if m['role'] == 'user' else 'A'}]: {_compact_message_text(m['content'])}" for m in messages)
+
+
+def build_followup_context(chat, session=None) -> str:
+    """후속 질문 payload의 이전 대화 부분: [이전 대화 요약] + 아직 요약에 안 접힌 메시지(평문).
+    chat은 현재 질문을 뺀 대화. 요약이 FOLLOWUP_SUMMARY_BATCH 단위로 접히므로 길이가 대략 일정."""
+    session = st.session_state if session is None else session
+    upto = min(int(session.get("followup_summary_upto", 0) or 0), len(chat))
+    summary = session.get("followup_summary") or ""
+    # 요약이 없는데(불러온 세션 등) 창 밖 메시지가 있으면 최근 창만
+    start = upto if summary else max(0, len(chat) - FOLLOWUP_RECENT_MESSAGES)
+    parts = [f"[이전 대화 요약]: {summary}"] if summary else []
+    if chat[start:]:
+        parts.append(_followup_history_lines(chat[start:]))
+    return "\n".join(parts)
+
+
+def update_followup_summary(chat, session=None, user_id=None):
+    """창(FOLLOWUP_RECENT_MESSAGES) 밖으로 밀린 메시지가 FOLLOWUP_SUMMARY_BATCH개 이상이면 rolling 요약에 접어 넣음.
+    다음 턴 payload용, start_followup_summary가 백그라운드 스레드에서 호출. 요약 호출이 실패하면 질문 목록만 남김."""
+    session = st.session_state if session is None else session
+    upto = int(session.get("followup_summary_upto", 0) or 0)
+    cut = len(chat) - FOLLOWUP_RECENT_MESSAGES
+    if cut - upto < FOLLOWUP_SUMMARY_BATCH:
+        return
+    prev = session.get("followup_summary") or ""
+    old = chat[upto:cut]
+    body = _followup_history_lines(old)
+    t0 = time.perf_counter()
+    summary = None
+    try:
+        with gemini_request_context(GEMINI_PRIO_FOLLOWUP, user_id):
+            summary = call_gemini_rotating(GEMINI_MODEL, GEMINI_API_KEYS, FOLLOWUP_SUMMARY_PROMPT,
+                                           f"[기존 요약]: {prev}\n\n{body}" if prev else body, max_tokens=1024)
+    except Exception as e:
+        print(f"⚠️ [followup summary] failed: {e}")
+    if not summary or summary.startswith("⚠️"):
+        summary = "\n".join([prev] * bool(prev) + [f"- 이전 질문: {m['content'][:200]}" for m in old if m["role"] == "user"])
+    summary = _compact_message_text(summary, FOLLOWUP_SUMMARY_MAX_TOKENS)
+    session["followup_summary"] = summary
+    session["followup_summary_upto"] = cut
+    print(f"[METRICS] followup_summary folded={len(old)} upto={cut} "
+          f"tokens_est={get_token_estimator().estimate(summary)} ms={(time.perf_counter() - t0) * 1000:.0f}")
+
+
+def start_followup_summary(chat, user_id=None):
+    """접을 메시지가 쌓였으면 update_followup_summary를 백그라운드 스레드로 (답변을 채팅에 붙이고 rerun하는 걸 막지 않게).
+    스레드는 세션 사본에만 쓰고, 결과는 다음 턴 시작 때 apply_followup_summary가 세션에 반영. 이미 접는 중이면 건너뜀."""
+    pending = st.session_state.get("followup_summary_pending")
+    if pending is not None and not pending["done"].is_set():
+        return
+    upto = int(st.session_state.get("followup_summary_upto", 0) or 0)
+    if len(chat) - FOLLOWUP_RECENT_MESSAGES - upto < FOLLOWUP_SUMMARY_BATCH:
+        return
+    snap = {"followup_summary": st.session_state.get("followup_summary") or "", "followup_summary_upto": upto}
+    done = threading.Event()
+
+    def _run():
+        try:
+            update_followup_summary(list(chat), session=snap, user_id=user_id)
+        finally:
+            done.set()
+
+    st.session_state["followup_summary_pending"] = {"base": upto, "session": snap, "done": done}
+    threading.Thread(target=_run, name="followup-summary", daemon=True).start()
+
+
+def apply_followup_summary(session=None):
+    """끝난 백그라운드 요약을 세션에 반영 (아직 접는 중이면 그대로 → 안 접힌 메시지는 평문으로 payload에 들어감).
+    그 사이 세션을 불러오는 등으로 요약 기준이 바뀌었으면 버림."""
+    session = st.session_state if session is None else session
+    pending = session.get("followup_summary_pending")
+    if pending is None or not pending["done"].is_set():
+        return
+    session.pop("followup_summary_pending", None)
+    if int(session.get("followup_summary_upto", 0) or 0) == pending["base"]:
+        session.update(pending["session"])
+
+
 def run_followup_turn(user_query: str):
     if not (schema := st.session_state.get("last_schema")):
         return "오류: 이전 분석 기록이 없습니다. 새 채팅을 시작해주세요."
 
-    context = "\n".join(f"[이전 {'Q' if m['role'] == 'user' else 'A'}]: {m['content']}" for m in st.session_state["chat"][-10:])
+    answer_cache = get_followup_answer_cache() if FOLLOWUP_ANSWER_CACHE_ENABLED else None
+    if answer_cache is not None:
+        ctx_hash = answer_cache.context_hash(st.session_state)
+        cache_key = answer_cache.make_key(ctx_hash, user_query, st.session_state["chat"][:-1])
+        if (cached := answer_cache.get(cache_key)) is not None:
+            return cached
+
+    # 이전 대화는 HTML을 걷어낸 평문 + 오래된 턴은 rolling 요약 (턴이 쌓여도 payload 크기가 거의 일정)
+    apply_followup_summary()
+    history = st.session_state["chat"][:-1]
+    context = build_followup_context(history)
 
     followup_instruction = (
         "🛑 [지시사항 변경] 🛑\n"
@@ -2529,24 +6412,271 @@ def run_followup_turn(user_query: str):
         "이전의 요약 미션은 잊어. 오직 아래 [현재 질문]에만 집중해서 답해.\n\n"
         "=== 답변 전략 ===\n"
         "1. 질문의 의도(속성/대상)를 먼저 파악해라.(파악한 의도는 답변을 위한 내부 지침으로만 활용하고, 사용자에게 보여주지 않아도 된다)\n"
-        "2. 네 기억 속에 있는 [댓글 샘플]에서 그와 관련된 구체적인 증거(댓글)를 찾아라.\n"
+        "2. 네 기억 속에 있는 [댓글 샘플]과 아래 [관련 댓글](전체 수집 댓글 검색 결과)에서 그와 관련된 구체적인 증거(댓글)를 찾아라.\n"
         "3. 증거 댓글은 눈에 잘 띄도록 반드시 `<div class='quote'>댓글 내용</div>` 태그로 감싸서 출력해라.\n"
         "4. 질문과 관련 없는 TMI(다른 배우, 다른 이슈 등)는 절대 말하지 마라.\n"
         "5. 만약 관련 내용이 데이터에 없으면 '데이터에서 확인되지 않는다'고 딱 잘라 말해라.\n"
     )
 
+    related = retrieve_followup_comments(user_query, history)
+    related_block = (
+        f"[관련 댓글] (전체 수집 댓글에서 질문 관련도 순 상위 {len(related)}개):\n" + "\n".join(related) + "\n\n"
+    ) if related else ""
+
     user_payload = (
         f"{followup_instruction}\n\n"
         f"{context}\n\n"
+        f"{related_block}"
         f"[현재 질문]: {user_query}\n"
         f"[기간(KST)]: {schema.get('start_iso', '?')} ~ {schema.get('end_iso', '?')}\n"
     )
 
-    with st.spinner("💬 답변 생성 중... "):
-        response_raw = call_gemini_smart_cache(GEMINI_MODEL, GEMINI_API_KEYS, "", user_payload, large_context_text=None)
+    # 답변은 스트리밍으로 받아서 말풍선에 바로바로 그림 (끝나면 rerun → render_chat이 최종본을 다시 그림)
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
+        placeholder.markdown("💬 답변 생성 중... ")
+        view = StreamingAnswerView(placeholder)
+        on_wait = lambda pos, eta: placeholder.markdown(
+            f"💬 AI 대기열 {pos}번째 · 예상 대기 약 {eta:.0f}초" if pos else "💬 답변 생성 중... ")
+        with gemini_request_context(GEMINI_PRIO_FOLLOWUP, _job_owner_id(), on_wait=on_wait):
+            response_raw = call_gemini_smart_cache(GEMINI_MODEL, GEMINI_API_KEYS, "", user_payload, large_context_text=None,
+                                                   on_chunk=view.feed)
         response = tidy_answer(response_raw)
 
+    print(f"[METRICS] followup_payload tokens_est={get_token_estimator().estimate(user_payload)} "
+          f"history_messages={len(history)}")
+    if answer_cache is not None:
+        answer_cache.put(cache_key, response, question=user_query, context_hash=ctx_hash)
+    # 다음 턴용 요약 갱신은 백그라운드로 (답변은 바로 채팅에 붙고 rerun)
+    start_followup_summary(st.session_state["chat"] + [{"role": "assistant", "content": response}],
+                           user_id=_job_owner_id())
     return response
+
+
+# ---- 1차 분석 백그라운드 잡 ----
+# 스크립트 재실행/새로고침/웹소켓 끊김과 무관하게 수집·분석을 계속하고, 다음 실행에서 다시 붙음.
+# 진행 상황(영상별 page token, 기록 건수)은 Mongo에 남겨서 프로세스가 죽어도 이어서 재개.
+def _first_turn_job_coll():
+    coll = _mongo_aux_coll("first_turn_jobs_coll", "ytcc_first_turn_jobs")
+    if coll is None:
+        return None
+    from pymongo import ASCENDING  # type: ignore
+    _mongo_aux_ensure_indexes("first_turn_jobs_coll", coll, [
+        ([("expiresAt", ASCENDING)], {"expireAfterSeconds": 0}),
+        ([("user_id", ASCENDING), ("status", ASCENDING)], {}),
+    ], "first turn job")
+    return coll
+
+def _job_owner_id() -> str:
+    """잡 소유자 = 로그인 사용자 ID (비로그인은 세션마다 임시 ID → 새로고침 후 재부착 불가)."""
+    return st.session_state.get("auth_user_id") or st.session_state.setdefault("_job_owner", f"anon:{uuid4().hex}")
+
+
+class JobProgressBar:
+    """st.progress 대용 (progress(value, text=) / empty()). 값은 잡에 저장 → UI가 폴링해서 그림."""
+    def __init__(self, job):
+        self.job = job
+
+    def progress(self, value, text=None):
+        self.job.progress_value = max(0.0, min(1.0, float(value)))
+        if text is not None:
+            self.job.progress_text = text
+
+    def empty(self):
+        pass
+
+
+class FirstTurnJob:
+    # 완료 후 세션으로 옮길 키 (잡 전용 session dict → st.session_state)
+    SESSION_KEYS = ("last_schema", "last_df", "last_csv", "sample_text", "sample_count", "sample_chars",
+                    "sample_meta", "analysis_scope_line", "current_cache", "sample_text_full_context")
+
+    def __init__(self, user_id, query, extra_video_ids=None, only_these_videos=False, own_ip_mode=False,
+                 job_id=None, state=None, full_corpus_mode=False):
+        self.job_id = job_id or uuid4().hex
+        self.user_id = user_id
+        self.query = query
+        self.extra_video_ids = list(extra_video_ids or [])
+        self.only_these_videos = bool(only_these_videos)
+        self.own_ip_mode = bool(own_ip_mode)
+        self.full_corpus_mode = bool(full_corpus_mode)
+        self.session = {"own_ip_mode": self.own_ip_mode, "full_corpus_mode": self.full_corpus_mode}
+        self.progress_value, self.progress_text = 0.0, "준비 중…"
+        self.status = "running"
+        self.answer = None
+        self.answer_tidier = AnswerTidier()   # 스트리밍 중인 보고서 (UI가 폴링해서 그림)
+        self.cancel_token = CollectCancelToken()
+        self.checkpoint = FirstTurnCheckpoint(state, persist=lambda snap: self._save({"checkpoint": snap}))
+        self._done = threading.Event()
+
+    def _save(self, fields: dict, insert: bool = False):
+        coll = _first_turn_job_coll()
+        if coll is None:
+            return
+        now = datetime.utcnow()
+        doc = {**fields, "heartbeat": now, "expiresAt": now + timedelta(hours=FIRST_TURN_JOB_TTL_HOURS)}
+        if insert:
+            doc.update({"user_id": self.user_id, "query": self.query, "extra_video_ids": self.extra_video_ids,
+                        "only_these_videos": self.only_these_videos, "own_ip_mode": self.own_ip_mode,
+                        "full_corpus_mode": self.full_corpus_mode,
+                        "status": self.status, "createdAt": now})
+        try:
+            coll.update_one({"_id": self.job_id}, {"$set": doc}, upsert=True)
+        except Exception as e:
+            print(f"⚠️ [first turn job] save failed: {e}")
+
+    def start(self, insert: bool = True):
+        if insert:
+            self._save({"checkpoint": self.checkpoint.snapshot()}, insert=True)
+        threading.Thread(target=self._run, name=f"first-turn-{self.job_id[:8]}", daemon=True).start()
+        threading.Thread(target=self._heartbeat, name=f"first-turn-hb-{self.job_id[:8]}", daemon=True).start()
+        return self
+
+    def _heartbeat(self):
+        while not self._done.wait(FIRST_TURN_JOB_HEARTBEAT_SEC):
+            self._save({"progress": self.progress_value, "progress_text": self.progress_text})
+
+    def _run(self):
+        try:
+            self.answer = run_pipeline_first_turn(
+                self.query, extra_video_ids=self.extra_video_ids, only_these_videos=self.only_these_videos,
+                session=self.session, prog_bar=JobProgressBar(self), user_id=self.user_id,
+                checkpoint=self.checkpoint, cancel=self.cancel_token, on_chunk=self._on_answer_chunk)
+            self.status = "cancelled" if self.cancel_token.is_cancelled() else "done"
+        except Exception as e:
+            print(f"⚠️ [first turn job] {self.job_id} failed: {e}")
+            self.answer = f"⚠️ [시스템] 처리 중 에러: {e}"
+            self.status = "error"
+        finally:
+            if self.cancel_token.is_cancelled():
+                # 취소된 잡의 세션은 아무 데도 안 옮겨지므로 여기서 캐시 참조 반납
+                release_gemini_cache(self.session.pop("current_cache", None))
+            self.checkpoint.flush(force=True)
+            self._save({"status": self.status, "progress": 1.0})
+            self._done.set()
+            gc.collect()
+
+    def _on_answer_chunk(self, delta):
+        self.answer_tidier.feed(delta)
+        self.progress_text = "AI 보고서 작성 중…"
+
+    def cancel(self):
+        self.cancel_token.cancel("user")
+
+    def finished(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout=None) -> bool:
+        return self._done.wait(timeout)
+
+    def session_updates(self) -> dict:
+        return {k: self.session[k] for k in self.SESSION_KEYS if k in self.session}
+
+
+class FirstTurnJobRegistry:
+    """프로세스 전역 잡 목록 (사용자당 진행 중 1개). 재실행된 스크립트가 user_id로 다시 찾아 붙음."""
+    def __init__(self):
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """이 사용자의 (아직 결과를 안 가져간) 잡. 메모리에 없으면 하트비트가 끊긴 DB 잡을 이어받아 재개."""
+        with self._lock:
+            job = self._by_user.get(user_id)
+            if job is None:
+                job = self._claim_stale(user_id)
+                if job is not None:
+                    self._by_user[user_id] = job.start(insert=False)
+            return job
+
+    def start(self, user_id, query, extra_video_ids=None, only_these_videos=False, own_ip_mode=False,
+              full_corpus_mode=False):
+        with self._lock:
+            job = self._by_user.get(user_id)
+            if job is None:
+                job = FirstTurnJob(user_id, query, extra_video_ids, only_these_videos, own_ip_mode,
+                                   full_corpus_mode=full_corpus_mode)
+                self._by_user[user_id] = job.start()
+            return job
+
+    def release(self, job):
+        """결과를 세션으로 옮긴 뒤 호출. 이후 재부착/재개 대상에서 빠짐."""
+        with self._lock:
+            if self._by_user.get(job.user_id) is job:
+                del self._by_user[job.user_id]
+        job._save({"status": "delivered"})
+
+    def cancel_for(self, user_id):
+        with self._lock:
+            job = self._by_user.pop(user_id, None)
+        if job is not None:
+            job.cancel()
+            job._save({"status": "cancelled"})
+
+    def _claim_stale(self, user_id):
+        coll = _first_turn_job_coll()
+        if coll is None:
+            return None
+        now = datetime.utcnow()
+        try:
+            # 하트비트 갱신을 조건부 업데이트로 해서 여러 레플리카 중 하나만 이어받음
+            doc = coll.find_one_and_update(
+                {"user_id": user_id, "status": "running",
+                 "heartbeat": {"$lt": now - timedelta(seconds=FIRST_TURN_JOB_STALE_SEC)}},
+                {"$set": {"heartbeat": now}})
+        except Exception as e:
+            print(f"⚠️ [first turn job] claim failed: {e}")
+            return None
+        if not doc:
+            return None
+        print(f"[first turn job] resume {doc['_id']} rows_written={(doc.get('checkpoint') or {}).get('rows_written', 0)}")
+        return FirstTurnJob(user_id, doc.get("query", ""), doc.get("extra_video_ids"), doc.get("only_these_videos"),
+                            doc.get("own_ip_mode"), job_id=doc["_id"], state=doc.get("checkpoint"),
+                            full_corpus_mode=doc.get("full_corpus_mode", False))
+
+
+@st.cache_resource
+def get_first_turn_jobs() -> FirstTurnJobRegistry:
+    return FirstTurnJobRegistry()
+
+
+def run_first_turn_job(user_query: str, extra_video_ids=None, only_these_videos: bool = False) -> str:
+    """1차 분석을 백그라운드 잡으로 시작(또는 진행 중인 잡에 재부착)하고 끝날 때까지 진행률만 그림.
+    이 스크립트 실행이 중간에 끊겨도 잡은 계속 돌고, 다음 실행에서 같은 잡에 다시 붙음."""
+    jobs = get_first_turn_jobs()
+    owner = _job_owner_id()
+    job = jobs.get(owner)
+    if job is not None and job.query != user_query:
+        # 진행 중 잡과 다른 질문이 새로 들어옴 → 최신 질문 우선
+        jobs.cancel_for(owner)
+        job = None
+    job = job or jobs.start(owner, user_query, extra_video_ids, only_these_videos,
+                            bool(st.session_state.get("own_ip_mode", False)),
+                            full_corpus_mode=bool(st.session_state.get("full_corpus_mode", False)))
+    prog_bar = st.progress(job.progress_value, text=job.progress_text)
+    answer_box, shown = None, ""
+    while not job.wait(0.3 if answer_box is None else GEMINI_STREAM_RENDER_SEC):
+        prog_bar.progress(job.progress_value, text=job.progress_text)
+        # 보고서가 스트리밍되기 시작하면 말풍선에 지금까지 받은 부분을 그림
+        partial = job.answer_tidier.text
+        if partial and partial != shown:
+            answer_box = answer_box or st.chat_message("assistant").empty()
+            render_message_content(partial, "assistant", target=answer_box)
+            shown = partial
+    prog_bar.empty()
+    st.session_state.update(job.session_updates())
+    jobs.release(job)
+    return job.answer or ""
+
+
+def reattach_first_turn_job():
+    """새로고침 등으로 대화가 비어 있는데 진행 중인 잡이 있으면 그 질문을 복원해서 다시 붙음."""
+    if st.session_state.chat or not st.session_state.get("auth_user_id"):
+        return
+    job = get_first_turn_jobs().get(_job_owner_id())
+    if job is not None:
+        st.session_state.chat = [{"role": "user", "content": job.query}]
+
 # endregion
 
 
@@ -2584,6 +6714,8 @@ with st.sidebar:
         st.markdown('<div style="border-bottom:1px solid #efefef; margin-bottom:12px; margin-top:2px;"></div>', unsafe_allow_html=True)
 
     if st.button("＋ 새 분석 시작", type="primary", use_container_width=True):
+        get_first_turn_jobs().cancel_for(_job_owner_id())
+        release_gemini_cache(st.session_state.get("current_cache"))
         _reset_chat_only(keep_auth=True)
         st.rerun()
     
@@ -2660,6 +6792,41 @@ with st.sidebar:
         except Exception as e: 
             st.error(f"Error: {e}")
             
+    if st.session_state.get("auth_role") == "admin":
+        with st.expander("해석기 벤치마크", expanded=False):
+            bench_live = st.checkbox("Gemini 실측 포함", key="light_bench_live")
+            if st.button("실행", key="light_bench_run", use_container_width=True):
+                with st.spinner("로컬 해석기 / Gemini 비교 중..."):
+                    bench_summary, bench_rows = benchmark_light_parser(live=bench_live)
+                st.caption(" · ".join(f"{k}={v}" for k, v in bench_summary.items()))
+                if not bench_rows.empty:
+                    st.dataframe(bench_rows, use_container_width=True, hide_index=True)
+        with st.expander("토큰 추정 보정", expanded=False):
+            st.caption(f"현재 배율 {get_token_estimator().scale:.3f} · 현재 세션 샘플로 count_tokens 실측")
+            if st.button("보정 실행", key="token_calib_run", use_container_width=True,
+                         disabled=not st.session_state.get("sample_text")):
+                calib_lines = st.session_state["sample_text"].splitlines()
+                calib_step = max(1, len(calib_lines) // 20)
+                calib_texts = ["\n".join(calib_lines[i:i + calib_step]) for i in range(0, len(calib_lines), calib_step)][:20]
+                with st.spinner("count_tokens 실측 중..."):
+                    calib_summary = calibrate_token_estimator(calib_texts)
+                st.caption(" · ".join(f"{k}={v}" for k, v in calib_summary.items()))
+        with st.expander("댓글 검색 인덱스 벤치마크", expanded=False):
+            st.caption("현재 세션 수집 댓글로 12만 건 기준 빌드/검색 시간 측정")
+            if st.button("실행", key="comment_index_bench_run", use_container_width=True,
+                         disabled=not st.session_state.get("last_csv")):
+                with st.spinner("인덱스 빌드 중..."):
+                    idx_summary, idx_rows = benchmark_comment_index(st.session_state["last_csv"])
+                st.caption(" · ".join(f"{k}={v}" for k, v in idx_summary.items()))
+                if not idx_rows.empty:
+                    st.dataframe(idx_rows, use_container_width=True, hide_index=True)
+        with st.expander("전체 댓글 모드 실행 기록", expanded=False):
+            if st.button("불러오기", key="full_corpus_bench_run", use_container_width=True):
+                fc_summary, fc_rows = benchmark_full_corpus()
+                st.caption(" · ".join(f"{k}={v}" for k, v in fc_summary.items()))
+                if not fc_rows.empty:
+                    st.dataframe(fc_rows, use_container_width=True, hide_index=True)
+
     st.markdown("""
         <div style="margin-top:auto; padding-top:1rem; font-size:0.9rem; color:#6b7280; text-align:center;">
             Media) Marketing Team - Data Insight Part<br>Powered by Gemini
@@ -2667,6 +6834,8 @@ with st.sidebar:
     """, unsafe_allow_html=True)
 
 
+reattach_first_turn_job()
+
 if not st.session_state.chat:
     st.markdown(
         """
@@ -2724,6 +6893,12 @@ if not st.session_state.chat:
                     
         st.session_state["own_ip_toggle_prev"] = cur_toggle
 
+        st.toggle(
+            "📚 전체 댓글 분석",
+            key="full_corpus_mode",
+            help="샘플(인기 1,000 + 랜덤 1,000) 대신 수집한 댓글 전체를 나눠 요약한 뒤 보고서를 작성합니다. 댓글이 많을수록 오래 걸립니다.",
+        )
+
 else:
     render_metadata_and_downloads()
     render_chat()
@@ -2741,12 +6916,13 @@ if st.session_state.chat and st.session_state.chat[-1]["role"] == "user":
     has_natural = len(natural_text) > 0
 
     if not st.session_state.get("last_csv"):
+        # 1차 분석은 백그라운드 잡으로 실행 (새로고침/재실행되어도 이어서 진행)
         if has_urls and not has_natural:
-            response = run_pipeline_first_turn(user_query, extra_video_ids=url_ids, only_these_videos=True)
+            response = run_first_turn_job(user_query, extra_video_ids=url_ids, only_these_videos=True)
         elif has_urls and has_natural:
-            response = run_pipeline_first_turn(user_query, extra_video_ids=url_ids, only_these_videos=False)
+            response = run_first_turn_job(user_query, extra_video_ids=url_ids, only_these_videos=False)
         else:
-            response = run_pipeline_first_turn(user_query)
+            response = run_first_turn_job(user_query)
     else:
         response = run_followup_turn(user_query)
 